@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+'''Mirror of the account state (fills, positions, account values and
+order status) kept up to date with the events of ib_insync. The tables
+are indexed by orderId, conId and account, then the state of orders is
+read from memory without requests to TWS.
+
+The events of fills and order status are sent by TWS to the client that
+placed the order (or to the master API client of TWS settings). The
+orders of other clients (backtrader IBStore, TWS) are read with the
+executions and open orders of all clients requested by 'sync'.
+'''
+
+import time
+
+import pandas as pd
+from ib_insync import util, OrderStatus, ExecutionFilter
+
+import datacache as dc
+
+# Status of orders not done
+ACTIVE_STATES = tuple(sorted(OrderStatus.ActiveStates))
+
+# Seconds between the requests of executions and orders of all clients
+SYNC_INTERVAL = 10.
+
+class AccountMirror(object):
+    '''Account state of an ib_insync connection. The tables are filled with
+    the state already received by ib_insync and updated by the events
+    execDetails, commissionReport, position, accountValue and orderStatus.
+
+    Parameters:
+
+      - ib
+
+      Connected ib_insync IB object
+
+      - account (default: '')
+
+      Account number. If empty the state of all accounts is kept
+
+      - sync_interval (default: SYNC_INTERVAL)
+
+      Seconds between the requests of executions and open orders of all
+      clients sent by 'poll' after 'start'. If None only 'sync' requests
+      them
+    '''
+
+    def __init__(self, ib, account='', sync_interval=SYNC_INTERVAL):
+        self.ib = ib
+        self.account = account or ''
+        self.sync_interval = sync_interval
+        # Time of last request of all clients and request in progress
+        self._synced = None
+        self._syncing = None
+
+        # Fills by execId, execIds by orderId and by conId
+        self.fills = dict()
+        self._order_fills = dict()
+        self._contract_fills = dict()
+        # Positions by (account, conId) and by conId and account
+        self.positions = dict()
+        self._contract_positions = dict()
+        # Account values by (account, tag, currency) and by (tag, currency)
+        self.values = dict()
+        self._tag_values = dict()
+        # Trades (order and status) by orderId
+        self.trades = dict()
+
+        # Snapshots are rebuilt only when the table changed
+        self._versions = {'fills':0, 'positions':0, 'values':0, 'trades':0}
+        self._snapshots = dict()
+
+        for trade in ib.trades():
+            self.on_status(trade)
+        for fill in ib.fills():
+            self._add_fill(fill)
+        for position in ib.positions():
+            self.on_position(position)
+        for value in ib.accountValues():
+            self.on_value(value)
+
+        ib.execDetailsEvent += self.on_fill
+        ib.commissionReportEvent += self.on_commission
+        ib.positionEvent += self.on_position
+        ib.accountValueEvent += self.on_value
+        ib.orderStatusEvent += self.on_status
+
+    def close(self):
+        '''Stop updating the tables.
+        '''
+        if self._syncing is not None:
+            self._syncing.cancel()
+        self.ib.execDetailsEvent -= self.on_fill
+        self.ib.commissionReportEvent -= self.on_commission
+        self.ib.positionEvent -= self.on_position
+        self.ib.accountValueEvent -= self.on_value
+        self.ib.orderStatusEvent -= self.on_status
+
+    async def start_async(self):
+        '''Read the executions and open orders of all clients, then 'poll'
+        requests them again every sync_interval seconds.
+        '''
+        await self.sync_async()
+
+    def start(self):
+        '''Blocking version of start_async.
+        '''
+        self.ib.run(self.start_async())
+
+    async def sync_async(self):
+        '''Request the executions of the day and the open orders of all
+        clients of the account. The fills and orders not received by events
+        are added to the tables.
+        '''
+        self._synced = time.monotonic()
+        fills = await self.ib.reqExecutionsAsync(ExecutionFilter(
+            acctCode=self.account))
+        for fill in fills:
+            self._add_fill(fill)
+        trades = await self.ib.reqAllOpenOrdersAsync()
+        for trade in trades:
+            self.on_status(trade)
+
+    def sync(self):
+        '''Blocking version of sync_async.
+        '''
+        self.ib.run(self.sync_async())
+
+    def poll(self):
+        '''Process the messages already received from TWS. It doesn't wait
+        for new messages and it does nothing inside the event loop. After
+        start the requests of all clients are sent every sync_interval
+        seconds, their answers are processed by the next polls.
+        '''
+        if self._synced is not None and self.sync_interval is not None and \
+                (self._syncing is None or self._syncing.done()) and \
+                time.monotonic() - self._synced >= self.sync_interval:
+            self._syncing = util.getLoop().create_task(self.sync_async())
+        if not util.getLoop().is_running():
+            self.ib.sleep(0)
+
+    def _accepted(self, account):
+        return not self.account or account == self.account
+
+    def _add_fill(self, fill):
+        execution = fill.execution
+        if not self._accepted(execution.acctNumber):
+            return
+        if execution.execId not in self.fills:
+            self._order_fills.setdefault(execution.orderId, []).append(
+                    execution.execId)
+            self._contract_fills.setdefault(fill.contract.conId, []).append(
+                    execution.execId)
+        elif self.fills[execution.execId] is fill:
+            return
+        self.fills[execution.execId] = fill
+        self._versions['fills'] += 1
+
+    # Events of ib_insync
+
+    def on_fill(self, trade, fill):
+        self._add_fill(fill)
+        self.on_status(trade)
+
+    def on_commission(self, trade, fill, report):
+        if fill.execution.execId in self.fills:
+            self._versions['fills'] += 1
+
+    def on_position(self, position):
+        if not self._accepted(position.account):
+            return
+        conId = position.contract.conId
+        self.positions[(position.account, conId)] = position
+        self._contract_positions.setdefault(conId, dict())[
+                position.account] = position
+        self._versions['positions'] += 1
+
+    def on_value(self, value):
+        if not self._accepted(value.account):
+            return
+        self.values[(value.account, value.tag, value.currency)] = value
+        self._tag_values[(value.tag, value.currency)] = value
+        self._versions['values'] += 1
+
+    def on_status(self, trade):
+        if not self._accepted(trade.order.account):
+            return
+        self.trades[trade.order.orderId] = trade
+        self._versions['trades'] += 1
+
+    # Lookups
+
+    def order_fills(self, orderId):
+        '''Return the fills (ib_insync Fill) of the order.
+        '''
+        return [self.fills[execId]
+                for execId in self._order_fills.get(orderId, [])]
+
+    def last_fill(self, conId):
+        '''Return the last fill of the contract or None.
+        '''
+        execIds = self._contract_fills.get(conId)
+        if not execIds:
+            return None
+        return self.fills[execIds[-1]]
+
+    def position(self, conId, account=None):
+        '''Return the signed size of the position of the contract (0. if
+        there is no position). Without account the positions of all
+        accounts are added.
+        '''
+        positions = self._contract_positions.get(conId)
+        if not positions:
+            return 0.
+        if account is not None:
+            position = positions.get(account)
+            return position.position if position is not None else 0.
+        return sum(position.position for position in positions.values())
+
+    def avgcost(self, conId, account=None):
+        '''Return the average cost of the position of the contract or None.
+        '''
+        positions = self._contract_positions.get(conId, {})
+        position = positions.get(account) if account is not None else \
+                next(iter(positions.values()), None)
+        return position.avgCost if position is not None else None
+
+    def value(self, tag, currency='', account=None):
+        '''Return the account value of the tag ('NetLiquidation', 'BASE')
+        or None. Without account the last value received is returned.
+        '''
+        if account is not None:
+            value = self.values.get((account, tag, currency))
+        else:
+            value = self._tag_values.get((tag, currency))
+        return value.value if value is not None else None
+
+    def status(self, orderId):
+        '''Return the status of the order ('Submitted', 'Filled') or None.
+        '''
+        trade = self.trades.get(orderId)
+        return trade.orderStatus.status if trade is not None else None
+
+    def open_orders(self):
+        '''Return the number of orders not done.
+        '''
+        return sum(1 for trade in self.trades.values()
+                if trade.orderStatus.status in ACTIVE_STATES)
+
+    def filled(self, orderId):
+        '''Return the filled size of the order.
+        '''
+        trade = self.trades.get(orderId)
+        if trade is not None and trade.orderStatus.filled:
+            return trade.orderStatus.filled
+        return sum(fill.execution.shares for fill in self.order_fills(orderId))
+
+    # Snapshots
+
+    def _snapshot(self, name, rows, index=None):
+        '''Return the data frame of the table. The data frame is shared
+        until the table changes, it must not be modified.
+        '''
+        version = self._versions[name]
+        cached = self._snapshots.get(name)
+        if cached is None or cached[0] != version:
+            rows = list(rows())
+            dataframe = pd.DataFrame(rows)
+            if index is not None and rows:
+                dataframe = dataframe.set_index(index)
+            cached = (version, dataframe)
+            self._snapshots[name] = cached
+        return cached[1]
+
+    def fills_df(self):
+        '''Data frame of fills sorted by time.
+        '''
+        def rows():
+            for fill in sorted(self.fills.values(), key=lambda f: f.time):
+                execution = fill.execution
+                yield {
+                        'time':fill.time,
+                        'orderId':execution.orderId,
+                        'execId':execution.execId,
+                        'account':execution.acctNumber,
+                        'conId':fill.contract.conId,
+                        'symbol':dc.contract_name(fill.contract),
+                        'side':execution.side,
+                        'shares':execution.shares,
+                        'price':execution.price,
+                        'avgPrice':execution.avgPrice,
+                        'cumQty':execution.cumQty,
+                        'commission':fill.commissionReport.commission,
+                        'realizedPNL':fill.commissionReport.realizedPNL,
+                        }
+        return self._snapshot('fills', rows)
+
+    def positions_df(self):
+        '''Data frame of positions.
+        '''
+        def rows():
+            for (account, conId), position in self.positions.items():
+                yield {
+                        'account':account,
+                        'conId':conId,
+                        'symbol':dc.contract_name(position.contract),
+                        'position':position.position,
+                        'avgCost':position.avgCost,
+                        }
+        return self._snapshot('positions', rows)
+
+    def account_df(self):
+        '''Data frame of account values indexed by tag (the columns of
+        IBDataClient.getaccountsummary).
+        '''
+        def rows():
+            for value in self.values.values():
+                yield {
+                        'Tag':value.tag,
+                        'Value':value.value,
+                        'Currency':value.currency,
+                        'Model Code':value.modelCode,
+                        'Account':value.account,
+                        }
+        return self._snapshot('values', rows, 'Tag')
+
+    def orders_df(self):
+        '''Data frame of orders and status.
+        '''
+        def rows():
+            for orderId, trade in self.trades.items():
+                yield {
+                        'orderId':orderId,
+                        'permId':trade.order.permId,
+                        'account':trade.order.account,
+                        'symbol':dc.contract_name(trade.contract),
+                        'action':trade.order.action,
+                        'totalQuantity':trade.order.totalQuantity,
+                        'status':trade.orderStatus.status,
+                        'filled':trade.orderStatus.filled,
+                        'remaining':trade.orderStatus.remaining,
+                        'avgFillPrice':trade.orderStatus.avgFillPrice,
+                        }
+        return self._snapshot('trades', rows)
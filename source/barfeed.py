@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+'''Backtrader data feed of bars in NumPy arrays (BarFrame, memory mapped
+datasets of BarStore). In preload mode the lines are filled with the
+arrays, the bars are not parsed or loaded one by one.
+'''
+
+import array
+
+import numpy as np
+import backtrader as bt
+
+import barframe as bf
+import datautils as du
+
+# Bar sizes of IB historical data and backtrader timeframes
+TIMEFRAMES = {
+        'sec':bt.TimeFrame.Seconds,
+        'min':bt.TimeFrame.Minutes,
+        'hour':bt.TimeFrame.Minutes,
+        'day':bt.TimeFrame.Days,
+        'week':bt.TimeFrame.Weeks,
+        'month':bt.TimeFrame.Months,
+        }
+
+def barsize_timeframe(barsize):
+    '''Return the backtrader timeframe and compression of an IB bar size
+    ('1 min' -> Minutes, 1; '1 hour' -> Minutes, 60).
+    '''
+    size, unit = barsize.split()
+    compression = int(size)
+    unit = unit.lower().rstrip('s')
+    if unit not in TIMEFRAMES:
+        raise ValueError('Unknown bar size: %s' % barsize)
+    if unit == 'hour':
+        compression *= 60
+    return TIMEFRAMES[unit], compression
+
+class ArrayData(bt.feed.DataBase):
+    '''Data feed of a BarFrame. The arrays are not copied until the
+    lines are filled. Like other feeds the timeframe and compression of
+    bars are parameters, then the feed can be resampled and replayed.
+
+    Parameters:
+
+      - dataname
+
+      Bars (BarFrame or Data Frame with OHLCV columns)
+
+      - openinterest (default: 0.)
+
+      Value of the open interest line
+    '''
+
+    params = (
+            ('openinterest', 0.),
+            )
+
+    @classmethod
+    def from_store(cls, store, symbol, barsize='1 min', **kwargs):
+        '''Create the feed of a BarStore dataset. The timeframe and
+        compression are given by the bar size.
+        '''
+        timeframe, compression = barsize_timeframe(barsize)
+        kwargs.setdefault('timeframe', timeframe)
+        kwargs.setdefault('compression', compression)
+        kwargs.setdefault('name', symbol)
+        return cls(dataname=store.read(symbol, barsize), **kwargs)
+
+    @property
+    def bars(self):
+        '''BarFrame of the feed. The bars are known after start, without
+        preload too.
+        '''
+        return self._bars
+
+    def start(self):
+        super(ArrayData, self).start()
+
+        bars = self.p.dataname
+        if not isinstance(bars, bf.BarFrame):
+            bars = bf.BarFrame.from_dataframe(bars)
+        self._bars = bars
+        self._dates = du.datetime64tonum(bars.time)
+        self._idx = -1
+
+    def preload(self):
+        '''Fill the lines with the arrays. The bars are loaded one by one
+        if the input timezone or filters change the bars.
+        '''
+        if self._tzinput or self._filters or self._ffilters or \
+                self._barstack or self._barstash:
+            return super(ArrayData, self).preload()
+
+        begin = np.searchsorted(self._dates, self.fromdate, side='left')
+        end = np.searchsorted(self._dates, self.todate, side='right')
+        end = max(begin, end)
+
+        bars = self._bars
+        columns = {
+                'datetime':self._dates[begin:end],
+                'open':bars.open[begin:end],
+                'high':bars.high[begin:end],
+                'low':bars.low[begin:end],
+                'close':bars.close[begin:end],
+                'volume':bars.volume[begin:end],
+                'openinterest':np.full(end - begin, self.p.openinterest),
+                }
+        for name in self.lines.getlinealiases():
+            line = getattr(self.lines, name)
+            values = columns.get(name)
+            if values is None:
+                values = np.full(end - begin, np.nan)
+            line.array = array.array(str('d'),
+                    np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        self._idx = end - 1
+
+        self._last()
+        self.home()
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._dates):
+            return False
+
+        i = self._idx
+        bars = self._bars
+        self.lines.datetime[0] = self._dates[i]
+        self.lines.open[0] = bars.open[i]
+        self.lines.high[0] = bars.high[i]
+        self.lines.low[0] = bars.low[i]
+        self.lines.close[0] = bars.close[i]
+        self.lines.volume[0] = bars.volume[i]
+        self.lines.openinterest[0] = self.p.openinterest
+        return True
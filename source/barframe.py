@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+'''Bars stored in typed columns: int64 timestamps (nanoseconds) and
+float64 OHLCV. The columns are NumPy arrays, then the selection of
+sessions and dates returns views without copying the bars.
+'''
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# Columns of bars
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+def to_datetime64(value):
+    '''Convert a datetime, Timestamp, string or POSIX timestamp (float,
+    local time like datetime.timestamp) to datetime64[ns]. The timezone
+    of aware datetimes is removed keeping the local time.
+    '''
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        value = dt.datetime.fromtimestamp(value)
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_localize(None)
+    return np.datetime64(value.value, 'ns')
+
+def find_columns(dataframe):
+    '''Return the time values and the OHLCV columns of a Data Frame.
+    The column names are not case sensitive ('Close' or 'close'), the
+    time is read from 'datetime' or 'date' columns or from the index.
+    Missing volume column is None.
+    '''
+    columns = {str(column).lower(): column for column in dataframe.columns}
+
+    if 'datetime' in columns:
+        times = pd.DatetimeIndex(dataframe[columns['datetime']])
+    elif 'date' in columns:
+        times = pd.DatetimeIndex(dataframe[columns['date']])
+    else:
+        times = pd.DatetimeIndex(dataframe.index)
+    if times.tz is not None:
+        times = times.tz_localize(None)
+
+    values = {name: dataframe[columns[name]] if name in columns else None
+            for name in COLUMNS}
+    return times.values, values
+
+class BarFrame(object):
+    '''Columns of bars. The constructor doesn't copy arrays with the
+    right type, slices of BarFrame are views of the same arrays.
+
+    Parameters:
+
+      - time
+
+      Time of bars (datetime64 or int64 nanoseconds)
+
+      - open, high, low, close
+
+      Prices of bars
+
+      - volume (default: None)
+
+      Volume of bars. If None the volume is NaN
+    '''
+
+    def __init__(self, time, open, high, low, close, volume=None):
+        time = np.asarray(time)
+        if np.issubdtype(time.dtype, np.datetime64):
+            time = time.astype('datetime64[ns]').view(np.int64)
+        self.time = np.asarray(time, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        if volume is None:
+            volume = np.full(len(self.time), np.nan)
+        self.volume = np.asarray(volume, dtype=np.float64)
+
+    @classmethod
+    def from_dataframe(cls, dataframe):
+        '''Create the bars from a Data Frame downloaded with dataclient,
+        read from csv files or created by datautils.parsedata. The Data
+        Frame is not changed.
+        '''
+        times, values = find_columns(dataframe)
+        return cls(times, **{name: None if column is None else
+            column.to_numpy(dtype=np.float64)
+            for name, column in values.items()})
+
+    @classmethod
+    def from_csv(cls, filename, **kwargs):
+        '''Read the bars from a csv file (like tests/eurusd.csv).
+        '''
+        return cls.from_dataframe(pd.read_csv(filename, **kwargs))
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        '''Return the bars of a slice (view) or of an index array (copy).
+        '''
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return BarFrame(self.time[index], self.open[index],
+                self.high[index], self.low[index], self.close[index],
+                self.volume[index])
+
+    def times(self):
+        '''Return the time of bars as datetime64[ns] (view).
+        '''
+        return self.time.view('datetime64[ns]')
+
+    def between(self, from_date=None, to_date=None):
+        '''Return the bars from from_date to to_date (both included).
+        '''
+        begin = 0
+        end = len(self.time)
+        if from_date is not None:
+            begin = np.searchsorted(self.time,
+                    to_datetime64(from_date).view(np.int64), side='left')
+        if to_date is not None:
+            end = np.searchsorted(self.time,
+                    to_datetime64(to_date).view(np.int64), side='right')
+        return self[begin:max(begin, end)]
+
+    def last(self, size):
+        '''Return the last bars.
+        '''
+        return self[max(0, len(self.time) - size):]
+
+    def sessions(self, calendar=None):
+        '''Return a list with the bars of each session. The sessions
+        are calendar days if calendar (SessionCalendar) is None.
+        '''
+        if calendar is not None:
+            index = calendar.index(self.times())
+            starts, ends = index.starts, index.ends
+        else:
+            days = self.times().astype('datetime64[D]')
+            starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) \
+                    if len(days) > 0 else np.empty(0, dtype=np.int64)
+            ends = np.append(starts[1:], len(days))
+        return [self[start:end] for start, end in zip(starts, ends)]
+
+    def to_dataframe(self):
+        '''Return a Data Frame with the format of datautils.parsedata.
+        '''
+        datetime = pd.DatetimeIndex(self.times(), name='datetime')
+        return pd.DataFrame({
+                'datetime':datetime,
+                'Close':self.close,
+                'High':self.high,
+                'Low':self.low,
+                'Open':self.open,
+                'Volume':self.volume},
+                index=datetime,
+                )
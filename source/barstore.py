@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''On-disk store of bars in columns. Each dataset (symbol and bar size)
+is a directory with one .npy file per column and a metadata file, the
+columns are loaded with memory mapping then reading years of bars
+doesn't parse or copy the data.
+'''
+
+import io
+import os
+import json
+import time
+import asyncio
+import shutil
+import tempfile
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import barframe as bf
+
+METADATA = 'meta.json'
+TIME = 'time'
+LOCK = '.lock'
+
+def dataset_name(symbol, barsize):
+    '''Return the directory name of the dataset ('EURUSD', '1 min' ->
+    'EURUSD_1min').
+    '''
+    name = '%s_%s' % (symbol, barsize)
+    for char in ' /\\:':
+        name = name.replace(char, '')
+    return name
+
+class DatasetLock(object):
+    '''Lock file of a dataset shared by processes. The lock file keeps
+    the pid of the process, the lock of a finished process (killed during
+    a download) is removed.
+
+    Parameters:
+
+      - filename
+
+      Path of the lock file
+
+      - timeout (default: 600)
+
+      Seconds waiting for the lock, TimeoutError is raised after the
+      timeout
+
+      - poll (default: 0.5)
+
+      Seconds between the checks of the lock file
+    '''
+
+    def __init__(self, filename, timeout=600, poll=0.5):
+        self.filename = filename
+        self.timeout = timeout
+        self.poll = poll
+
+    def _create(self):
+        '''Create the lock file. Return False if the dataset is locked
+        by other process.
+        '''
+        try:
+            fd = os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+
+    def _expired(self, begin):
+        if time.time() - begin > self.timeout:
+            raise TimeoutError('Dataset locked: %s' % self.filename)
+
+    def acquire(self):
+        begin = time.time()
+        while not self._create():
+            if self.locked():
+                self._expired(begin)
+                time.sleep(self.poll)
+
+    async def acquire_async(self):
+        '''Acquire the lock without blocking the event loop (downloads
+        of other datasets continue while waiting).
+        '''
+        begin = time.time()
+        while not self._create():
+            if self.locked():
+                self._expired(begin)
+                await asyncio.sleep(self.poll)
+
+    def locked(self):
+        '''Return True if the lock file exists and the process of the
+        lock is running. The lock file of a finished process is removed.
+        '''
+        try:
+            with open(self.filename) as lockfile:
+                pid = int(lockfile.read() or 0)
+        except (OSError, ValueError):
+            return os.path.exists(self.filename)
+        if pid <= 0:
+            # Lock file created but pid not written yet
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def release(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *args):
+        self.release()
+
+class BarStore(object):
+    '''Datasets of bars saved in a directory.
+
+    Parameters:
+
+      - directory
+
+      Root directory of the store
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, symbol, barsize='1 min'):
+        return os.path.join(self.directory, dataset_name(symbol, barsize))
+
+    def exists(self, symbol, barsize='1 min'):
+        return os.path.isfile(os.path.join(self.path(symbol, barsize),
+            METADATA))
+
+    def lock(self, symbol, barsize='1 min', timeout=600):
+        '''Return the lock of the dataset (DatasetLock), used as context
+        manager by the processes writing the dataset.
+        '''
+        return DatasetLock(self.path(symbol, barsize) + LOCK, timeout)
+
+    def datasets(self):
+        '''Return the metadata of all datasets.
+        '''
+        result = []
+        for name in sorted(os.listdir(self.directory)):
+            filename = os.path.join(self.directory, name, METADATA)
+            if os.path.isfile(filename):
+                with open(filename) as metafile:
+                    result.append(json.load(metafile))
+        return result
+
+    def metadata(self, symbol, barsize='1 min'):
+        '''Return the metadata of the dataset (symbol, barsize, ticksize,
+        rows, first and last bar time and other saved values).
+        '''
+        with open(os.path.join(self.path(symbol, barsize), METADATA)) \
+                as metafile:
+            return json.load(metafile)
+
+    def read(self, symbol, barsize='1 min', mmap=True):
+        '''Return the bars of the dataset as BarFrame. With mmap the
+        columns are memory mapped (read only).
+        '''
+        path = self.path(symbol, barsize)
+        mode = 'r' if mmap else None
+        columns = {name: np.load(os.path.join(path, name + '.npy'),
+            mmap_mode=mode) for name in (TIME,) + bf.COLUMNS}
+        return bf.BarFrame(**columns)
+
+    def write(self, symbol, bars, barsize='1 min', ticksize=None, **kwargs):
+        '''Save the bars (BarFrame or Data Frame downloaded with dataclient
+        or read from csv files) replacing the dataset. The other keyword
+        arguments are saved in metadata (exchange, whatToShow, ...).
+        '''
+        if isinstance(bars, pd.DataFrame):
+            bars = bf.BarFrame.from_dataframe(bars)
+
+        metadata = dict(kwargs)
+        metadata.update({
+            'symbol':str(symbol),
+            'barsize':str(barsize),
+            'ticksize':None if ticksize is None else float(ticksize),
+            'rows':len(bars),
+            'first':str(bars.times()[0]) if len(bars) > 0 else None,
+            'last':str(bars.times()[-1]) if len(bars) > 0 else None,
+            })
+
+        # The dataset is written in a temporary directory and renamed,
+        # readers never see an incomplete dataset
+        path = self.path(symbol, barsize)
+        tmppath = tempfile.mkdtemp(dir=self.directory,
+                prefix='.' + os.path.basename(path))
+        for name in (TIME,) + bf.COLUMNS:
+            np.save(os.path.join(tmppath, name + '.npy'),
+                    np.ascontiguousarray(getattr(bars, name)))
+        with open(os.path.join(tmppath, METADATA), 'w') as metafile:
+            json.dump(metadata, metafile, indent=2)
+
+        oldpath = None
+        if os.path.isdir(path):
+            oldpath = tempfile.mkdtemp(dir=self.directory,
+                    prefix='.old' + os.path.basename(path))
+            os.rmdir(oldpath)
+            os.rename(path, oldpath)
+        os.rename(tmppath, path)
+        if oldpath is not None:
+            shutil.rmtree(oldpath, ignore_errors=True)
+        return metadata
+
+    def merge(self, symbol, bars, barsize='1 min', ticksize=None, **kwargs):
+        '''Add the bars to the dataset. Bars with the same time of saved
+        bars replace them. The metadata of saved dataset is kept unless
+        new values are passed.
+        '''
+        if isinstance(bars, pd.DataFrame):
+            bars = bf.BarFrame.from_dataframe(bars)
+        if not self.exists(symbol, barsize):
+            return self.write(symbol, bars, barsize, ticksize, **kwargs)
+
+        metadata = self.metadata(symbol, barsize)
+        saved = self.read(symbol, barsize, mmap=False)
+        if ticksize is None:
+            ticksize = metadata.get('ticksize')
+        for key in ('symbol', 'barsize', 'ticksize', 'rows', 'first',
+                'last'):
+            metadata.pop(key, None)
+        metadata.update(kwargs)
+
+        # New bars are placed after the saved bars, then the last
+        # occurrence of each time is kept
+        columns = {name: np.concatenate([getattr(saved, name),
+            getattr(bars, name)]) for name in (TIME,) + bf.COLUMNS}
+        order = np.argsort(columns[TIME], kind='stable')
+        times = columns[TIME][order]
+        keep = np.r_[times[1:] != times[:-1], True] if len(times) > 0 \
+                else np.empty(0, dtype=bool)
+        merged = bf.BarFrame(**{name: values[order][keep]
+            for name, values in columns.items()})
+        return self.write(symbol, merged, barsize, ticksize, **metadata)
+
+    def append(self, symbol, bars, barsize='1 min', ticksize=None,
+            **kwargs):
+        '''Add the bars after the last bar of the dataset. The columns are
+        extended in place, the saved bars are not read or copied. Bars
+        not newer than the last saved bar are merged (merge). The metadata
+        of saved dataset is kept unless new values are passed.
+        '''
+        if isinstance(bars, pd.DataFrame):
+            bars = bf.BarFrame.from_dataframe(bars)
+        if not self.exists(symbol, barsize):
+            return self.write(symbol, bars, barsize, ticksize, **kwargs)
+
+        metadata = self.metadata(symbol, barsize)
+        path = self.path(symbol, barsize)
+        if len(bars) > 0 and metadata['last'] is not None and \
+                bars.time[0] <= bf.to_datetime64(metadata['last']).view(
+                    np.int64):
+            return self.merge(symbol, bars, barsize, ticksize, **kwargs)
+
+        # All data is written before the headers, readers of the old
+        # headers see the saved bars only
+        files = [(os.path.join(path, name + '.npy'),
+            np.ascontiguousarray(getattr(bars, name)))
+            for name in (TIME,) + bf.COLUMNS]
+        headers = [extend_npy(filename, values)
+                for filename, values in files]
+        if None in headers:
+            return self.merge(symbol, bars, barsize, ticksize, **kwargs)
+        for (filename, values), header in zip(files, headers):
+            with open(filename, 'r+b') as npyfile:
+                npyfile.write(header)
+
+        metadata.update(kwargs)
+        if ticksize is not None:
+            metadata['ticksize'] = float(ticksize)
+        metadata['rows'] += len(bars)
+        if len(bars) > 0:
+            if metadata['first'] is None:
+                metadata['first'] = str(bars.times()[0])
+            metadata['last'] = str(bars.times()[-1])
+        fd, tmpname = tempfile.mkstemp(dir=path, suffix='.json')
+        with os.fdopen(fd, 'w') as metafile:
+            json.dump(metadata, metafile, indent=2)
+        os.replace(tmpname, os.path.join(path, METADATA))
+        return metadata
+
+def extend_npy(filename, values):
+    '''Write the values at the end of the .npy file of one column. Return
+    the header with the new shape, written by the caller after the data
+    of all columns, or None if the header doesn't fit in the saved header
+    or the type is different (nothing is written).
+    '''
+    with open(filename, 'r+b') as npyfile:
+        version = np.lib.format.read_magic(npyfile)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(
+                    npyfile)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(
+                    npyfile)
+        offset = npyfile.tell()
+        if dtype != values.dtype or len(shape) != 1:
+            return None
+
+        write_header = np.lib.format.write_array_header_1_0 \
+                if version == (1, 0) else \
+                np.lib.format.write_array_header_2_0
+        header = io.BytesIO()
+        write_header(header, {
+            'descr':np.lib.format.dtype_to_descr(dtype),
+            'fortran_order':fortran,
+            'shape':(shape[0] + len(values),),
+            })
+        header = header.getvalue()
+        if len(header) != offset:
+            return None
+
+        npyfile.seek(offset + shape[0] * dtype.itemsize)
+        npyfile.write(values.tobytes())
+        npyfile.truncate()
+        return header
+
+def convert_csv(filename, store, symbol, barsize='1 min', ticksize=None,
+        **kwargs):
+    '''Save a csv file of bars (like tests/eurusd.csv) in the store.
+    '''
+    return store.write(symbol, bf.BarFrame.from_csv(filename), barsize,
+            ticksize, **kwargs)
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description='Convert csv files of bars to the bar store')
+
+    parser.add_argument('filename', help='Csv file of bars')
+    parser.add_argument('directory', help='Directory of the bar store')
+    parser.add_argument('symbol', help='Symbol of bars')
+
+    parser.add_argument(
+            '--barsize', '-b',
+            required=False,
+            default='1 min',
+            action='store',
+            help='Bar size'
+            )
+
+    parser.add_argument(
+            '--ticksize', '-t',
+            required=False,
+            default=None,
+            action='store',
+            type=float,
+            help='Tick size of symbol'
+            )
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+    return parser.parse_args()
+
+def run(args=None):
+    args = parse_args(args)
+    metadata = convert_csv(args.filename, BarStore(args.directory),
+            args.symbol, args.barsize, args.ticksize)
+    print(json.dumps(metadata, indent=2))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+'''Cache of contract details (tick size, market rules, multiplier and
+exchange) in memory and on disk. The details are requested to IB once and
+served from the cache until the TTL expires.
+'''
+
+import os
+import json
+import time
+import tempfile
+
+from ib_insync import Contract
+
+# File of the cache, None keeps the details only in memory
+CACHE_FILENAME = 'contracts.json'
+
+# Seconds until the details are requested again
+DEFAULT_TTL = 24 * 60 * 60
+
+def contract_key(contract):
+    '''Return the key of the contract. Qualified contracts are found by
+    conId, other contracts by the fields that define them.
+    '''
+    if contract.conId:
+        return str(contract.conId)
+    return ':'.join(str(value) for value in (contract.secType,
+        contract.symbol, contract.exchange, contract.currency,
+        contract.lastTradeDateOrContractMonth, contract.strike,
+        contract.right, contract.multiplier))
+
+class ContractInfo(object):
+    '''Details of a contract used by the data client and the strategies.
+
+    Parameters:
+
+      - fields
+
+      Dictionary of contract fields, minTick, marketRules (list of
+      [lowEdge, increment] by exchange), timeZoneId and updated (time of
+      the request)
+    '''
+
+    FIELDS = ('conId', 'symbol', 'secType', 'exchange', 'primaryExchange',
+            'currency', 'localSymbol', 'tradingClass', 'multiplier',
+            'lastTradeDateOrContractMonth', 'longName', 'timeZoneId',
+            'minTick', 'marketRules', 'updated')
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+        if self.marketRules is None:
+            self.marketRules = dict()
+
+    @classmethod
+    def from_details(cls, details, rules=None):
+        '''Create the information from ib_insync ContractDetails. The rules
+        are the price increments (PriceIncrement list) by market rule id.
+        '''
+        contract = details.contract
+        fields = {name: getattr(contract, name) for name in cls.FIELDS
+                if hasattr(contract, name)}
+        fields.update({
+            'multiplier':float(contract.multiplier)
+                if contract.multiplier else None,
+            'longName':details.longName,
+            'timeZoneId':details.timeZoneId,
+            'minTick':float(details.minTick),
+            'updated':time.time(),
+            })
+
+        # Market rule ids are given in the same order of valid exchanges
+        marketrules = dict()
+        if rules is not None and details.marketRuleIds:
+            ruleids = details.marketRuleIds.split(',')
+            exchanges = details.validExchanges.split(',')
+            for exchange, ruleid in zip(exchanges, ruleids):
+                if int(ruleid) in rules:
+                    marketrules[exchange] = [[increment.lowEdge,
+                        increment.increment]
+                        for increment in rules[int(ruleid)]]
+        fields['marketRules'] = marketrules
+        return cls(**fields)
+
+    def contract(self):
+        '''Return the qualified contract (with conId).
+        '''
+        return Contract(
+                secType=self.secType,
+                conId=self.conId,
+                symbol=self.symbol,
+                lastTradeDateOrContractMonth=
+                    self.lastTradeDateOrContractMonth or '',
+                multiplier='%g' % self.multiplier if self.multiplier else '',
+                exchange=self.exchange,
+                primaryExchange=self.primaryExchange or '',
+                currency=self.currency,
+                localSymbol=self.localSymbol or '',
+                tradingClass=self.tradingClass or '')
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def expired(self, ttl=DEFAULT_TTL):
+        return self.updated is None or time.time() - self.updated > ttl
+
+    def ticksize(self, price=None, exchange=None):
+        '''Return the tick size. With price, the increment of the price
+        band of the market rule (exchange of the contract if None) is
+        returned.
+        '''
+        if price is None:
+            return self.minTick
+        rule = self.marketRules.get(exchange or self.exchange)
+        if rule is None and self.marketRules:
+            rule = next(iter(self.marketRules.values()))
+        if not rule:
+            return self.minTick
+
+        increment = rule[0][1]
+        for lowedge, value in rule:
+            if abs(price) >= lowedge:
+                increment = value
+        return increment
+
+class ContractCache(object):
+    '''Contract details by contract key.
+
+    Parameters:
+
+      - filename (default: CACHE_FILENAME)
+
+      JSON file of the cache. If None the cache is not saved
+
+      - ttl (default: DEFAULT_TTL)
+
+      Seconds until the details expire
+    '''
+
+    def __init__(self, filename=CACHE_FILENAME, ttl=DEFAULT_TTL):
+        self.filename = filename
+        self.ttl = ttl
+        self._contracts = dict()
+        self._aliases = dict()
+        self.load()
+
+    def load(self):
+        '''Read the saved details. Expired details are not loaded.
+        '''
+        if self.filename is None or not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename) as cachefile:
+                saved = json.load(cachefile)
+        except ValueError:
+            return
+        for key, fields in saved.get('contracts', {}).items():
+            info = ContractInfo(**fields)
+            if not info.expired(self.ttl):
+                self._contracts[key] = info
+        self._aliases.update({alias: key for alias, key in
+            saved.get('aliases', {}).items() if key in self._contracts})
+
+    def save(self):
+        '''Write the details on disk (replacing the file).
+        '''
+        if self.filename is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as cachefile:
+            json.dump({
+                'contracts':{key: info.to_dict()
+                    for key, info in self._contracts.items()},
+                'aliases':self._aliases,
+                }, cachefile, indent=2)
+        os.replace(tmpname, self.filename)
+
+    def get(self, contract):
+        '''Return the information of the contract (ContractInfo) or None
+        if it's not in the cache or expired.
+        '''
+        key = contract_key(contract)
+        info = self._contracts.get(self._aliases.get(key, key))
+        if info is None or info.expired(self.ttl):
+            return None
+        return info
+
+    def put(self, contract, info):
+        '''Add the information of the contract. The contract used in the
+        request (not qualified) is an alias of the conId.
+        '''
+        key = contract_key(info) if info.conId else contract_key(contract)
+        self._contracts[key] = info
+        alias = contract_key(contract)
+        if alias != key:
+            self._aliases[alias] = key
+
+    def missing(self, contracts):
+        '''Return the contracts without information in the cache.
+        '''
+        return [contract for contract in contracts
+                if self.get(contract) is None]
+
+# Caches shared by the objects of the same process
+_caches = dict()
+
+def getcache(filename=CACHE_FILENAME, ttl=DEFAULT_TTL):
+    '''Return the contract cache of the file.
+    '''
+    if filename not in _caches:
+        _caches[filename] = ContractCache(filename, ttl)
+    return _caches[filename]
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+'''Cache of historical data in the bar store. The metadata of each
+dataset keeps the time ranges [start, end) already downloaded, then only
+the missing ranges are requested to IB. A lock file of the dataset
+avoids that two processes download the same ranges.
+'''
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import barframe as bf
+
+# Seconds of IB duration units
+DURATION_UNITS = {
+        'S':1,
+        'D':24 * 60 * 60,
+        'W':7 * 24 * 60 * 60,
+        'M':30 * 24 * 60 * 60,
+        'Y':365 * 24 * 60 * 60,
+        }
+
+# Seconds of IB bar size units
+BARSIZE_UNITS = {
+        'sec':1,
+        'min':60,
+        'hour':60 * 60,
+        'day':24 * 60 * 60,
+        'week':7 * 24 * 60 * 60,
+        'month':30 * 24 * 60 * 60,
+        }
+
+# Bars of ranges without data
+EMPTY_BARS = bf.BarFrame(*[np.empty(0)] * 5)
+
+# whatToShow saved with the symbol name only
+DEFAULT_WHATTOSHOW = 'MIDPOINT'
+
+def duration_seconds(duration):
+    '''Return the seconds of an IB duration ('5 D' -> 432000). The days
+    are 24 hours, like the limits of requests. IB counts the days of the
+    duration in trading days, then the time range of the duration is
+    returned by duration_start.
+    '''
+    size, unit = duration.split()
+    return int(size) * DURATION_UNITS[unit.upper()]
+
+def duration_start(duration, end):
+    '''Return the start of the IB duration before end. The days are
+    trading days like IB, weekends are skipped (holidays are not known).
+    The other units are calendar time.
+    '''
+    size, unit = duration.split()
+    end = pd.Timestamp(end)
+    if unit.upper() == 'D':
+        return end - pd.offsets.BDay(int(size))
+    return end - pd.Timedelta(seconds=duration_seconds(duration))
+
+def barsize_seconds(barsize):
+    '''Return the seconds of an IB bar size ('5 mins' -> 300).
+    '''
+    size, unit = barsize.split()
+    return int(size) * BARSIZE_UNITS[unit.lower().rstrip('s')]
+
+def seconds_duration(seconds):
+    '''Return the IB duration of the seconds. Durations longer than one
+    day are requested in days.
+    '''
+    seconds = int(np.ceil(seconds))
+    if seconds <= DURATION_UNITS['D']:
+        return '%d S' % max(seconds, 1)
+    return '%d D' % int(np.ceil(seconds / DURATION_UNITS['D']))
+
+def contract_name(contract):
+    '''Return the name of the contract ('EURUSD' for Forex contracts
+    without local symbol).
+    '''
+    if contract.localSymbol:
+        return contract.localSymbol
+    if contract.secType == 'CASH':
+        return contract.symbol + contract.currency
+    return contract.symbol
+
+def cache_symbol(symbol, whatToShow=DEFAULT_WHATTOSHOW):
+    '''Return the dataset symbol of the data type. MIDPOINT bars are
+    saved with the symbol, other data types with a suffix ('AMD_TRADES').
+    '''
+    if whatToShow == DEFAULT_WHATTOSHOW:
+        return symbol
+    return '%s_%s' % (symbol, whatToShow)
+
+def add_range(ranges, start, end):
+    '''Return the sorted ranges with [start, end) added, overlapping or
+    adjacent ranges are joined.
+    '''
+    result = []
+    for begin, finish in sorted(list(ranges) + [(start, end)]):
+        if result and begin <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], finish))
+        else:
+            result.append((begin, finish))
+    return result
+
+def missing_ranges(ranges, start, end):
+    '''Return the ranges of [start, end) not included in ranges.
+    '''
+    result = []
+    for begin, finish in sorted(ranges):
+        if finish <= start:
+            continue
+        if begin >= end:
+            break
+        if begin > start:
+            result.append((start, begin))
+        start = max(start, finish)
+    if start < end:
+        result.append((start, end))
+    return result
+
+def saved_ranges(metadata, barsize):
+    '''Return the downloaded ranges of the dataset metadata. Datasets
+    saved without ranges (csv files, getdata_tostore) cover the time
+    from the first to the last bar.
+    '''
+    if metadata is None:
+        return []
+    if 'ranges' in metadata:
+        return [(pd.Timestamp(begin), pd.Timestamp(end))
+                for begin, end in metadata['ranges']]
+    if metadata.get('first') is None:
+        return []
+    return [(pd.Timestamp(metadata['first']), pd.Timestamp(metadata['last'])
+        + pd.Timedelta(seconds=barsize_seconds(barsize)))]
+
+def concat_bars(parts):
+    '''Return the bars (BarFrame) of the sorted parts joined.
+    '''
+    if not parts:
+        return EMPTY_BARS
+    if len(parts) == 1:
+        return parts[0]
+    return bf.BarFrame(**{name: np.concatenate([getattr(part, name)
+        for part in parts]) for name in ('time',) + bf.COLUMNS})
+
+class HistoricalCache(object):
+    '''Historical data of IB saved in a bar store.
+
+    Parameters:
+
+      - client
+
+      Data client (dataclient.IBDataClient)
+
+      - store
+
+      Bar store (barstore.BarStore)
+
+      - whatToShow (default: 'MIDPOINT')
+
+      Data type of bars
+
+      - useRTH (default: True)
+
+      Use only the data of regular trading hours
+
+      - timeout (default: 600)
+
+      Seconds waiting for the download of other process
+    '''
+
+    def __init__(self, client, store, whatToShow=DEFAULT_WHATTOSHOW,
+            useRTH=True, timeout=600):
+        self.client = client
+        self.store = store
+        self.whatToShow = whatToShow
+        self.useRTH = useRTH
+        self.timeout = timeout
+
+    def metadata(self, symbol, barsize):
+        symbol = cache_symbol(symbol, self.whatToShow)
+        if not self.store.exists(symbol, barsize):
+            return None
+        return self.store.metadata(symbol, barsize)
+
+    def window(self, barsize, duration, end=None):
+        '''Return the [start, end) range of the duration. The end is the
+        start of the current bar, the bar in progress is not saved.
+        '''
+        if end is None:
+            end = dt.datetime.now()
+        end = pd.Timestamp(end).floor('%ds' % barsize_seconds(barsize))
+        return duration_start(duration, end), end
+
+    def gaps(self, symbol, barsize, start, end, earliest=None):
+        '''Return the ranges of [start, end) not downloaded. The ranges
+        before the earliest bar of IB (saved in metadata if None) are not
+        included.
+        '''
+        metadata = self.metadata(symbol, barsize)
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if earliest is None and metadata is not None:
+            earliest = metadata.get('earliest')
+        if earliest is not None:
+            start = max(start, pd.Timestamp(earliest))
+        return missing_ranges(saved_ranges(metadata, barsize), start, end)
+
+    async def update_async(self, contract, symbol=None, barsize='1 min',
+            duration='1 D', end=None):
+        '''Download the missing ranges of the duration and merge them in
+        the store. Return the bars of the duration (BarFrame).
+        '''
+        if symbol is None:
+            symbol = contract_name(contract)
+        name = cache_symbol(symbol, self.whatToShow)
+        start, end = self.window(barsize, duration, end)
+
+        # The gaps are found with the lock, the ranges downloaded by
+        # other process while waiting are not requested again
+        async with self.store.lock(name, barsize, self.timeout):
+            metadata = self.metadata(symbol, barsize)
+            earliest = None if metadata is None \
+                    else metadata.get('earliest')
+            if earliest is None:
+                # Empty if IB doesn't return the earliest bar
+                earliest = await self.client.getearliestbar_async(contract,
+                        self.whatToShow, self.useRTH)
+                earliest = str(pd.Timestamp(bf.to_datetime64(earliest))) \
+                        if earliest else None
+
+            args = {
+                    'earliest':earliest,
+                    'whatToShow':self.whatToShow,
+                    'useRTH':self.useRTH,
+                    'exchange':contract.exchange,
+                    }
+            if metadata is None or metadata.get('ticksize') is None:
+                args['ticksize'] = await self.client.getticksize_async(
+                        contract)
+
+            ranges = saved_ranges(metadata, barsize)
+            parts = []
+            for begin, finish in self.gaps(symbol, barsize, start, end,
+                    earliest):
+                bars = await self.client.getbars_range_async(contract,
+                        barsize, begin, finish, self.whatToShow, self.useRTH)
+                ranges = add_range(ranges, begin, finish)
+                parts.append(bars.between(begin,
+                    finish - pd.Timedelta(1, 'ns')))
+
+            # The gaps are saved at once, gaps after the saved bars are
+            # appended in place and the others are merged in one rewrite
+            if parts:
+                args['ranges'] = [[str(begin), str(finish)]
+                        for begin, finish in ranges]
+                parts = [part for part in parts if len(part) > 0]
+                last = None if metadata is None else metadata.get('last')
+                if last is None or not parts or parts[0].time[0] > \
+                        bf.to_datetime64(last).view(np.int64):
+                    for part in parts or [EMPTY_BARS]:
+                        self.store.append(name, part, barsize, **args)
+                else:
+                    self.store.merge(name, concat_bars(parts), barsize,
+                            **args)
+
+            if not self.store.exists(name, barsize):
+                self.store.write(name, EMPTY_BARS, barsize, **args)
+
+        return self.store.read(name, barsize).between(start,
+                end - pd.Timedelta(1, 'ns'))
+
+    def update(self, contract, symbol=None, barsize='1 min', duration='1 D',
+            end=None):
+        '''Blocking version of update_async.
+        '''
+        return self.client.run_until_complete(self.update_async(contract,
+            symbol, barsize, duration, end), symbol or contract_name(contract))
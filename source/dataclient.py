@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 
 from ib_insync import *
+import asyncio
 import datetime as dt
 import pandas as pd
+import accountmirror
+import barstore
+import contractcache
+import datacache
+import downloader
 
 HOST = '127.0.0.1'
 PORT = 7497
 CLIENT_ID = '1234'
 
+# Contracts requested at the same time by prefetch
+PREFETCH_SIZE = 50
+
 # Data Client Contract Types
 FOREX = 'Forex'
 FUTURES = 'Futures'
@@ -105,12 +114,48 @@ def getcontract(symbol, symboltype, **kwargs):
     else:
         raise ('Symbol Type not found')
     
+def getcontract_fromname(dataname):
+    '''Get contract from the data names of backtrader IB store:
+
+      - TICKER-STK-EXCHANGE-CURRENCY (exchange SMART and currency USD by
+        default)
+      - CUR1.CUR2-CASH-IDEALPRO
+      - TICKER-IND-EXCHANGE-CURRENCY
+      - TICKER-YYYYMM-EXCHANGE-CURRENCY (futures)
+    '''
+    tokens = dataname.split('-')
+    symbol = tokens[0]
+    sectype = tokens[1] if len(tokens) > 1 else 'STK'
+    exchange = tokens[2] if len(tokens) > 2 else None
+    currency = tokens[3] if len(tokens) > 3 else 'USD'
+
+    if sectype == 'CASH':
+        return Forex(symbol.replace('.', ''), exchange or 'IDEALPRO')
+    elif sectype == 'IND':
+        return Index(symbol, exchange, currency)
+    elif sectype.isdigit():
+        return Future(symbol, sectype, exchange, currency=currency)
+    elif sectype == 'STK':
+        return Stock(symbol, exchange or 'SMART', currency)
+    else:
+        raise ValueError('Data name not supported: %s' % dataname)
+
 def secs_duration(self, datetime):
     '''Get total seconds from datetime parameter to current time.
     '''
     _datetime = pd.Timestamp(dt.datetime.now()) - pd.Timestamp(datetime)
     return str(int(_datetime.total_seconds()))
 
+def rename_columns(dataframe):
+    '''Rename the columns of ib_insync bars (util.df) to the names used
+    by the strategies ('datetime', 'Open', 'High', 'Low' and 'Close').
+    '''
+    return dataframe.rename(
+            columns={'close':'Close', 
+                'open':'Open',
+                'date':'datetime', 
+                'high':'High', 
+                'low':'Low'})
 
 class IBDataClient:
     '''Client with functions to handle data, get account information, 
@@ -120,6 +165,11 @@ class IBDataClient:
     def __init__(self, host, port, clientid):
         self.client = IB()
         self.client.connect(host, port, clientid)
+        self.contracts = contractcache.getcache()
+        self.qualified = dict()
+        self._downloader = None
+        self._marketrules = dict()
+        self._mirrors = dict()
 
     def connected(self):
         '''Check if api client is connected.
@@ -129,21 +179,22 @@ class IBDataClient:
     def close(self):
         '''Disconnect the ib_insync api.
         '''
+        for mirror in self._mirrors.values():
+            mirror.close()
+        self._mirrors.clear()
         self.client.disconnect()
 
     def getaccountsummary(self, account=''):
+        '''Return the account summary (values different from zero) as
+        data frame indexed by tag.
         '''
-        '''
-        accounts =  self.client.accountSummary(account)
-        acc = pd.DataFrame()
-        for account in accounts:
-            if str(account.value) != '0.00':
-                acc = acc.append(pd.DataFrame({
-                    'Value':account.value,
-                    'Currency':account.currency,
-                    'Model Code':account.modelCode,
-                    }, index=[account.tag]))
-        return acc
+        accounts = [value for value in self.client.accountSummary(account)
+                if str(value.value) != '0.00']
+        return pd.DataFrame({
+            'Value':[value.value for value in accounts],
+            'Currency':[value.currency for value in accounts],
+            'Model Code':[value.modelCode for value in accounts],
+            }, index=[value.tag for value in accounts])
 
     def getcompletedorders(self, apionly=True):
         '''Request the completed orders and return dataframes with information of
@@ -181,6 +232,15 @@ class IBDataClient:
         contract_args.update(**kwargs)
         contract = getcontract(**contract_args)
 
+        # Durations longer than one request are downloaded in chunks,
+        # the Data Frame has the same columns of a single request
+        seconds = datacache.duration_seconds(duration)
+        if seconds > downloader.max_chunk_seconds(timeframe):
+            todate = dt.datetime.now()
+            return rename_columns(self.getdownloader().download_frame(
+                contract, timeframe,
+                datacache.duration_start(duration, todate), todate))
+
         data_args = {
                 'contract':contract,
                 'barSizeSetting':timeframe,
@@ -190,13 +250,7 @@ class IBDataClient:
                 'useRTH':True,
                 }
         dataframe = util.df(self.client.reqHistoricalData(**data_args))
-        dataframe = dataframe.rename(
-                columns={'close':'Close', 
-                    'open':'Open',
-                    'date':'datetime', 
-                    'high':'High', 
-                    'low':'Low'})
-        return dataframe
+        return rename_columns(dataframe)
 
     def getdata_fromct(self, contract, timeframe='1 secs', duration='1 D'):
         '''Get data with contract as input parameter.
@@ -210,27 +264,18 @@ class IBDataClient:
                 'useRTH':True,
                 }
         dataframe = util.df(self.client.reqHistoricalData(**data_args))
-
-        dataframe = dataframe.rename(
-                columns={'close':'Close', 
-                    'open':'Open',
-                    'date':'datetime', 
-                    'high':'High', 
-                    'low':'Low'})
-        return dataframe
+        return rename_columns(dataframe)
 
     def getdata_fromdt(self, symbol, symboltype, exchange='IDEALPRO', 
             currency='USD', timeframe='1 secs', 
             fromdate= dt.datetime(2015,1,1), 
-            todate= dt.datetime.now(), **kwargs):
+            todate=None, **kwargs):
 
         '''Download data and return as Data Frame. 
         The input parameters 'fromdate' and 'todate' is set in same than backtrader backtests, 
         then is converted internally for ib_insync api input mode.
         '''
 
-        durationstr = self.secs_duration(fromdate) + ' S'
-
         contract_args = {
                 'symbol':symbol,
                 'symboltype':symboltype,
@@ -240,24 +285,160 @@ class IBDataClient:
         contract_args.update(**kwargs)
         contract = getcontract(**contract_args)
 
-        data_args = {
-                'contract':contract,
-                'barSizeSetting':timeframe,
-                'durationStr':durationstr,
-                'endDateTime':todate,
+        # Long ranges are downloaded in chunks, the Data Frame has the
+        # same columns of getdata
+        if todate is None:
+            todate = dt.datetime.now()
+        return rename_columns(self.getdownloader().download_frame(
+            contract, timeframe, fromdate, todate))
+
+    def getdownloader(self):
+        '''Return the chunked downloader of the client (downloader.
+        ChunkedDownloader), the pacing of requests is shared by all
+        downloads of the client.
+        '''
+        if self._downloader is None:
+            self._downloader = downloader.ChunkedDownloader(self.client)
+        return self._downloader
+
+    def getmirror(self, account=''):
+        '''Return the account mirror of the client (accountmirror.
+        AccountMirror). Fills, positions, account values and order status
+        are updated by events and read without requests.
+        '''
+        if account not in self._mirrors:
+            self._mirrors[account] = accountmirror.AccountMirror(self.client,
+                    account)
+        return self._mirrors[account]
+
+    def getbars_range(self, contract, timeframe='1 min', fromdate=None,
+            todate=None, whatToShow='MIDPOINT', useRTH=True):
+        '''Download the bars from fromdate to todate of the contract and
+        return as BarFrame. The range is requested in chunks with the
+        pacing of IB.
+        '''
+        if todate is None:
+            todate = dt.datetime.now()
+        return self.getdownloader().download(contract, timeframe,
+                fromdate, todate, whatToShow, useRTH)
+
+    async def getbars_range_async(self, contract, timeframe='1 min',
+            fromdate=None, todate=None, whatToShow='MIDPOINT', useRTH=True):
+        '''Async version of getbars_range.
+        '''
+        if todate is None:
+            todate = dt.datetime.now()
+        return await self.getdownloader().download_bars_async(contract,
+                timeframe, fromdate, todate, whatToShow, useRTH)
+
+    def getbars_tostore(self, contract, store, symbol=None,
+            timeframe='1 min', fromdate=None, todate=None,
+            whatToShow='MIDPOINT', useRTH=True):
+        '''Download the bars from fromdate to todate of the contract and
+        save them in the bar store (barstore.BarStore) chunk by chunk, the
+        range is never loaded in memory. Return the metadata of dataset.
+        '''
+        if todate is None:
+            todate = dt.datetime.now()
+        return self.getdownloader().download_tostore(contract, timeframe,
+                fromdate, todate, store, symbol, whatToShow, useRTH,
+                ticksize=self.getticksize(contract),
+                exchange=contract.exchange)
+
+    def run_until_complete(self, awaitable, name=''):
+        '''Run the awaitable (async downloads) and return the result. The
+        progress of downloads is printed while running.
+        '''
+        return self.getdownloader().run(awaitable, name)
+
+    def getdata_cached(self, contract, store, symbol=None,
+            timeframe='1 min', duration='1 D', whatToShow='MIDPOINT',
+            useRTH=True):
+        '''Return the bars of the duration (barframe.BarFrame) from the
+        bar store (barstore.BarStore). Only the ranges missing in the
+        store are downloaded (datacache.HistoricalCache).
+        '''
+        cache = datacache.HistoricalCache(self, store, whatToShow, useRTH)
+        return cache.update(contract, symbol, timeframe, duration)
+
+    def getdata_tostore(self, contract, store, symbol=None,
+            timeframe='1 min', duration='1 D', merge=True):
+        '''Download data with contract as input parameter and save it in
+        the bar store (barstore.BarStore) with the tick size of contract.
+        Return the metadata of dataset.
+        '''
+        dataframe = self.getdata_fromct(contract, timeframe, duration)
+        if symbol is None:
+            symbol = contract.localSymbol or contract.symbol
+        args = {
+                'symbol':symbol,
+                'bars':dataframe,
+                'barsize':timeframe,
+                'ticksize':self.getticksize(contract),
+                'exchange':contract.exchange,
                 'whatToShow':'MIDPOINT',
-                'useRTH':True,
                 }
-        
-        dataframe = util.df(self.client.reqHistoricalData(**data_args))
-        dataframe = dataframe.rename(
-                columns={'close':'Close', 
-                    'open':'Open',
-                    'date':'datetime', 
-                    'high':'High', 
-                    'low':'Low'})
-        return dataframe
-            
+        if merge:
+            return store.merge(**args)
+        return store.write(**args)
+
+    async def getdata_batch_async(self, jobs, store, concurrency=4):
+        '''Async version of getdata_batch.
+        '''
+        semaphore = asyncio.Semaphore(concurrency)
+
+        # Contracts of all jobs are qualified at once
+        specs = []
+        for job in jobs:
+            job = dict(job)
+            contract = job.pop('contract', None)
+            name = job.pop('name', None)
+            spec = {
+                    'timeframe':job.pop('timeframe', '1 min'),
+                    'duration':job.pop('duration', '1 D'),
+                    'whatToShow':job.pop('whatToShow', 'MIDPOINT'),
+                    'useRTH':job.pop('useRTH', True),
+                    }
+            if contract is None:
+                contract = getcontract(**job)
+            if name is None:
+                name = datacache.contract_name(contract)
+            specs.append((name, contract, spec))
+        qualified = await self.qualify_async({name: contract
+            for name, contract, spec in specs})
+
+        async def download(name, contract, spec):
+            cache = datacache.HistoricalCache(self, store,
+                    spec['whatToShow'], spec['useRTH'])
+            async with semaphore:
+                try:
+                    bars = await cache.update_async(
+                            qualified.get(name, contract), name,
+                            spec['timeframe'], spec['duration'])
+                except Exception as e:
+                    print('[ Download Error: %s ] %s' % (name, e))
+                    return name, None
+            print('[ Download Finished: %s ] %d bars' % (name, len(bars)))
+            return name, bars
+
+        results = await asyncio.gather(*[download(*spec) for spec in specs])
+        return dict(results)
+
+    def getdata_batch(self, jobs, store, concurrency=4):
+        '''Download the jobs concurrently with the connection of the
+        client and save them in the bar store (barstore.BarStore), each
+        symbol is saved when it's finished. Only the ranges missing in the
+        store are downloaded. Return a dictionary of name and bars
+        (BarFrame, None if the download failed).
+
+        Each job is a dictionary with 'contract' or the getcontract
+        arguments (symbol, symboltype, exchange, currency...), and
+        optionally 'name' (dataset symbol), 'timeframe', 'duration',
+        'whatToShow' and 'useRTH'. The concurrency is the maximum number
+        of symbols downloaded at the same time.
+        '''
+        return self.run_until_complete(self.getdata_batch_async(jobs, store,
+            concurrency), 'batch')
 
     def getearliestbar(self, symbol, symboltype, exchange, **kwargs):
         '''Get oldest bar date
@@ -271,6 +452,19 @@ class IBDataClient:
 
         return self.client.reqHeadTimeStamp(**args)
 
+    def getearliestbar_fromct(self, contract, whatToShow='MIDPOINT',
+            useRTH=True):
+        '''Get oldest bar date with contract as input parameter.
+        '''
+        return self.client.reqHeadTimeStamp(contract, whatToShow, useRTH)
+
+    async def getearliestbar_async(self, contract, whatToShow='MIDPOINT',
+            useRTH=True):
+        '''Async version of getearliestbar_fromct.
+        '''
+        return await self.client.reqHeadTimeStampAsync(contract, whatToShow,
+                useRTH, 1)
+
     def getexecutions(self):
         '''Request the executions and return dataframes with contracts, executions and commission information.
         '''
@@ -300,10 +494,15 @@ class IBDataClient:
         return contracts, executions, reports
     
     def getmarketrules(self, contract):
-        '''Get market rules of the contract.
+        '''Get market rules (price increments) of the contract in the
+        exchange of the contract.
         '''
-        details = self.client.reqContractDetails(contract)
-        return self.client.reqMarketRule(details[0].marketRuleIds)
+        info = self.getcontractinfo(contract)
+        rule = info.marketRules.get(contract.exchange or info.exchange)
+        if rule is None:
+            rule = next(iter(info.marketRules.values()), [])
+        return [PriceIncrement(lowedge, increment)
+                for lowedge, increment in rule]
 
     def getpositions(self, symbol_filter=None):
         '''Return tuple with dataframes of positions and contracts.
@@ -344,31 +543,130 @@ class IBDataClient:
         #TODO
         print(self.client.tickers())
 
-    def getticksize(self, contract):
-        '''Get the minimum variation of price (tick size).
+    def getticksize(self, contract, price=None):
+        '''Get the minimum variation of price (tick size). With price,
+        the tick size of the price band of the market rule.
         '''
-        details = self.client.reqContractDetails(contract)
-        return float(details[0].minTick)
+        return self.getcontractinfo(contract).ticksize(price,
+                contract.exchange)
+
+    async def getticksize_async(self, contract, price=None):
+        '''Async version of getticksize.
+        '''
+        info = await self.getcontractinfo_async(contract)
+        return info.ticksize(price, contract.exchange)
 
     def getticksize_df(self, contract):
         '''Return a dataframe with symbol, contract type, exchange and tick size.
         '''
-        details = self.client.reqContractDetails(contract)
-        con_str = str(contract).split(',')
-        p1 = con_str[0]
-        _p1 = p1.split('(')
-        type_str = _p1[0]
-        symbol_str = _p1[1] 
-        p2 = con_str[1]
-        _p2 = p2.split('=')
-        exchange_str = _p2[1]
+        info = self.getcontractinfo(contract)
         return pd.DataFrame({
-            'Symbol':symbol_str.replace("'", ""),
-            'Tick Size':details[0].minTick, 
-            'Exchange':exchange_str.replace("'", "").replace(")", ""),
-            'Contract Type':type_str,
+            'Symbol':datacache.contract_name(contract),
+            'Tick Size':info.minTick,
+            'Exchange':contract.exchange or info.exchange,
+            'Contract Type':type(contract).__name__,
             }, index=[0])
 
+    def getcontractinfo(self, contract):
+        '''Return the details of the contract (contractcache.ContractInfo)
+        from the contract cache, the details are requested if they are
+        not in the cache.
+        '''
+        info = self.contracts.get(contract)
+        if info is None:
+            info = self.client.run(self.getcontractinfo_async(contract))
+        return info
+
+    async def getcontractinfo_async(self, contract):
+        '''Async version of getcontractinfo.
+        '''
+        info = self.contracts.get(contract)
+        if info is None:
+            await self.prefetch_async([contract])
+            info = self.contracts.get(contract)
+            if info is None:
+                raise ValueError('Contract not found: %s' % contract)
+        return info
+
+    def prefetch(self, contracts):
+        '''Request the details of the contracts missing in the contract
+        cache at the same time.
+        '''
+        if self.contracts.missing(contracts):
+            self.client.run(self.prefetch_async(contracts))
+
+    async def prefetch_async(self, contracts):
+        '''Async version of prefetch.
+        '''
+        missing = self.contracts.missing(contracts)
+        if not missing:
+            return
+
+        # Large universes are requested in groups
+        results = []
+        for i in range(0, len(missing), PREFETCH_SIZE):
+            results += await asyncio.gather(*[
+                self.client.reqContractDetailsAsync(contract)
+                for contract in missing[i:i + PREFETCH_SIZE]])
+
+        # Market rules are shared by contracts of the same exchange,
+        # each rule is requested once
+        ruleids = {int(ruleid) for details in results if details
+                for ruleid in details[0].marketRuleIds.split(',') if ruleid}
+        rules = await asyncio.gather(*[self._marketrule_async(ruleid)
+            for ruleid in ruleids])
+        rules = {ruleid: rule for ruleid, rule in zip(ruleids, rules)
+                if rule}
+
+        for contract, details in zip(missing, results):
+            if not details:
+                print('[ Contract Not Found ] %s' % contract)
+                continue
+            self.contracts.put(contract,
+                    contractcache.ContractInfo.from_details(details[0],
+                        rules))
+        self.contracts.save()
+
+    def qualify(self, contracts):
+        '''Return a dictionary of name and qualified contract (with conId)
+        of the contracts. The contracts are a dictionary of name and
+        contract, or a list of contracts or backtrader IB data names
+        ('EUR.USD-CASH-IDEALPRO'). The contracts are qualified at once with
+        the details of the contract cache, then the conIds are saved for
+        the next runs.
+        '''
+        return self.client.run(self.qualify_async(contracts))
+
+    async def qualify_async(self, contracts):
+        '''Async version of qualify.
+        '''
+        if not isinstance(contracts, dict):
+            contracts = {contract if isinstance(contract, str)
+                    else datacache.contract_name(contract): contract
+                    for contract in contracts}
+        contracts = {name: getcontract_fromname(contract)
+                if isinstance(contract, str) else contract
+                for name, contract in contracts.items()}
+
+        missing = {name: contract for name, contract in contracts.items()
+                if name not in self.qualified}
+        await self.prefetch_async(list(missing.values()))
+        for name, contract in missing.items():
+            info = self.contracts.get(contract)
+            if info is not None:
+                self.qualified[name] = info.contract()
+        return {name: self.qualified[name] for name in contracts
+                if name in self.qualified}
+
+    def _marketrule_async(self, ruleid):
+        '''Return the request of the market rule, concurrent requests of
+        the same rule wait for the same answer.
+        '''
+        if ruleid not in self._marketrules:
+            self._marketrules[ruleid] = asyncio.ensure_future(
+                    self.client.reqMarketRuleAsync(ruleid))
+        return self._marketrules[ruleid]
+
 
 '''Shortcut to download and save data
 '''
@@ -383,3 +681,14 @@ def run(args=None, **kwargs):
     datautils.save_data(dataframe, output_filename=output_fn)
     ib_client.close()
 
+def run_batch(jobs, host=HOST, port=PORT, clientid=CLIENT_ID,
+        directory='data', concurrency=4):
+    '''Shortcut to download the jobs (see IBDataClient.getdata_batch) in
+    the bar store of the directory with one connection.
+    '''
+    ib_client = IBDataClient(host, port, clientid)
+    try:
+        return ib_client.getdata_batch(jobs, barstore.BarStore(directory),
+                concurrency)
+    finally:
+        ib_client.close()
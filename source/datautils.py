@@ -1,12 +1,47 @@
 # -*- coding: utf-8 -*-
 
+import array
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime as dt
-from market_profile import MarketProfile, MarketProfileSlice
+import backtrader as bt
+from dateutil.tz import tzlocal
+import profileutils as pu
+import barframe as bf
+
+# Ordinal of 1970-01-01 in backtrader float dates
+EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+MUSECONDS_PER_DAY = 24 * 60 * 60 * 10**6
+
+def num2datetime64(values):
+    '''Convert an array of backtrader float dates (days since
+    0001-01-01 plus one) to datetime64[us]. Like backtrader num2date,
+    microseconds within 10 of a second are rounded to the second.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    musec = np.round((values - EPOCH_ORDINAL) * MUSECONDS_PER_DAY
+            ).astype(np.int64)
+    seconds = np.round(musec / 10**6).astype(np.int64) * 10**6
+    musec = np.where(np.abs(musec - seconds) < 10, seconds, musec)
+    return musec.astype('datetime64[us]')
+
+def datetime64tonum(values):
+    '''Convert an array of datetime64 (or int64 nanoseconds) to backtrader
+    float dates. The values are the same of backtrader date2num.
+    '''
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ns]').view(np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    days, nsec = np.divmod(values, 86400 * 10**9)
+    return (days + EPOCH_ORDINAL).astype(np.float64) + \
+            (nsec // 1000) / MUSECONDS_PER_DAY
 
 def generateprofiles(dataframe, ticksize=0.5, valuearea = 0.7, 
-        mp_mode='tpo', save_fig=True, name=''):
+        mp_mode='tpo', save_fig=True, name='', bins=pu.BINS_CLOSE,
+        renderer=None):
     '''Generate Market Profile from pandas Data Frame
 
     Params:
@@ -22,121 +57,208 @@ def generateprofiles(dataframe, ticksize=0.5, valuearea = 0.7,
         -mp_mode (default: 'tpo')
         Market Profile mode ('tpo' or 'vol')
 
+        -bins (default: 'Close')
+        Price binning of bars ('Close' for close price only or 'Range'
+        for all ticks between low and high)
+
         -save_fig (default: True)
         Create and save the Market Profile chart
 
         -name (default: '')
         Optional argument for prefix name
+
+        -renderer (default: None)
+        RenderService for saving the chart in background. If None the
+        chart is saved before returning
     '''
 
     # Generate Market Profile
-    mp = MarketProfile(
+    mp_slice = pu.build_profile(
             dataframe,
-            value_area_pct = valuearea,
-            tick_size=ticksize,
+            ticksize=ticksize,
+            valuearea=valuearea,
+            mode=mp_mode,
+            bins=bins,
             open_range_size=pd.to_timedelta(1, 'd'),
-            initial_balance_delta=pd.to_timedelta(1, 'h'),
-            mode=mp_mode)
+            initial_balance_delta=pd.to_timedelta(1, 'h'))
 
-    mp_slice = mp[0: len(dataframe.index)]
     profile = mp_slice.profile
 
     # Save figure
     if save_fig:
-        val, vah = mp_slice.value_area
-        plt.clf()
-        plt.axhline(y=val, color='yellow', linestyle= '-')
-        plt.axhline(y=vah, color='blue', linestyle= '-')
-        plt.plot(dataframe['Open'].iloc[0], color='red', marker='o')
-        fig = profile.plot(kind='barh')
         filename = name+'_'+mp_mode+'_'+str(dataframe['datetime'].iloc[
                     dataframe['datetime'].size-1])+'_'+\
                     str(dataframe['datetime'].iloc[0])
-        filename.replace(' ','_').replace(':','').replace('.','')+'.png'
-        fig.figure.savefig(filename)
+        if renderer is not None:
+            renderer.profile(profile, mp_slice.value_area,
+                    dataframe['Open'].iloc[0], ticksize, filename)
+        else:
+            plot_profile(profile, mp_slice.value_area,
+                    dataframe['Open'].iloc[0], filename)
     return profile, mp_slice
 
-def parsedata(data, from_date=None, to_date=None, size_limit=60*60*24):
-    '''Get data from backtrader cerebro and convert
-    in a pandas dataframe. The columns names are changed for
-    compatibility with Market Profile library. The dataframe 
-    can be filtered by date and size.
+def generatesessionprofiles(dataframe, ticksize=0.5, valuearea=0.7,
+        mp_mode='tpo', bins=pu.BINS_CLOSE, calendar=None, store=None,
+        name=''):
+    '''Generate the Market Profile levels of every session (day) of the
+    dataframe in a single pass. Return a Data Frame with one row for
+    each session (and value area) and columns 'session' (session key),
+    'session_start', 'mode', 'bins', 'valuearea', 'open', 'val', 'vah',
+    'poc', 'or_low' and 'or_high'.
+
+    Params:
+        - dataframe (required)
+        Pandas Data Frame with datetime and OHLCV columns, as downloaded
+        with dataclient or read from csv files
+
+        - ticksize (default: 0.5)
+        Size of ticks in Market Profile
+
+        - valuearea (default: 0.7)
+        Value Area parameter or list of parameters
+
+        -mp_mode (default: 'tpo')
+        Market Profile mode ('tpo' or 'vol')
+
+        -bins (default: 'Close')
+        Price binning of bars ('Close' or 'Range')
+
+        -calendar (default: None)
+        SessionCalendar of sessions. If None the sessions are calendar days
+
+        -store (default: None)
+        ProfileStore of the session histograms. If None the histograms
+        are always generated
+
+        -name (default: '')
+        Symbol of the data in the store keys
     '''
-    timestamp = []
-    datetime = []
-    
-    # Define maximum size of data
-    _size = size_limit if len(data) > size_limit else len(data)
+    times, values = bf.find_columns(dataframe)
 
-    open = data.open.get(ago=0, size=_size)
-    high = data.high.get(ago=0, size=_size)
-    low = data.low.get(ago=0, size=_size)
-    close = data.close.get(ago=0, size=_size)
-    volume = data.volume.get(ago=0, size=_size)
+    sessions = None
+    if calendar is not None:
+        sessions = calendar.index(times).keys
 
-    for i in range(-_size+1, 1,  1):
-        timestamp.append(dt.datetime.timestamp(data.datetime.datetime(i)))
-        datetime.append(data.datetime.datetime(i))
-    
-    dataframe = pd.DataFrame({
-            'timestamp':timestamp,
-            'datetime':datetime,
-            'Close':close,
-            'High':high,
-            'Low':low,
-            'Open':open,
-            'Volume':volume},
-            )
+    histograms = None
+    if store is not None and len(times) > 0:
+        histograms = store.session_histograms(
+                name,
+                times,
+                values['open'],
+                values['high'],
+                values['low'],
+                values['close'],
+                values['volume'],
+                ticksize=ticksize,
+                mode=mp_mode,
+                bins=bins,
+                sessions=sessions)
 
-    dataframe['Close'] = dataframe['Close'].astype('float')
-    dataframe['Volume'] = dataframe['Volume'].astype('float')
+    return pu.build_session_profiles(
+            times,
+            values['open'],
+            values['high'],
+            values['low'],
+            values['close'],
+            values['volume'],
+            ticksize=ticksize,
+            valuearea=valuearea,
+            mode=mp_mode,
+            bins=bins,
+            sessions=sessions,
+            histograms=histograms)
 
-    # To work properly with Market Profile library
-    dataframe['datetime'] = pd.to_datetime(dataframe['datetime'],
-            format = '%Y-%m-%d %H:%M:%S', 
-            infer_datetime_format=True).dt.strftime('%Y%m%d %H:%M')
-    dataframe=dataframe.set_index('datetime',drop=False)
-    dataframe.index = pd.to_datetime(dataframe.index)
+def plot_profile(profile, value_area, open_price, filename):
+    '''Plot the Market Profile with Value Area lines and open price
+    and save the figure.
+    '''
+    val, vah = value_area
+    plt.clf()
+    plt.axhline(y=val, color='yellow', linestyle= '-')
+    plt.axhline(y=vah, color='blue', linestyle= '-')
+    plt.plot(open_price, color='red', marker='o')
+    fig = profile.plot(kind='barh')
+    filename = filename.replace(' ','_').replace(':','').replace('.','')+'.png'
+    fig.figure.savefig(filename)
 
-    # Filter by date
-    if from_date is not None:
-        dataframe = dataframe.query('timestamp >= %s' % str(from_date))
-    if to_date is not None:
-        dataframe = dataframe.query('timestamp <= %s' % str(to_date))
+def line_array(line):
+    '''Return the values of a backtrader line until the current bar as
+    a NumPy array. The buffer of the line is not copied, then the array
+    must not be kept after the next bar (the buffer can't grow while it
+    is used by NumPy).
+    '''
+    values = line.array
+    if isinstance(values, array.array):
+        if len(values) == 0:
+            return np.empty(0, dtype=np.float64)
+        values = np.frombuffer(values, dtype=np.float64)
+    else:
+        # Lines with exactbars keep the values in a deque
+        values = np.array(values, dtype=np.float64)
+    return values[:line.idx + 1]
 
-    return dataframe
+def bt_date2num(value, tz=None):
+    '''Convert a datetime, Timestamp or POSIX timestamp (float) to
+    backtrader float date.
+    '''
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        value = dt.datetime.fromtimestamp(value)
+    return bt.date2num(pd.Timestamp(value).to_pydatetime(), tz=tz)
 
-def parsedataframe(dataframe, from_date=None, to_date=None, size_limit=60*60*24):
+def parsedata(data, from_date=None, to_date=None, size_limit=60*60*24):
     '''Get data from backtrader cerebro and convert
     in a pandas dataframe. The columns names are changed for
     compatibility with Market Profile library. The dataframe 
-    can be filtered by date and size.
+    can be filtered by date (datetime or POSIX timestamp) and size.
+    The dates are searched in the line buffer and only the selected
+    bars are copied.
     '''
-    timestamp = []
-    datetime = []
-    
-    # Define maximum size of data
-    _size = size_limit if dataframe.size > size_limit else dataframe.size
-    
+    tz = getattr(data.datetime, '_tz', None)
+    dates = line_array(data.datetime)
 
-    dataframe['Close'] = dataframe['Close'].astype('float')
-    #dataframe['Volume'] = dataframe['Volume'].astype('float')
-
-    # To work properly with Market Profile library
-    dataframe['datetime'] = pd.to_datetime(dataframe['datetime'],
-            format = '%Y-%m-%d %H:%M:%S', 
-            infer_datetime_format=True).dt.strftime('%Y%m%d %H:%M')
-    dataframe=dataframe.set_index('datetime',drop=False)
-    dataframe.index = pd.to_datetime(dataframe.index)
+    # Define maximum size of data
+    end = len(dates)
+    begin = max(0, end - size_limit)
 
     # Filter by date
     if from_date is not None:
-        dataframe = dataframe.query('timestamp >= %s' % str(from_date))
+        begin = max(begin, int(np.searchsorted(dates,
+            bt_date2num(from_date, tz), side='left')))
     if to_date is not None:
-        dataframe = dataframe.query('timestamp <= %s' % str(to_date))
+        end = int(np.searchsorted(dates, bt_date2num(to_date, tz),
+            side='right'))
+    end = max(begin, end)
+
+    datetime = pd.DatetimeIndex(num2datetime64(dates[begin:end]).astype(
+        'datetime64[ns]'))
+    if tz is not None:
+        datetime = datetime.tz_localize('UTC').tz_convert(tz
+                ).tz_localize(None)
+    del dates
+
+    dataframe = pd.DataFrame({
+            'timestamp':datetime.tz_localize(tzlocal(),
+                ambiguous='NaT', nonexistent='NaT').asi8 / 10**9,
+            'datetime':datetime,
+            'Close':np.array(line_array(data.close)[begin:end]),
+            'High':np.array(line_array(data.high)[begin:end]),
+            'Low':np.array(line_array(data.low)[begin:end]),
+            'Open':np.array(line_array(data.open)[begin:end]),
+            'Volume':np.array(line_array(data.volume)[begin:end])},
+            index=pd.DatetimeIndex(datetime, name='datetime'),
+            )
 
     return dataframe
 
+def parsedataframe(dataframe, from_date=None, to_date=None, size_limit=60*60*24):
+    '''Convert a Data Frame downloaded with dataclient or read from csv
+    files to the format of parsedata. The dataframe can be filtered by
+    date (datetime or POSIX timestamp) and size (number of last bars).
+    The input Data Frame is not changed.
+    '''
+    bars = bf.BarFrame.from_dataframe(dataframe).last(size_limit)
+    return bars.between(from_date, to_date).to_dataframe()
+
 def save_data(dataframe, output_filename='out.csv', sep=',', **kwargs):
     args = {
             'path_or_buf':output_filename,
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+
+'''Download of long ranges of historical data. The range is split in
+chunks with the maximum duration of the bar size, the chunks are
+requested concurrently with the async api of ib_insync under the pacing
+rules of IB (token buckets) and each chunk is saved on disk when it's
+received, then the memory used doesn't depend on the range. The
+chunks are read one by one (iter_parts) or copied once in the result.
+'''
+
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+
+import numpy as np
+import pandas as pd
+from ib_insync import util
+
+import barframe as bf
+import datacache as dc
+
+# Maximum duration (seconds) of requests by bar size (seconds), from the
+# valid durations of IB historical data
+MAX_DURATIONS = (
+        (1, 1800),
+        (5, 3600),
+        (15, 4 * 60 * 60),
+        (30, 8 * 60 * 60),
+        (60, 24 * 60 * 60),
+        (2 * 60, 2 * 24 * 60 * 60),
+        (20 * 60, 7 * 24 * 60 * 60),
+        (24 * 60 * 60 - 1, 30 * 24 * 60 * 60),
+        )
+MAX_DURATION = 365 * 24 * 60 * 60
+
+# Pacing of requests (tokens per second, capacity). The requests of the
+# same contract are limited to 5 in 2 seconds, the requests of bars of 30
+# seconds or less are limited to 60 in 10 minutes
+CONTRACT_PACING = (2., 1)
+SMALL_BARS_PACING = (30 / 600., 30)
+SMALL_BARS = 30
+
+# Maximum number of requests in flight
+MAX_INFLIGHT = 50
+
+# Seconds between progress reports
+REPORT_INTERVAL = 10
+
+# Columns of util.df of historical bars (BarData)
+FRAME_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume',
+        'average', 'barCount']
+
+def max_chunk_seconds(barsize):
+    '''Return the maximum duration (seconds) of one request of the bar
+    size ('1 min' -> 86400).
+    '''
+    seconds = dc.barsize_seconds(barsize)
+    for size, duration in MAX_DURATIONS:
+        if seconds <= size:
+            return duration
+    return MAX_DURATION
+
+def chunk_ranges(start, end, barsize):
+    '''Return the [begin, finish) ranges of requests from start to end,
+    sorted from the most recent.
+    '''
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    chunk = pd.Timedelta(seconds=max_chunk_seconds(barsize))
+    result = []
+    while end > start:
+        result.append((max(start, end - chunk), end))
+        end = end - chunk
+    return result
+
+class TokenBucket(object):
+    '''Token bucket of requests. The bucket has capacity tokens, each
+    request takes one token and the tokens are refilled with the rate.
+
+    Parameters:
+
+      - rate
+
+      Tokens added by second
+
+      - capacity
+
+      Maximum number of tokens
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def delay(self):
+        '''Return the seconds until one token is available.
+        '''
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        '''Take one token. Return the seconds waited.
+        '''
+        waited = 0.
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                self.tokens -= 1
+                return waited
+            waited += delay
+            await asyncio.sleep(delay)
+
+class DownloadStats(object):
+    '''Progress of downloads.
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.chunks = 0
+        self.completed = 0
+        self.empty = 0
+        self.bars = 0
+        self.inflight = 0
+        self.pacing_waits = 0
+        self.pacing_seconds = 0.
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def bars_per_second(self):
+        elapsed = self.elapsed()
+        return self.bars / elapsed if elapsed > 0 else 0.
+
+    def report(self, name=''):
+        print('[ Download %s ] %d/%d chunks, %d bars, %.0f bars/s, '
+                '%d in flight, %d pacing waits (%.1f s)' % (name,
+                    self.completed, self.chunks, self.bars,
+                    self.bars_per_second(), self.inflight,
+                    self.pacing_waits, self.pacing_seconds))
+
+def part_columns(bars):
+    '''Return the columns of a chunk (BarFrame or Data Frame of util.df)
+    as arrays. The date of Data Frames is datetime64[ns] without timezone,
+    like the time of BarFrame.
+    '''
+    if isinstance(bars, pd.DataFrame):
+        columns = {str(name): bars[name].to_numpy() for name in bars.columns}
+        columns['date'] = bf.find_columns(bars)[0]
+        return columns
+    return {name: getattr(bars, name) for name in ('time',) + bf.COLUMNS}
+
+def save_part(directory, bars):
+    '''Save the bars of a chunk (BarFrame or Data Frame of util.df) in
+    the directory. Return the filename.
+    '''
+    columns = part_columns(bars)
+    times = columns['date' if 'date' in columns else 'time']
+    first = np.asarray(times[:1]).astype('datetime64[ns]').view(np.int64)
+    filename = os.path.join(directory, '%020d.npz' % (first[0]
+        if len(first) > 0 else 0))
+    np.savez(filename, **columns)
+    return filename
+
+def concat_parts(filenames):
+    '''Return the columns of chunks saved with save_part. The filenames
+    are sorted by the time of the first bar and the chunks don't overlap,
+    then the bars are sorted by time. The columns are allocated once with
+    the total size, only one chunk is loaded besides the result.
+    '''
+    filenames = sorted(filenames)
+    if not filenames:
+        return None
+    sizes = []
+    for filename in filenames:
+        with np.load(filename) as part:
+            sizes.append(len(part[part.files[0]]))
+            dtypes = {name: part[name].dtype for name in part.files}
+
+    columns = {name: np.empty(sum(sizes), dtype=dtype)
+            for name, dtype in dtypes.items()}
+    begin = 0
+    for filename, size in zip(filenames, sizes):
+        with np.load(filename) as part:
+            for name, values in columns.items():
+                values[begin:begin + size] = part[name]
+        begin += size
+    return columns
+
+def read_parts(filenames):
+    '''Return the bars of chunks saved with save_part as BarFrame.
+    '''
+    columns = concat_parts(filenames)
+    if columns is None:
+        return dc.EMPTY_BARS
+    return bf.BarFrame(**columns)
+
+def read_frame_parts(filenames):
+    '''Return the Data Frames of chunks saved with save_part as one Data
+    Frame with the columns of ib_insync (util.df).
+    '''
+    columns = concat_parts(filenames)
+    if columns is None:
+        return pd.DataFrame(columns=FRAME_COLUMNS)
+    return pd.DataFrame(columns)
+
+def iter_parts(filenames):
+    '''Yield the bars of each chunk saved with save_part (BarFrame)
+    sorted by time. Only one chunk is in memory.
+    '''
+    for filename in sorted(filenames):
+        with np.load(filename) as part:
+            yield bf.BarFrame(**{name: part[name] for name in part.files})
+
+class ChunkedDownloader(object):
+    '''Download of historical data in chunks. The pacing and the
+    requests in flight are shared by all downloads of the downloader.
+
+    Parameters:
+
+      - ib
+
+      Connected ib_insync IB object
+
+      - maxinflight (default: MAX_INFLIGHT)
+
+      Maximum number of requests in flight
+
+      - verbose (default: True)
+
+      Print the progress of downloads every REPORT_INTERVAL seconds
+    '''
+
+    def __init__(self, ib, maxinflight=MAX_INFLIGHT, verbose=True):
+        self.ib = ib
+        self.maxinflight = maxinflight
+        self.verbose = verbose
+        self.stats = DownloadStats()
+        self._semaphore = None
+        self._contract_buckets = dict()
+        self._small_bars_bucket = TokenBucket(*SMALL_BARS_PACING)
+
+    def buckets(self, contract, barsize):
+        '''Return the token buckets of the request.
+        '''
+        key = contract.conId or (contract.symbol, contract.secType,
+                contract.exchange, contract.currency)
+        if key not in self._contract_buckets:
+            self._contract_buckets[key] = TokenBucket(*CONTRACT_PACING)
+        buckets = [self._contract_buckets[key]]
+        if dc.barsize_seconds(barsize) <= SMALL_BARS:
+            buckets.append(self._small_bars_bucket)
+        return buckets
+
+    async def request_chunk(self, contract, barsize, begin, finish,
+            whatToShow, useRTH):
+        '''Request the bars of [begin, finish). Return a BarFrame.
+        '''
+        dataframe = await self.request_frame(contract, barsize, begin,
+                finish, whatToShow, useRTH)
+        if dataframe is None:
+            return dc.EMPTY_BARS
+        return bf.BarFrame.from_dataframe(dataframe)
+
+    async def request_frame(self, contract, barsize, begin, finish,
+            whatToShow, useRTH):
+        '''Request the bars of [begin, finish). Return the Data Frame of
+        ib_insync (util.df) or None if there are no bars.
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxinflight)
+
+        async with self._semaphore:
+            for bucket in self.buckets(contract, barsize):
+                waited = await bucket.acquire()
+                if waited > 0:
+                    self.stats.pacing_waits += 1
+                    self.stats.pacing_seconds += waited
+
+            self.stats.inflight += 1
+            try:
+                bars = await self.ib.reqHistoricalDataAsync(contract,
+                        endDateTime=finish.to_pydatetime(),
+                        durationStr=dc.seconds_duration(
+                            (finish - begin).total_seconds()),
+                        barSizeSetting=barsize,
+                        whatToShow=whatToShow,
+                        useRTH=useRTH)
+            finally:
+                self.stats.inflight -= 1
+
+        dataframe = util.df(bars) if bars else None
+        if dataframe is None:
+            return None
+        times = bf.find_columns(dataframe)[0]
+        inrange = (times >= begin.to_datetime64()) & \
+                (times < finish.to_datetime64())
+        if not inrange.any():
+            return None
+        return dataframe[inrange]
+
+    async def download_async(self, contract, barsize, start, end,
+            whatToShow='MIDPOINT', useRTH=True, directory=None,
+            frames=False):
+        '''Download the bars from start to end. Each chunk is saved in
+        the directory, return the list of filenames (read_parts,
+        iter_parts). With frames the chunks are the Data Frames of
+        ib_insync (read_frame_parts).
+        '''
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='download')
+        ranges = chunk_ranges(start, end, barsize)
+        self.stats.chunks += len(ranges)
+        request = self.request_frame if frames else self.request_chunk
+
+        async def download_chunk(begin, finish):
+            bars = await request(contract, barsize, begin, finish,
+                    whatToShow, useRTH)
+            self.stats.completed += 1
+            if bars is None or len(bars) == 0:
+                self.stats.empty += 1
+                return None
+            self.stats.bars += len(bars)
+            return save_part(directory, bars)
+
+        filenames = await asyncio.gather(*[download_chunk(begin, finish)
+            for begin, finish in ranges])
+        return [filename for filename in filenames if filename is not None]
+
+    async def download_bars_async(self, contract, barsize, start, end,
+            whatToShow='MIDPOINT', useRTH=True):
+        '''Download the bars from start to end and return a BarFrame. The
+        chunks are saved in a temporary directory until all are received.
+        '''
+        directory = tempfile.mkdtemp(prefix='download')
+        try:
+            filenames = await self.download_async(contract, barsize, start,
+                    end, whatToShow, useRTH, directory)
+            return read_parts(filenames)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    async def download_frame_async(self, contract, barsize, start, end,
+            whatToShow='MIDPOINT', useRTH=True):
+        '''Download the bars from start to end and return a Data Frame
+        with the columns of ib_insync (util.df), like a single request.
+        The chunks are saved in a temporary directory until all are
+        received.
+        '''
+        directory = tempfile.mkdtemp(prefix='download')
+        try:
+            filenames = await self.download_async(contract, barsize, start,
+                    end, whatToShow, useRTH, directory, frames=True)
+            return read_frame_parts(filenames)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    async def download_tostore_async(self, contract, barsize, start, end,
+            store, symbol=None, whatToShow='MIDPOINT', useRTH=True,
+            **kwargs):
+        '''Download the bars from start to end and save them in the bar
+        store (barstore.BarStore) chunk by chunk, the bars are never
+        loaded at once. The whatToShow and the other keyword arguments are
+        saved in metadata. Return the metadata of dataset.
+        '''
+        if symbol is None:
+            symbol = dc.contract_name(contract)
+        directory = tempfile.mkdtemp(prefix='download')
+        try:
+            filenames = await self.download_async(contract, barsize, start,
+                    end, whatToShow, useRTH, directory)
+            metadata = None
+            for bars in iter_parts(filenames):
+                metadata = store.append(symbol, bars, barsize,
+                        whatToShow=whatToShow, **kwargs)
+            if metadata is None:
+                metadata = store.append(symbol, dc.EMPTY_BARS, barsize,
+                        whatToShow=whatToShow, **kwargs)
+            return metadata
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    async def report_async(self, name='', interval=REPORT_INTERVAL):
+        '''Print the progress every interval seconds until cancelled.
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            self.stats.report(name)
+
+    async def _reporting(self, awaitable, name):
+        reporter = None
+        if self.verbose:
+            reporter = asyncio.ensure_future(self.report_async(name))
+        try:
+            return await awaitable
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+
+    def run(self, awaitable, name=''):
+        '''Run the awaitable (downloads) in the event loop of ib_insync,
+        the progress is printed while running.
+        '''
+        result = self.ib.run(self._reporting(awaitable, name))
+        if self.verbose:
+            self.stats.report(name)
+        return result
+
+    def download(self, contract, barsize, start, end, whatToShow='MIDPOINT',
+            useRTH=True):
+        '''Download the bars from start to end and return a BarFrame.
+        '''
+        return self.run(self.download_bars_async(contract, barsize, start,
+            end, whatToShow, useRTH), dc.contract_name(contract))
+
+    def download_frame(self, contract, barsize, start, end,
+            whatToShow='MIDPOINT', useRTH=True):
+        '''Download the bars from start to end and return a Data Frame
+        with the columns of ib_insync (util.df).
+        '''
+        return self.run(self.download_frame_async(contract, barsize, start,
+            end, whatToShow, useRTH), dc.contract_name(contract))
+
+    def download_tostore(self, contract, barsize, start, end, store,
+            symbol=None, whatToShow='MIDPOINT', useRTH=True, **kwargs):
+        '''Download the bars from start to end and save them in the bar
+        store. Return the metadata of dataset.
+        '''
+        return self.run(self.download_tostore_async(contract, barsize,
+            start, end, store, symbol, whatToShow, useRTH, **kwargs),
+            symbol or dc.contract_name(contract))
@@ -6,7 +6,12 @@ import backtrader.feeds as btfeeds
 import backtrader.analyzers as analyzer
 import argparse
 from strategies.fadesystem import FadeSystemIB
+from strategies.optparams import PROFILE_TABLES
 import datautils
+import barframe
+import barfeed
+import barstore
+import sessionutils
 from dataclient import *
 from ib_insync import *
 
@@ -23,6 +28,8 @@ DOWNLOAD_DATA = False
 CONTRACT = Forex('EURUSD', 'IDEALPRO', 'EUR') 
 DATA_TIMEFRAME = '1 min'
 DATA_DURATION = '20 D'
+# Bar store of downloaded data, only the missing bars are downloaded
+STORE_DIRECTORY = 'data'
 
 # Strategy Default Parameters
 MA_PERIOD = 5
@@ -33,6 +40,8 @@ TAKEPROFIT = 3000
 MP_VALUEAREA = 0.75
 POSITION_TIME_DECAY = 60*60
 MINIMUM_PRICE_CHANGE = 0.0001
+# Session calendar of the strategy and of the session profiles
+SESSION_CALENDAR = 'day'
 
 def parse_args(pargs=None):
     parser = argparse.ArgumentParser(
@@ -111,6 +120,22 @@ def parse_args(pargs=None):
             help='Minimum price change for opening a new order'
             )
 
+    parser.add_argument(
+            '--save_figures', '-fig',
+            required=False,
+            default=False,
+            action='store_true',
+            help='Save the charts of session profiles and orders'
+            )
+
+    parser.add_argument(
+            '--intrabar', '-ib',
+            required=False,
+            default=False,
+            action='store_true',
+            help='Compare the stops with the high and low of bars'
+            )
+
     if pargs is not None:
         return parser.parse_args(pargs)
     return parser.parse_args()
@@ -126,32 +151,31 @@ def run_strategy(args=None, **kwargs):
     ticksize = dataclient.getticksize(CONTRACT)
     if DOWNLOAD_DATA:
         print('[ Downloading Data ]')
-        data = dataclient.getdata_fromct(
+        bars = dataclient.getdata_cached(
                 contract=CONTRACT,
+                store=barstore.BarStore(STORE_DIRECTORY),
+                symbol=DATANAME,
                 timeframe=DATA_TIMEFRAME,
                 duration=DATA_DURATION)
-
-        datautils.save_data(data, output_filename=DATANAME)
+    else:
+        bars = barframe.BarFrame.from_csv(DATANAME)
 
     dataclient.close()
     
     cerebro = bt.Cerebro()
     
-    data = btfeeds.GenericCSVData(
-            dataname = DATANAME,
-            nullvalue = 0., 
-            dtformat = ('%Y-%m-%d %H:%M:%S'),
-            date = 0,
-            open = 1,
-            high = 2,
-            low = 3,
-            close = 4,
-            volume = 5,
+    data = barfeed.ArrayData(
+            dataname = bars,
+            name = DATANAME,
             timeframe = bt.TimeFrame.Minutes,
             )
     
     cerebro.adddata(data)
 
+    PROFILE_TABLES.update({data._name: datautils.generatesessionprofiles(
+        bars.to_dataframe(), ticksize, args.value_area,
+        calendar=sessionutils.SessionCalendar.from_name(SESSION_CALENDAR))})
+
     cerebro.resampledata(data, timeframe=bt.TimeFrame.Minutes, compression=5)
 
     strategy_args = {
@@ -164,6 +188,9 @@ def run_strategy(args=None, **kwargs):
             'takeprofit':args.takeprofit,
             'positiontimedecay':args.time_decay,
             'minimumchangeprice':args.minimum_price, 
+            'session_calendar':SESSION_CALENDAR,
+            'savefigures':args.save_figures,
+            'intrabar':args.intrabar,
             }
 
     cerebro.addstrategy(FadeSystemIB, **strategy_args)
@@ -7,9 +7,15 @@ import pandas as pd
 import argparse
 from tabulate import tabulate
 from strategies.fadesystem import FadeSystemIB
+from strategies.optparams import PROFILE_TABLES
 from ib_insync import *
 from dataclient import *
 import datautils
+import barframe
+import barfeed
+import barstore
+import profilestore
+import sessionutils
 
 # Input File
 DEFAULT_FILE = 'EURUSD'
@@ -24,6 +30,12 @@ CLIENTID = 1234
 DOWNLOAD_DATA = True
 DATA_DURATION = '5 D'
 DATA_TIMEFRAME = '1 min'
+# Bar store of downloaded data, only the missing bars are downloaded
+STORE_DIRECTORY = 'data'
+# Market Profile store, the profiles are reused by the next optimizations
+PROFILE_STORE_DIRECTORY = 'profiles'
+# Session calendar of the strategy and of the session profiles
+SESSION_CALENDAR = 'day'
 
 # Results Output File
 OUTPUT_FILENAME = 'results.csv'
@@ -80,6 +92,22 @@ def parse_args(pargs=None):
             type= str,
             help= 'Input File Name')
 
+    parser.add_argument(
+            '--save_figures', '-fig',
+            required=False,
+            default=False,
+            action='store_true',
+            help='Save the charts of session profiles and orders'
+            )
+
+    parser.add_argument(
+            '--intrabar', '-ib',
+            required=False,
+            default=False,
+            action='store_true',
+            help='Compare the stops with the high and low of bars'
+            )
+
     if pargs is not None:
         return parser.parse_args(pargs)
     return parser.parse_args()
@@ -124,33 +152,42 @@ def run_optimization(args=None, **kwargs):
     client = IBDataClient(HOST, PORT, CLIENTID)
     ticksize = client.getticksize(CONTRACT)
     params.update({'mp_ticksize':ticksize})
+    params.update({'mp_store':PROFILE_STORE_DIRECTORY})
+    params.update({'session_calendar':SESSION_CALENDAR})
+    params.update({'savefigures':args.save_figures})
+    params.update({'intrabar':args.intrabar})
 
     if DOWNLOAD_DATA:
         print('[ Downloading Data ]')
-        data = client.getdata_fromct(
+        bars = client.getdata_cached(
                 CONTRACT,
+                barstore.BarStore(STORE_DIRECTORY),
+                args.data,
                 DATA_TIMEFRAME,
                 DATA_DURATION)
-        datautils.save_data(data, output_filename=args.data)
+    else:
+        bars = barframe.BarFrame.from_csv(args.data)
     client.close()
 
     cerebro = bt.Cerebro()
     cerebro.broker.set_cash(10000.)
     cerebro.broker.setcommission(0.002)
 
-    data = btfeeds.GenericCSVData(
-            dataname = args.data,
-            nullvalue = 0.,
-            dtformat = ('%Y-%m-%d %H:%M:%S'),
-            date = 0,
-            open = 1,
-            high = 2,
-            low = 3,
-            close = 4,
-            volume = 5,
-            timeframe = bt.TimeFrame.Minutes)
+    data = barfeed.ArrayData(
+            dataname = bars,
+            name = args.data,
+            timeframe = bt.TimeFrame.Minutes,
+            )
 
     cerebro.adddata(data)
+
+    # Market Profiles of all sessions are generated before the optimization
+    PROFILE_TABLES.update({data._name: datautils.generatesessionprofiles(
+        bars.to_dataframe(), ticksize, MP_VALUEAREA_RANGE,
+        calendar=sessionutils.SessionCalendar.from_name(SESSION_CALENDAR),
+        store=profilestore.getstore(PROFILE_STORE_DIRECTORY),
+        name=data._name)})
+
     cerebro.resampledata(
             data, 
             timeframe = bt.TimeFrame.Minutes,
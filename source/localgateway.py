@@ -0,0 +1,790 @@
+# -*- coding: utf-8 -*-
+
+'''Local stand-in of the IB gateway for tests and benchmarks without TWS.
+The gateway speaks the socket protocol of the IB API used by ib_insync:
+contract details and market rules of the configured symbols, historical
+bars read from local files, real-time bars replayed from the same files
+and simulated orders (acknowledgement and fills after a configurable
+latency), with the positions, executions and account values of one
+account.
+
+Only the protocol of ib_insync (server version 157) is served. IbPy,
+used by backtrader IBStore for the orders of the live scripts, speaks the
+legacy protocol; its handshake is answered with an unsupported server
+version and the client disconnects with an error, then the orders of
+IBStore need TWS or the IB gateway.
+
+Run python localgateway.py --forex EURUSD=../tests/eurusd.csv and connect
+the data client or the live scripts to 127.0.0.1:7497.
+'''
+
+import time
+import struct
+import asyncio
+import argparse
+import threading
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import barframe as bf
+import datacache as dc
+
+HOST = '127.0.0.1'
+PORT = 7497
+
+# Protocol version of the gateway (minimum version of ib_insync)
+SERVER_VERSION = 157
+# Server version answered to legacy clients (IbPy), lower than the
+# minimum of any client
+LEGACY_SERVER_VERSION = 0
+
+# Account of the gateway
+ACCOUNT = 'DU0000001'
+INITIAL_CASH = 1000000.
+
+# Default tick sizes by security type
+TICKSIZES = {
+        'CASH':0.00005,
+        'STK':0.01,
+        'FUT':0.25,
+        'IND':0.01,
+        }
+
+# Default exchanges by security type
+EXCHANGES = {
+        'CASH':'IDEALPRO',
+        'STK':'SMART',
+        'FUT':'GLOBEX',
+        'IND':'CBOE',
+        }
+
+# Message ids of the gateway
+MSG_ORDER_STATUS = 3
+MSG_ERROR = 4
+MSG_ACCOUNT_VALUE = 6
+MSG_NEXT_VALID_ID = 9
+MSG_CONTRACT_DETAILS = 10
+MSG_EXEC_DETAILS = 11
+MSG_MANAGED_ACCOUNTS = 15
+MSG_HISTORICAL_DATA = 17
+MSG_CURRENT_TIME = 49
+MSG_REALTIME_BAR = 50
+MSG_CONTRACT_DETAILS_END = 52
+MSG_OPEN_ORDER_END = 53
+MSG_ACCOUNT_DOWNLOAD_END = 54
+MSG_EXEC_DETAILS_END = 55
+MSG_COMMISSION_REPORT = 59
+MSG_POSITION = 61
+MSG_POSITION_END = 62
+MSG_ACCOUNT_SUMMARY = 63
+MSG_ACCOUNT_SUMMARY_END = 64
+MSG_ACCOUNT_UPDATE_MULTI = 73
+MSG_ACCOUNT_UPDATE_MULTI_END = 74
+MSG_HEAD_TIMESTAMP = 88
+MSG_MARKET_RULE = 93
+MSG_COMPLETED_ORDERS_END = 102
+
+def resample(bars, seconds):
+    '''Return the bars joined in bars of the seconds. The bars are sorted
+    by time, the first bar of each interval gives the open.
+    '''
+    if len(bars) == 0:
+        return bars
+    keys = bars.time // (seconds * 1000000000)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    return bf.BarFrame(keys[starts] * seconds * 1000000000,
+            bars.open[starts],
+            np.maximum.reduceat(bars.high, starts),
+            np.minimum.reduceat(bars.low, starts),
+            bars.close[ends],
+            np.add.reduceat(bars.volume, starts))
+
+def parse_time(value):
+    '''Return the local time (datetime64) of an IB datetime of requests
+    ('20190902 10:00:00 UTC'). Empty values are None.
+    '''
+    if not value:
+        return None
+    date, clock, *zone = value.replace('-', ' ').split()
+    value = dt.datetime.strptime(date + clock, '%Y%m%d%H:%M:%S')
+    if zone and zone[0] == 'UTC':
+        value = value.replace(tzinfo=dt.timezone.utc).astimezone().replace(
+                tzinfo=None)
+    return bf.to_datetime64(value)
+
+def format_time(value):
+    '''Return the IB datetime of bars ('20190902  10:00:00').
+    '''
+    return str(value.astype('datetime64[s]').item().strftime(
+        '%Y%m%d  %H:%M:%S'))
+
+class GatewaySymbol(object):
+    '''Contract and bars of a symbol of the gateway.
+
+    Parameters:
+
+      - name
+
+      Name of the symbol ('EURUSD', 'AMD')
+
+      - bars
+
+      Bars of the symbol (BarFrame or csv filename)
+
+      - conId
+
+      Contract id
+
+      - secType (default: 'STK')
+
+      Security type ('CASH', 'STK', 'FUT', 'IND')
+
+      - barsize (default: '1 min')
+
+      Bar size of the bars
+
+      Other arguments are the contract fields (exchange, currency,
+      ticksize, multiplier, lastTradeDateOrContractMonth)
+    '''
+
+    def __init__(self, name, bars, conId, secType='STK', barsize='1 min',
+            exchange=None, currency='USD', ticksize=None, multiplier='',
+            lastTradeDateOrContractMonth=''):
+        if isinstance(bars, str):
+            bars = bf.BarFrame.from_csv(bars)
+        self.name = name
+        self.bars = bars
+        self.conId = conId
+        self.secType = secType
+        self.barsize = barsize
+        self.exchange = exchange or EXCHANGES.get(secType, 'SMART')
+        self.ticksize = ticksize or TICKSIZES.get(secType, 0.01)
+        self.multiplier = multiplier
+        self.lastTradeDateOrContractMonth = lastTradeDateOrContractMonth
+
+        if secType == 'CASH':
+            self.symbol = name[:3]
+            self.currency = name[3:] or currency
+            self.localSymbol = '%s.%s' % (self.symbol, self.currency)
+        else:
+            self.symbol = name
+            self.currency = currency
+            self.localSymbol = name
+
+        # Last price (replayed bars or last bar of the file)
+        self.price = float(bars.close[-1]) if len(bars) > 0 else 0.
+
+    def contract_fields(self):
+        '''Fields of the contract in execution and position messages.
+        '''
+        return [self.conId, self.symbol, self.secType,
+                self.lastTradeDateOrContractMonth, 0., '', self.multiplier,
+                self.exchange, self.currency, self.localSymbol, self.symbol]
+
+    def details_fields(self, reqId):
+        return [MSG_CONTRACT_DETAILS, 8, reqId, self.symbol, self.secType,
+                self.lastTradeDateOrContractMonth, 0., '', self.exchange,
+                self.currency, self.localSymbol, self.symbol, self.symbol,
+                self.conId, self.ticksize, 1, self.multiplier,
+                'LMT,MKT,STP', self.exchange, 1, 0, self.name, '',
+                self.lastTradeDateOrContractMonth, '', '', '', 'US/Eastern',
+                '', '', '', '', 0, 1, '', '', str(self.conId), '', '']
+
+    def history(self, barsize, end, duration):
+        '''Return the bars of [end - duration, end) in the bar size.
+        '''
+        seconds = dc.barsize_seconds(barsize)
+        if end is None:
+            end = self.bars.time[-1] + dc.barsize_seconds(self.barsize) \
+                    * 1000000000 if len(self.bars) > 0 else 0
+        else:
+            end = end.astype('datetime64[ns]').view(np.int64)
+        begin = dc.duration_start(duration, pd.Timestamp(end)).value
+        first, last = np.searchsorted(self.bars.time, [begin, end])
+        bars = self.bars[first:last]
+        if seconds > dc.barsize_seconds(self.barsize):
+            bars = resample(bars, seconds)
+        return bars
+
+class GatewayOrder(object):
+    '''Order sent to the gateway.
+    '''
+
+    def __init__(self, connection, orderId, permId, symbol, action,
+            quantity, orderType, lmtPrice, auxPrice):
+        self.connection = connection
+        self.orderId = orderId
+        self.permId = permId
+        self.symbol = symbol
+        self.action = action
+        self.quantity = quantity
+        self.orderType = orderType
+        self.lmtPrice = lmtPrice
+        self.auxPrice = auxPrice
+        self.status = 'Submitted'
+
+    def trigger(self, high, low):
+        '''Return the fill price of the order in a bar with high and low,
+        None if the order is not filled.
+        '''
+        buy = self.action == 'BUY'
+        if self.orderType == 'LMT':
+            if (buy and low <= self.lmtPrice) or \
+                    (not buy and high >= self.lmtPrice):
+                return self.lmtPrice
+        elif self.orderType == 'STP':
+            if (buy and high >= self.auxPrice) or \
+                    (not buy and low <= self.auxPrice):
+                return self.auxPrice
+        return None
+
+class GatewayConnection(object):
+    '''Connection of an API client.
+    '''
+
+    def __init__(self, gateway, reader, writer):
+        self.gateway = gateway
+        self.reader = reader
+        self.writer = writer
+        self.clientId = None
+        self.positions = False
+        self.accounts = set()
+        self.replays = dict()
+
+    def send(self, *fields):
+        '''Send a message of the fields.
+        '''
+        text = []
+        for field in fields:
+            if field is None:
+                field = ''
+            elif isinstance(field, bool):
+                field = '1' if field else '0'
+            text.append(str(field))
+        message = ('\0'.join(text) + '\0').encode()
+        self.writer.write(struct.pack('>I', len(message)) + message)
+
+    async def read(self):
+        '''Return the fields of the next message or None if the client
+        closed the connection.
+        '''
+        try:
+            size = struct.unpack('>I', await self.reader.readexactly(4))[0]
+            message = await self.reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        fields = message.decode(errors='backslashreplace').split('\0')
+        return fields[:-1] if fields and fields[-1] == '' else fields
+
+class LocalGateway(object):
+    '''Local gateway of the IB API.
+
+    Parameters:
+
+      - host (default: HOST)
+
+      - port (default: PORT)
+
+      Port of the gateway, 0 selects a free port (port attribute after
+      start)
+
+      - speedup (default: 60.)
+
+      Speed of the real-time bars, bars of one minute are sent every
+      second with 60
+
+      - latency (default: 0.)
+
+      Seconds from the order acknowledgement to the fill
+
+      - commission (default: 0.)
+
+      Commission by order
+    '''
+
+    def __init__(self, host=HOST, port=PORT, speedup=60., latency=0.,
+            commission=0.):
+        self.host = host
+        self.port = port
+        self.speedup = speedup
+        self.latency = latency
+        self.commission = commission
+
+        self.account = ACCOUNT
+        self.cash = INITIAL_CASH
+        self.symbols = dict()
+        self._conids = dict()
+        # Signed size and average cost by conId
+        self.positions = dict()
+        self.executions = []
+        self.orders = dict()
+        self._permid = 0
+        self._connections = set()
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def add_symbol(self, name, bars, secType='STK', **kwargs):
+        '''Add a symbol with the bars (BarFrame or csv filename). Return
+        the GatewaySymbol.
+        '''
+        symbol = GatewaySymbol(name, bars, len(self.symbols) + 1000001,
+                secType, **kwargs)
+        self.symbols[name] = symbol
+        self._conids[symbol.conId] = symbol
+        return symbol
+
+    def find(self, fields):
+        '''Return the symbol of the contract fields of a request (conId,
+        symbol, secType, lastTradeDateOrContractMonth, strike, right,
+        multiplier, exchange, primaryExchange, currency, localSymbol,
+        tradingClass) or None.
+        '''
+        conId, symbol, secType = fields[0], fields[1], fields[2]
+        currency, localSymbol = fields[9], fields[10]
+        if conId and int(conId) in self._conids:
+            return self._conids[int(conId)]
+        if localSymbol:
+            name = localSymbol.replace('.', '')
+        elif secType == 'CASH':
+            name = symbol + currency
+        else:
+            name = symbol
+        return self.symbols.get(name)
+
+    # Server
+
+    async def start_async(self):
+        self._server = await asyncio.start_server(self._serve, self.host,
+                self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_async(self):
+        '''Serve until cancelled.
+        '''
+        await self.start_async()
+        print('[ Local Gateway ] %s:%d %s' % (self.host, self.port,
+            ', '.join(self.symbols)))
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        '''Start the gateway in a thread. Return when the gateway accepts
+        connections.
+        '''
+        ready = threading.Event()
+
+        def serve():
+            loop = self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start_async())
+            ready.set()
+            loop.run_forever()
+
+            # Connections and replays are cancelled when stopped
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks,
+                return_exceptions=True))
+            loop.close()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        '''Stop the gateway started with start.
+        '''
+        if self._loop is None:
+            return
+
+        def close():
+            self._server.close()
+            for connection in list(self._connections):
+                connection.writer.close()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(close)
+        self._thread.join()
+        self._loop = None
+
+    async def _serve(self, reader, writer):
+        connection = GatewayConnection(self, reader, writer)
+        self._connections.add(connection)
+        try:
+            # Handshake: 'API\0' and the client versions. Legacy clients
+            # send the client version only and wait for the answer
+            if await reader.readexactly(1) != b'A':
+                await reader.readuntil(b'\0')
+                self._reject_legacy(writer)
+                await writer.drain()
+                return
+            if await reader.readexactly(3) != b'PI\0':
+                return
+            await connection.read()
+            connection.send(SERVER_VERSION, time.strftime('%Y%m%d %H:%M:%S'))
+
+            while True:
+                fields = await connection.read()
+                if fields is None:
+                    break
+                handler = self.HANDLERS.get(int(fields[0]))
+                if handler is not None:
+                    handler(self, connection, fields)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            for replay in connection.replays.values():
+                replay.cancel()
+            self._connections.discard(connection)
+            writer.close()
+
+    def _reject_legacy(self, writer):
+        '''Answer the handshake of legacy clients (IbPy of backtrader
+        IBStore) with a server version lower than their minimum, then the
+        client disconnects with the error of old TWS instead of waiting.
+        '''
+        print('[ Local Gateway ] Legacy API client (IbPy) not supported')
+        writer.write(b'%d\0' % LEGACY_SERVER_VERSION)
+
+    # Requests
+
+    def start_api(self, connection, fields):
+        connection.clientId = int(fields[2])
+        connection.send(MSG_NEXT_VALID_ID, 1, 1)
+        connection.send(MSG_MANAGED_ACCOUNTS, 1, self.account)
+
+    def req_ids(self, connection, fields):
+        connection.send(MSG_NEXT_VALID_ID, 1, 1)
+
+    def req_current_time(self, connection, fields):
+        connection.send(MSG_CURRENT_TIME, 1, int(time.time()))
+
+    def req_positions(self, connection, fields):
+        connection.positions = True
+        for conId in self.positions:
+            self._send_position(connection, self._conids[conId])
+        connection.send(MSG_POSITION_END, 1)
+
+    def req_open_orders(self, connection, fields):
+        connection.send(MSG_OPEN_ORDER_END, 1)
+
+    def req_completed_orders(self, connection, fields):
+        connection.send(MSG_COMPLETED_ORDERS_END)
+
+    def req_account_updates(self, connection, fields):
+        if fields[2] == '1':
+            connection.accounts.add(None)
+            for tag, value in self.account_values():
+                connection.send(MSG_ACCOUNT_VALUE, 2, tag, value, 'USD',
+                        self.account)
+            connection.send(MSG_ACCOUNT_DOWNLOAD_END, 1, self.account)
+        else:
+            connection.accounts.discard(None)
+
+    def req_account_updates_multi(self, connection, fields):
+        reqId = int(fields[2])
+        connection.accounts.add(reqId)
+        for tag, value in self.account_values():
+            connection.send(MSG_ACCOUNT_UPDATE_MULTI, 1, reqId, self.account,
+                    '', tag, value, 'USD')
+        connection.send(MSG_ACCOUNT_UPDATE_MULTI_END, 1, reqId)
+
+    def req_account_summary(self, connection, fields):
+        reqId = int(fields[2])
+        for tag, value in self.account_values():
+            connection.send(MSG_ACCOUNT_SUMMARY, 1, reqId, self.account, tag,
+                    value, 'USD')
+        connection.send(MSG_ACCOUNT_SUMMARY_END, 1, reqId)
+
+    def req_executions(self, connection, fields):
+        reqId = int(fields[2])
+        for execution in self.executions:
+            if execution[1] == connection.clientId:
+                self._send_execution(connection, reqId, *execution)
+        connection.send(MSG_EXEC_DETAILS_END, 1, reqId)
+
+    def req_contract_details(self, connection, fields):
+        reqId = int(fields[2])
+        symbol = self.find(fields[3:15])
+        if symbol is None:
+            connection.send(MSG_ERROR, 2, reqId, 200,
+                    'No security definition has been found for the request')
+            return
+        connection.send(*symbol.details_fields(reqId))
+        connection.send(MSG_CONTRACT_DETAILS_END, 1, reqId)
+
+    def req_market_rule(self, connection, fields):
+        ruleId = int(fields[1])
+        symbol = self._conids.get(ruleId)
+        ticksize = symbol.ticksize if symbol is not None else 0.01
+        connection.send(MSG_MARKET_RULE, ruleId, 1, 0, ticksize)
+
+    def req_head_timestamp(self, connection, fields):
+        reqId = int(fields[1])
+        symbol = self.find(fields[2:14])
+        if symbol is None or len(symbol.bars) == 0:
+            connection.send(MSG_ERROR, 2, reqId, 162,
+                    'Historical Market Data Service error message:'
+                    'HMDS query returned no data')
+            return
+        connection.send(MSG_HEAD_TIMESTAMP, reqId,
+                format_time(symbol.bars.times()[0]))
+
+    def req_historical_data(self, connection, fields):
+        reqId = int(fields[1])
+        symbol = self.find(fields[2:14])
+        end, barsize, duration = fields[15], fields[16], fields[17]
+        if symbol is None:
+            connection.send(MSG_ERROR, 2, reqId, 200,
+                    'No security definition has been found for the request')
+            return
+        bars = symbol.history(barsize, parse_time(end), duration)
+
+        message = [MSG_HISTORICAL_DATA, reqId, '', '', len(bars)]
+        times = bars.times()
+        for i in range(len(bars)):
+            message += [format_time(times[i]), bars.open[i], bars.high[i],
+                    bars.low[i], bars.close[i], bars.volume[i], -1., -1]
+        connection.send(*message)
+
+    def req_realtime_bars(self, connection, fields):
+        reqId = int(fields[2])
+        symbol = self.find(fields[3:15])
+        if symbol is None:
+            connection.send(MSG_ERROR, 2, reqId, 200,
+                    'No security definition has been found for the request')
+            return
+        connection.replays[reqId] = asyncio.ensure_future(
+                self._replay(connection, reqId, symbol))
+
+    def cancel_realtime_bars(self, connection, fields):
+        replay = connection.replays.pop(int(fields[2]), None)
+        if replay is not None:
+            replay.cancel()
+
+    def place_order(self, connection, fields):
+        orderId = int(fields[1])
+        symbol = self.find(fields[2:14])
+        if symbol is None:
+            connection.send(MSG_ERROR, 2, orderId, 200,
+                    'No security definition has been found for the request')
+            return
+        action, quantity, orderType = fields[16], float(fields[17]), \
+                fields[18]
+        self._permid += 1
+        order = GatewayOrder(connection, orderId, self._permid, symbol,
+                action, quantity, orderType, float(fields[19] or 0),
+                float(fields[20] or 0))
+        self.orders[(connection.clientId, orderId)] = order
+        self._send_status(order, 0.)
+        if orderType == 'MKT':
+            self._start_fill(order, None)
+        elif order.trigger(symbol.price, symbol.price) is not None:
+            # Marketable orders are filled with the last price
+            self._start_fill(order, symbol.price)
+
+    def cancel_order(self, connection, fields):
+        order = self.orders.get((connection.clientId, int(fields[2])))
+        if order is not None and order.status == 'Submitted':
+            order.status = 'Cancelled'
+            self._send_status(order, 0.)
+
+    HANDLERS = {
+            3:place_order,
+            4:cancel_order,
+            5:req_open_orders,
+            6:req_account_updates,
+            7:req_executions,
+            8:req_ids,
+            9:req_contract_details,
+            16:req_open_orders,
+            20:req_historical_data,
+            49:req_current_time,
+            50:req_realtime_bars,
+            51:cancel_realtime_bars,
+            61:req_positions,
+            62:req_account_summary,
+            71:start_api,
+            76:req_account_updates_multi,
+            87:req_head_timestamp,
+            91:req_market_rule,
+            99:req_completed_orders,
+            }
+
+    # Simulation
+
+    def account_values(self):
+        '''Return the tags and values of the account.
+        '''
+        value = sum(size * self._conids[conId].price
+                for conId, (size, cost) in self.positions.items())
+        return [
+                ('TotalCashValue', '%.2f' % self.cash),
+                ('NetLiquidation', '%.2f' % (self.cash + value)),
+                ('GrossPositionValue', '%.2f' % abs(value)),
+                ('AvailableFunds', '%.2f' % (self.cash + value)),
+                ]
+
+    async def _replay(self, connection, reqId, symbol):
+        '''Send the bars of the symbol as real-time bars.
+        '''
+        interval = dc.barsize_seconds(symbol.barsize) / float(self.speedup)
+        bars = symbol.bars
+        times = bars.times()
+        for i in range(len(bars)):
+            symbol.price = float(bars.close[i])
+            connection.send(MSG_REALTIME_BAR, 3, reqId,
+                    int(times[i].astype('datetime64[s]').item().timestamp()),
+                    bars.open[i], bars.high[i], bars.low[i], bars.close[i],
+                    bars.volume[i], -1., -1)
+            for order in list(self.orders.values()):
+                if order.symbol is symbol and order.status == 'Submitted' \
+                        and order.orderType != 'MKT':
+                    price = order.trigger(bars.high[i], bars.low[i])
+                    if price is not None:
+                        self._start_fill(order, price)
+            await asyncio.sleep(interval)
+
+    def _start_fill(self, order, price):
+        order.status = 'Filling'
+        asyncio.ensure_future(self._fill(order, price))
+
+    async def _fill(self, order, price):
+        '''Fill the order after the latency, price None is the last price.
+        '''
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        symbol = order.symbol
+        if price is None:
+            price = symbol.price
+
+        size = order.quantity if order.action == 'BUY' else -order.quantity
+        position, cost = self.positions.get(symbol.conId, (0., 0.))
+        realized = 0.
+        if position == 0 or (position > 0) == (size > 0):
+            cost = (position * cost + size * price) / (position + size)
+        else:
+            closed = min(abs(size), abs(position))
+            realized = closed * (price - cost) * (1 if position > 0 else -1)
+            if abs(size) > abs(position):
+                cost = price
+        position += size
+        if position == 0:
+            cost = 0.
+        self.positions[symbol.conId] = (position, cost)
+        self.cash -= size * price + self.commission
+
+        execution = (order.orderId, order.connection.clientId, order.permId,
+                symbol, '%08d.01' % order.permId, time.strftime(
+                    '%Y%m%d  %H:%M:%S'), order.action, order.quantity,
+                price, realized)
+        self.executions.append(execution)
+
+        order.status = 'Filled'
+        connection = order.connection
+        self._send_execution(connection, -1, *execution)
+        self._send_status(order, order.quantity, price)
+        for other in list(self._connections):
+            if other.positions:
+                self._send_position(other, symbol)
+            for reqId in other.accounts:
+                for tag, value in self.account_values():
+                    if reqId is None:
+                        other.send(MSG_ACCOUNT_VALUE, 2, tag, value, 'USD',
+                                self.account)
+                    else:
+                        other.send(MSG_ACCOUNT_UPDATE_MULTI, 1, reqId,
+                                self.account, '', tag, value, 'USD')
+
+    def _send_status(self, order, filled, price=0.):
+        order.connection.send(MSG_ORDER_STATUS, order.orderId, order.status,
+                filled, order.quantity - filled, price, order.permId, 0,
+                price, order.connection.clientId, '', 0.)
+
+    def _send_execution(self, connection, reqId, orderId, clientId, permId,
+            symbol, execId, timestr, action, quantity, price, realized):
+        connection.send(*[MSG_EXEC_DETAILS, reqId, orderId] +
+                symbol.contract_fields() + [execId, timestr, self.account,
+                    symbol.exchange, 'BOT' if action == 'BUY' else 'SLD',
+                    quantity, price, permId, clientId, 0, quantity, price,
+                    '', '', '', '', 0])
+        connection.send(MSG_COMMISSION_REPORT, 1, execId, self.commission,
+                'USD', realized, '', '')
+
+    def _send_position(self, connection, symbol):
+        position, cost = self.positions.get(symbol.conId, (0., 0.))
+        connection.send(*[MSG_POSITION, 3, self.account] +
+                symbol.contract_fields() + [position, cost])
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description='Local stand-in of the IB gateway')
+
+    for option, sectype in (('--forex', 'CASH'), ('--stock', 'STK'),
+            ('--future', 'FUT')):
+        parser.add_argument(
+                option,
+                required=False,
+                default=[],
+                action='append',
+                metavar='SYMBOL=FILE',
+                help='Csv file of bars of a %s symbol' % sectype
+                )
+
+    parser.add_argument(
+            '--port', '-p',
+            required=False,
+            default=PORT,
+            action='store',
+            type=int,
+            help='Port of the gateway'
+            )
+
+    parser.add_argument(
+            '--speedup', '-s',
+            required=False,
+            default=60.,
+            action='store',
+            type=float,
+            help='Speed of real-time bars'
+            )
+
+    parser.add_argument(
+            '--latency', '-l',
+            required=False,
+            default=0.,
+            action='store',
+            type=float,
+            help='Seconds from order acknowledgement to fill'
+            )
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+    return parser.parse_args()
+
+def run(args=None):
+    args = parse_args(args)
+    gateway = LocalGateway(port=args.port, speedup=args.speedup,
+            latency=args.latency)
+    for sectype, symbols in (('CASH', args.forex), ('STK', args.stock),
+            ('FUT', args.future)):
+        for value in symbols:
+            name, filename = value.split('=', 1)
+            gateway.add_symbol(name, filename, sectype)
+    try:
+        asyncio.run(gateway.serve_async())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    run()
@@ -9,6 +9,10 @@ from strategies.multifadesystem import FadeSystemIB
 from dataclient import *
 from strategies.optparams import *
 import datautils
+import barframe
+import barfeed
+import barstore
+import sessionutils
 
 HOST='127.0.0.1'
 PORT = 7497
@@ -18,6 +22,10 @@ CLIENTID = 1234
 DOWNLOAD_DATA = True
 DATA_DURATION = '100 D'
 DATA_TIMEFRAME = '1 min'
+# Bar store of downloaded data, only the missing bars are downloaded
+STORE_DIRECTORY = 'data'
+# Symbols downloaded at the same time
+DOWNLOAD_CONCURRENCY = 4
 
 # Broker configuration
 INITIAL_CASH = 10000.
@@ -47,8 +55,12 @@ STDDEV_PERIOD = 6
 ATR_PERIOD = 5
 # Market Profile Parameter
 MP_VALUEAREA_RANGE = 0.75
+MP_MODE = 'tpo' # 'vol' for stocks and futures
+MP_BINS = 'Close' # 'Range' distributes the volume between low and high
 # Position parameter
 POSITIONTIMEDECAY = 60*60*2
+# Session calendar of the strategy and of the session profiles
+SESSION_CALENDAR = 'day'
 
 class AcctStats(bt.Analyzer):
     
@@ -71,19 +83,22 @@ def run_backtest(args=None, **kwargs):
     dataclient = IBDataClient(HOST, PORT, CLIENTID)
 
     print('[ Get Tick Size ]')
+    dataclient.prefetch(list(DATAFILES.values()))
     for symbol, contract in DATAFILES.items():
 
         TICKSIZE_CONFIGURATION.update({symbol:dataclient.getticksize(contract)})
 
+    datas = dict()
     if DOWNLOAD_DATA:
 
-        for symbol, contract in DATAFILES.items():
-            print('[ Downloading Data %s ] ' % symbol)
-            data = dataclient.getdata_fromct(contract, 
-                    DATA_TIMEFRAME,
-                    DATA_DURATION)
-            datautils.save_data(data, output_filename=symbol)
-            print('[ Download Finished: %s ]' % symbol)
+        print('[ Downloading Data ]')
+        jobs = [{'contract':contract,
+            'name':symbol,
+            'timeframe':DATA_TIMEFRAME,
+            'duration':DATA_DURATION} for symbol, contract in DATAFILES.items()]
+        datas = dataclient.getdata_batch(jobs,
+                barstore.BarStore(STORE_DIRECTORY),
+                DOWNLOAD_CONCURRENCY)
 
     dataclient.close()
 
@@ -95,10 +110,13 @@ def run_backtest(args=None, **kwargs):
             'std_threshold': STD_THRESHOLD,
             'atr_period': ATR_PERIOD,
             'mp_valuearea': MP_VALUEAREA_RANGE, 
+            'mp_mode': MP_MODE,
+            'mp_bins': MP_BINS,
             'stoploss': STOPLOSS_RANGE,
             'takeprofit': TAKEPROFIT_RANGE,
             'positiontimedecay': POSITIONTIMEDECAY,
-            'minimumchangeprice': MINIMUMPRICECHANGE,}
+            'minimumchangeprice': MINIMUMPRICECHANGE,
+            'session_calendar': SESSION_CALENDAR,}
 
     strategy_args.update(**kwargs)
     
@@ -107,21 +125,25 @@ def run_backtest(args=None, **kwargs):
     cerebro.broker.setcommission(COMMISSION)
     
     for datafile in DATAFILES:
-        data = btfeeds.GenericCSVData(
-                dataname = datafile,
-                nullvalue = 0., 
-                dtformat = ('%Y-%m-%d %H:%M:%S'),
-                date = 0,
-                open = 1,
-                high = 2,
-                low = 3,
-                close = 4,
-                volume = 5,
+        bars = datas.get(datafile)
+        if bars is None:
+            bars = barframe.BarFrame.from_csv(datafile)
+        data = barfeed.ArrayData(
+                dataname = bars,
+                name = datafile,
                 timeframe = bt.TimeFrame.Minutes,
                 )
     
         cerebro.adddata(data)
 
+        PROFILE_TABLES.update({data._name: datautils.generatesessionprofiles(
+            bars.to_dataframe(), TICKSIZE_CONFIGURATION[datafile],
+            strategy_args['mp_valuearea'],
+            mp_mode=strategy_args['mp_mode'],
+            bins=strategy_args['mp_bins'],
+            calendar=sessionutils.SessionCalendar.from_name(
+                strategy_args['session_calendar']))})
+
     strategies = cerebro.addstrategy(
             FadeSystemIB,
             **strategy_args)
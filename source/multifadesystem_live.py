@@ -7,6 +7,8 @@ import backtrader.analyzers as analyzer
 import datetime as dt
 
 from strategies.multifadesystem import FadeSystemIB
+from strategies.optparams import TICKSIZE_CONFIGURATION
+from dataclient import IBDataClient
 
 FOREX = [
         'EUR.USD-CASH-IDEALPRO',
@@ -23,6 +25,8 @@ FUTURES = []
 HOST = '127.0.0.1'
 PORT = 7497
 CLIENTID = 1234
+# Client of contract details, connected before the broker
+DATACLIENTID = CLIENTID + 1
 
 STRATEGY_PARAMS = {
         "lotconfig": 1,
@@ -47,6 +51,17 @@ STRATEGY_PARAMS = {
 
 
 def run_live(args=None, **kwargs):
+    print('[ Qualify Contracts ]')
+
+    # The contracts of the universe are qualified at once, the tick
+    # sizes are served from the contract cache
+    dataclient = IBDataClient(HOST, PORT, DATACLIENTID)
+    contracts = dataclient.qualify(FOREX + STOCKS + FUTURES)
+    for dataname, contract in contracts.items():
+        TICKSIZE_CONFIGURATION.update({dataname:
+            dataclient.getticksize(contract)})
+    dataclient.close()
+
     print('[ Configuring Cerebro ]')
     
     cerebro = bt.Cerebro(live= True)
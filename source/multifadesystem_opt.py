@@ -8,6 +8,11 @@ import argparse
 from strategies.multifadesystem import FadeSystemIB
 from dataclient import *
 import datautils
+import barframe
+import barfeed
+import barstore
+import profilestore
+import sessionutils
 from strategies.optparams import * 
 
 
@@ -18,6 +23,16 @@ CLIENTID = 1234
 DOWNLOAD_DATA = True # Download the data before optimization
 DATA_DURATION = '10 D'
 DATA_TIMEFRAME = '1 min'
+# Bar store of downloaded data, only the missing bars are downloaded
+STORE_DIRECTORY = 'data'
+# Market Profile store, the profiles are reused by the next optimizations
+PROFILE_STORE_DIRECTORY = 'profiles'
+# Session calendar of the strategy and of the session profiles
+SESSION_CALENDAR = 'day'
+# Symbols downloaded at the same time
+DOWNLOAD_CONCURRENCY = 4
+# Save the charts of session profiles and orders of every combination
+SAVEFIGURES = False
 
 
 INITIAL_CASH = 10000.
@@ -94,44 +109,52 @@ def run_optimization(args=None, **kwargs):
     print('[ Get Tick Size]')
 
     dc = IBDataClient(HOST, PORT, CLIENTID)
+    dc.prefetch(list(DATAFILES.values()))
     for symbol, contract in DATAFILES.items():
         TICKSIZE_CONFIGURATION.update({symbol:dc.getticksize(contract)})
 
     datas = dict()
     if DOWNLOAD_DATA:
-        for symbol, contract in DATAFILES.items():
-            print('[ Downloading Data %s ]' % symbol)
-            data = dc.getdata_fromct(
-                    contract,
-                    DATA_TIMEFRAME,
-                    DATA_DURATION)
-            datautils.save_data(data, output_filename=symbol)
-            datas.update({symbol:data})
+        print('[ Downloading Data ]')
+        jobs = [{'contract':contract,
+            'name':symbol,
+            'timeframe':DATA_TIMEFRAME,
+            'duration':DATA_DURATION} for symbol, contract in DATAFILES.items()]
+        datas = dc.getdata_batch(jobs,
+                barstore.BarStore(STORE_DIRECTORY),
+                DOWNLOAD_CONCURRENCY)
     dc.close()
 
     print('[ Configuring Cerebro ]')
     params = optimization_params(TICKSIZE_CONFIGURATION)
+    params.update({'mp_store':PROFILE_STORE_DIRECTORY})
+    params.update({'session_calendar':SESSION_CALENDAR})
+    params.update({'savefigures':SAVEFIGURES})
     
     cerebro = bt.Cerebro(maxcpus=1)
     cerebro.broker.set_cash(INITIAL_CASH)
     cerebro.broker.setcommission(COMMISSION)
     
-    for symbol, datas in DATAFILES.items():
-        _data = btfeeds.GenericCSVData(
-                dataname = symbol,
-                nullvalue = 0., 
-                dtformat = ('%Y-%m-%d %H:%M:%S'),
-                date = 0,
-                open = 1,
-                high = 2,
-                low = 3,
-                close = 4,
-                volume = 5,
+    for symbol in DATAFILES:
+        bars = datas.get(symbol)
+        if bars is None:
+            bars = barframe.BarFrame.from_csv(symbol)
+        _data = barfeed.ArrayData(
+                dataname = bars,
+                name = symbol,
                 timeframe = bt.TimeFrame.Minutes,
                 )
     
         cerebro.adddata(_data)
 
+        # Market Profiles of all sessions are generated before the optimization
+        PROFILE_TABLES.update({_data._name: datautils.generatesessionprofiles(
+            bars.to_dataframe(), TICKSIZE_CONFIGURATION[symbol],
+            MP_VALUEAREA_RANGE,
+            calendar=sessionutils.SessionCalendar.from_name(SESSION_CALENDAR),
+            store=profilestore.getstore(PROFILE_STORE_DIRECTORY),
+            name=_data._name)})
+
     strategies = cerebro.optstrategy(
             FadeSystemIB,
             **params)
@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*-
 
 from backtrader.order import Order
+import bisect
+import heapq
+import itertools
+import numpy as np
 import pandas as pd
 from tabulate import tabulate
 import datetime as dt
 from strategies.exceptions import *
 import datautils as du
+import sessionutils as su
+from ib_insync import util
+from accountmirror import ACTIVE_STATES
 
 # Position types
 NONE = 'None'
 LONG = 'Long'
 SHORT = 'Short'
 
+# Codes of sides in the order store
+SIDES = {NONE:0, LONG:1, SHORT:-1}
+SIDE_NAMES = {code: side for side, code in SIDES.items()}
+
 # Stops calculation mode
 PERCENT = 'Percent' # 0.01 = 1%
 PRICE = 'Price'     # absolute price
@@ -68,6 +79,230 @@ def calc_stops(price, side, stoploss, takeprofit, mode=VALUE,
 
     return None, None
 
+class OrderBook(object):
+    '''Orders of the Order Management object indexed by trade id and by
+    symbol. The open orders keep the order of creation, the transitions
+    from open to closed orders don't search the lists.
+    '''
+
+    def __init__(self):
+        # Orders by trade id
+        self.open = dict()
+        self.closed = dict()
+        # Open orders by symbol and trade id
+        self._symbols = dict()
+
+    def __len__(self):
+        return len(self.open)
+
+    def __iter__(self):
+        return iter(list(self.open.values()))
+
+    def add(self, order):
+        '''Add an open order.
+        '''
+        self.open[order._id] = order
+        self._symbols.setdefault(order.symbol, dict())[order._id] = order
+
+    def get(self, tradeid):
+        '''Return the order (open or closed) of the trade id or None.
+        '''
+        order = self.open.get(tradeid)
+        if order is None:
+            order = self.closed.get(tradeid)
+        return order
+
+    def close(self, order):
+        '''Move the order to the closed orders.
+        '''
+        order.closed = True
+        if self.open.pop(order._id, None) is None:
+            return
+        self.closed[order._id] = order
+        orders = self._symbols[order.symbol]
+        del orders[order._id]
+        if not orders:
+            del self._symbols[order.symbol]
+
+    def symbols(self):
+        '''Return the symbols with open orders.
+        '''
+        return list(self._symbols)
+
+    def symbol_orders(self, symbol):
+        '''Return the open orders of the symbol.
+        '''
+        return list(self._symbols.get(symbol, {}).values())
+
+class TriggerIndex(object):
+    '''Stop loss and take profit levels of the executed orders of a symbol
+    sorted by price. The levels below the price (stop loss of long orders
+    and take profit of short orders) are reached when the price falls to
+    the level and the levels above the price (take profit of long orders
+    and stop loss of short orders) when the price rises to the level. The
+    levels reached are removed, then only the levels crossed since the
+    previous price are visited.
+    '''
+
+    def __init__(self):
+        # Sorted lists of (level, count, order)
+        self.below = []
+        self.above = []
+        # Levels of each order by trade id
+        self._levels = dict()
+        self._count = itertools.count()
+
+    def __len__(self):
+        return len(self.below) + len(self.above)
+
+    def add(self, order):
+        '''Add the stops of the order.
+        '''
+        if order.side == LONG:
+            below, above = order._stoploss, order._takeprofit
+        elif order.side == SHORT:
+            below, above = order._takeprofit, order._stoploss
+        else:
+            raise DirectionNotFound()
+        levels = []
+        if below is not None:
+            level = (below, next(self._count), order)
+            bisect.insort(self.below, level)
+            levels.append((self.below, level))
+        if above is not None:
+            level = (above, next(self._count), order)
+            bisect.insort(self.above, level)
+            levels.append((self.above, level))
+        if levels:
+            self._levels[order._id] = levels
+
+    def remove(self, order):
+        '''Remove the stops of the order.
+        '''
+        for levels, level in self._levels.pop(order._id, ()):
+            self._delete(levels, level)
+
+    def trigger(self, low, high=None):
+        '''Return the orders (sorted by trade id) with a level reached by
+        the price and remove all the levels of these orders. The levels
+        below are compared with the low and the levels above with the high
+        (the low without high).
+        '''
+        if high is None:
+            high = low
+        start = bisect.bisect_left(self.below, (low,))
+        end = bisect.bisect_right(self.above, (high, float('inf')))
+        if start == len(self.below) and end == 0:
+            return []
+        levels = self.below[start:] + self.above[:end]
+        del self.below[start:]
+        del self.above[:end]
+        orders = {level[2]._id: level[2] for level in levels}
+        # The other level of the orders reached is removed too
+        for tradeid in orders:
+            self.remove(orders[tradeid])
+        return [orders[tradeid] for tradeid in sorted(orders)]
+
+    def _delete(self, levels, level):
+        '''Internal function for deleting the level from the sorted list,
+        levels already deleted are ignored.
+        '''
+        i = bisect.bisect_left(levels, level)
+        if i < len(levels) and levels[i] is level:
+            del levels[i]
+
+class PnLTracker(object):
+    '''Realized and unrealized PnL by symbol with average cost positions.
+    The PnL is updated with each fill and each price, the totals of the
+    portfolio are kept with the changes of the symbols.
+
+    Parameters:
+
+      - multipliers (default: None)
+
+      Dictionary with the multiplier of the price by symbol (1. if the
+      symbol is not in the dictionary)
+    '''
+
+    def __init__(self, multipliers=None):
+        self.multipliers = dict(multipliers or {})
+        # Signed size, average price, last price by symbol
+        self.positions = dict()
+        self.avgprices = dict()
+        self.prices = dict()
+        # PnL by symbol and totals
+        self.realized = dict()
+        self.unrealized = dict()
+        self.total_realized = 0.
+        self.total_unrealized = 0.
+
+    def _revalue(self, symbol):
+        unrealized = self.positions[symbol] * (self.prices[symbol] -
+                self.avgprices[symbol]) * self.multipliers.get(symbol, 1.)
+        self.total_unrealized += unrealized - self.unrealized[symbol]
+        self.unrealized[symbol] = unrealized
+
+    def fill(self, symbol, size, price, commission=0.):
+        '''Add the fill of size (negative to sell) at price. The closed
+        size of the position is added to the realized PnL.
+        '''
+        if symbol not in self.positions:
+            self.positions[symbol] = 0.
+            self.avgprices[symbol] = 0.
+            self.realized[symbol] = 0.
+            self.unrealized[symbol] = 0.
+        position = self.positions[symbol]
+        avgprice = self.avgprices[symbol]
+        realized = -commission
+        if position == 0 or (position > 0) == (size > 0):
+            avgprice = (avgprice * position + price * size) / (position + size)
+        else:
+            closed = min(abs(size), abs(position)) * (1 if position > 0 else -1)
+            realized += closed * (price - avgprice) * \
+                    self.multipliers.get(symbol, 1.)
+            if abs(size) > abs(position):
+                avgprice = price
+        position += size
+        self.positions[symbol] = position
+        self.avgprices[symbol] = avgprice if position != 0 else 0.
+        self.realized[symbol] += realized
+        self.total_realized += realized
+        self.prices[symbol] = price
+        self._revalue(symbol)
+
+    def update(self, symbol, price):
+        '''Change the last price of the symbol.
+        '''
+        if symbol in self.positions:
+            self.prices[symbol] = price
+            self._revalue(symbol)
+
+    def open_symbols(self):
+        '''Return the symbols with position.
+        '''
+        return [symbol for symbol, position in self.positions.items()
+                if position != 0]
+
+    def pnl(self, symbol=None):
+        '''Return the realized and the unrealized PnL of the symbol (of
+        the portfolio if None).
+        '''
+        if symbol is None:
+            return self.total_realized + self.total_unrealized
+        return self.realized.get(symbol, 0.) + self.unrealized.get(symbol, 0.)
+
+    def as_dataframe(self):
+        '''Return Data Frame with PnL by symbol
+        '''
+        return pd.DataFrame({
+            'symbol':list(self.positions),
+            'position':list(self.positions.values()),
+            'avgprice':list(self.avgprices.values()),
+            'price':[self.prices[symbol] for symbol in self.positions],
+            'realized':list(self.realized.values()),
+            'unrealized':list(self.unrealized.values()),
+            })
+
 class OrdersManagement(object):
     '''Handle the orders state. 
     Manage time parameters, check open and close conditions, 
@@ -82,7 +317,8 @@ class OrdersManagement(object):
       - dataclient (default: None)
 
       The dataclient is optional, recommended in Live mode. Some features are handled by the dataclient, like the confirmation with broker about the
-      orders state
+      orders state. The state of broker is read from the account mirror of the dataclient (accountmirror.AccountMirror), updated by events
+      after 'start'
 
       - account (default='')
 
@@ -94,10 +330,9 @@ class OrdersManagement(object):
         self.dataclient = dataclient
         self.account_number = account_number
 
-        # Current orders
-        self.order_list = []
-        # Closed orders
-        self.order_history = []
+        # Current and closed orders, values of open orders in columns
+        self.book = OrderBook()
+        self.store = OrderStore()
         # Daily orders
         self.daily_orders = []
 
@@ -119,11 +354,77 @@ class OrdersManagement(object):
         # Internal variable that stores last order time
         self._lastordertime = dt.datetime(2000,1,1)
 
-    def next(self, datetime):
+        # Session calendar flags of current bar
+        self._flags = None
+
+        # Broker state updated by events and conIds of data names
+        self.mirror = None
+        self._conids = dict()
+        # Orders closed with broker confirmation pending
+        self._closing = []
+        # Time decay deadlines of executed orders (deadline, count, order)
+        self._expiries = []
+        self._expiry_count = itertools.count()
+        # Stop levels of executed orders by symbol (backtesting only)
+        self.triggers = dict()
+        # Compare the stops with high and low of bars in backtesting
+        self.intrabar = False
+        # PnL of fills by symbol
+        self.pnl = PnLTracker()
+        # Start of the broker state in progress (start inside event loop)
+        self._starting = None
+        if self.dataclient != None:
+            self.mirror = self.dataclient.getmirror(self.account_number or '')
+
+    async def start_async(self):
+        '''Qualify the contracts of the data names and read the executions
+        and open orders of all clients (AccountMirror.start_async). The
+        positions of broker are known after the start.
+        '''
+        if self.dataclient == None:
+            return
+        contracts = await self.dataclient.qualify_async(
+                self.st.getdatanames())
+        self._conids = {name: contract.conId
+                for name, contract in contracts.items()}
+        await self.mirror.start_async()
+
+    def start(self):
+        '''Start the broker state with the dataclient (start_async), called
+        by the strategy start. Inside the event loop the start is scheduled
+        and the broker state is available when it's finished.
+        '''
+        if self.dataclient == None:
+            return
+        loop = util.getLoop()
+        if loop.is_running():
+            self._starting = loop.create_task(self.start_async())
+        else:
+            loop.run_until_complete(self.start_async())
+
+    @property
+    def order_list(self):
+        '''Current orders
+        '''
+        return list(self.book.open.values())
+
+    @property
+    def order_history(self):
+        '''Closed orders
+        '''
+        return list(self.book.closed.values())
+
+    def next(self, datetime, flags=None):
+        '''Update current time. The flags of the session calendar replace
+        the time parameters when running without dataclient.
+        '''
         if self.dataclient != None:
             self.now = dt.datetime.utcnow()
+            # Events received since last bar, no requests are sent
+            self.mirror.poll()
         else:
             self.now = datetime
+        self._flags = flags
 
     def check_last_trade_time(self):
         '''Check if time parameter allow open a new order based on last order executed time
@@ -134,42 +435,80 @@ class OrdersManagement(object):
             return False
         return True
     
+    def broker_position(self, symbol):
+        '''Return the position of broker for the data name (None without
+        dataclient or if the data name is not a contract of broker).
+        '''
+        if self.mirror is None or symbol not in self._conids:
+            return None
+        return self.mirror.position(self._conids[symbol])
+
     def confirm_fill(self, order):
-        '''Get confirmation about the execution of order with the dataclient
+        '''Get confirmation about the execution of order with the dataclient.
+        The position of broker must be in the side of the order.
         '''
-        if self.dataclient != None:
-            contract, execution, report = self.dataclient.getfills()
-            #TODO
-        return True
+        position = self.broker_position(order.symbol)
+        if position is None:
+            return True
+        if order.side == LONG:
+            return position > 0
+        elif order.side == SHORT:
+            return position < 0
+        else:
+            raise DirectionNotFound()
 
-    def confirm_close(self):
-        '''Check with dataclient if the order was executed
+    def confirm_close(self, symbol):
+        '''Check with dataclient if the position of symbol was closed
         '''
-        if self.dataclient != None:
-            contract, execution, report = self.dataclient.getfills()
-            #TODO
-        return True
+        position = self.broker_position(symbol)
+        if position is None:
+            return True
+        return position == 0
 
     def clear_closed_orders(self):
         '''Check with dataclient if order is already closed
         '''
-        if self.dataclient != None:
-            contracts, executions, reports = self.dataclient.getcompletedorders(apionly=True)
-            #TODO 
-
-        # Remove from current order list and append to order history list
-        for i in range(len(self.order_list)-1, -1, -1):
-            if self.order_list[i].closed:
-                self.order_history.append(self.order_list[i])
-                self.order_list.pop(i)
+        if self._closing:
+            # Orders are closed when the broker has no position
+            for order in self._closing:
+                if self.confirm_close(order.symbol):
+                    self._close(order)
+            self._closing = [order for order in self._closing
+                    if not order.closed]
 
     def close_all_positions(self):
-        for i in range(0, len(self.order_list)-1,  1):
-            self.close_order(self.order_list[i])
+        for order in self.book:
+            self.close_order(order)
         self.clear_closed_orders()
 
-    def get_pnl(self, symbol):
-        pass #TODO
+    def close_positions(self, symbol):
+        '''Close the position of symbol (all executed orders of symbol)
+        '''
+        for order in self.book.symbol_orders(symbol):
+            if order.executed and order not in self._closing:
+                self.close_order(order)
+                break
+
+    def get_pnl(self, symbol=None):
+        '''Return the realized and the unrealized PnL of fills of symbol
+        (of the portfolio if symbol is None)
+        '''
+        return self.pnl.pnl(symbol)
+
+    def get_unrealized(self, symbol=None):
+        '''Return the unrealized PnL of the position of symbol at the last
+        close (of the portfolio if symbol is None). The PnL stops of the
+        symbols are compared with this value
+        '''
+        if symbol is None:
+            return self.pnl.total_unrealized
+        return self.pnl.unrealized.get(symbol, 0.)
+
+    def notify_fill(self, order):
+        '''Add the execution of the backtrader order (completed) to the PnL
+        '''
+        self.pnl.fill(order.data._name, order.executed.size,
+                order.executed.price, order.executed.comm or 0.)
 
     def check_close_conditions(self):
         '''Check the order close conditions, the symbol close conditions and the time parameter for closing the positions
@@ -177,25 +516,50 @@ class OrdersManagement(object):
 
         self.clear_closed_orders()
 
-        # Check PnL stops
-        for key, value in self.takeprofit.items():
-            if self.get_pnl(key) >= float(value):
-                self.close_positions(key)
-
-        for key, value in self.stoploss.items():
-            if self.get_pnL(key) <= float(value):
-                self.close_positions(key)
+        # Check PnL stops of the symbols with position, the stop loss is
+        # the loss (positive or negative value) of the position
+        for symbol in self.pnl.open_symbols():
+            self.pnl.update(symbol, self.st.getdatabyname(symbol).close[0])
+            pnl = self.get_unrealized(symbol)
+            if symbol in self.takeprofit and \
+                    pnl >= float(self.takeprofit[symbol]):
+                self.close_positions(symbol)
+            elif symbol in self.stoploss and \
+                    pnl <= -abs(float(self.stoploss[symbol])):
+                self.close_positions(symbol)
         self.clear_closed_orders()
 
-        to_close = []
-        for order in self.order_list:
-            # Check the order close conditions
-            if order.check_stops(self.st.getdatabyname(order.symbol).close[0]) or order.check_timedecay(self.st.datas[0].datetime.datetime(0)):
-                to_close.append(order)
-        to_close = list(dict.fromkeys(to_close))
+        if len(self.book) == 0:
+            return
 
-        for order in to_close:
-            self.close_order(order)
+        if self.dataclient != None:
+            # Stops of all open orders compared with the closes by symbol
+            closes = [self.st.getdatabyname(symbol).close[0]
+                    for symbol in self.store.symbols]
+            orders = [self.store.orders[row]
+                    for row in self.store.check_stops(closes)]
+        else:
+            # Only the stops crossed by the bar are checked
+            orders = []
+            for symbol, triggers in self.triggers.items():
+                if not triggers:
+                    continue
+                data = self.st.getdatabyname(symbol)
+                if self.intrabar:
+                    orders += triggers.trigger(data.low[0], data.high[0])
+                else:
+                    orders += triggers.trigger(data.close[0])
+        for order in orders:
+            # Orders closed with other order of the symbol are skipped
+            if not order.closed and order not in self._closing:
+                self.close_order(order)
+
+        # Only the orders with the deadline passed are checked
+        now = self.st.datas[0].datetime.datetime(0)
+        while self._expiries and self._expiries[0][0] <= now:
+            deadline, count, order = heapq.heappop(self._expiries)
+            if not order.closed and order not in self._closing:
+                self.close_order(order)
         self.clear_closed_orders()
 
     def check_order_final_time(self):
@@ -203,6 +567,9 @@ class OrdersManagement(object):
         Check if parameters are passed and compares the values with dataclient (if activated) or the backtrader strategy.
         '''
 
+        if self.dataclient == None and self._flags is not None:
+            return bool(self._flags & su.MAY_OPEN)
+
         if self.orderfinaltime == None:
             return True
 
@@ -221,6 +588,9 @@ class OrdersManagement(object):
         '''Check if parameter with time to close orders is activated, then
         check if time to close all orders
         '''
+        if self.dataclient == None and self._flags is not None:
+            return bool(self._flags & su.MUST_FLATTEN)
+
         if self.timetocloseorders == None:
             return False
         if self.dataclient == None:
@@ -231,24 +601,25 @@ class OrdersManagement(object):
                 return True
         return False
 
-    def confirm_close(self, tradeid):
-        #TODO
-        return True
-    
     def close_order(self, order):
         '''Close position means openning a oposite
         position with same parameters
         '''
-        if order.executed:
-            if not order.closed:
-                _order = self.st.close(
-                    data = self.st.getdatabyname(order.symbol),
-                    price=None, 
-                    exectype= Order.Market, 
-                    )
-
-            if self.dataclient != None:
-                self.confirm_close(symbol)
+        if order.executed and not order.closed:
+            _order = self.st.close(
+                data = self.st.getdatabyname(order.symbol),
+                price=None, 
+                exectype= Order.Market, 
+                )
+
+            # The position of the symbol is closed with all its orders
+            for _order in self.book.symbol_orders(order.symbol):
+                if not _order.executed:
+                    continue
+                if self.dataclient == None:
+                    self._close(_order)
+                elif _order not in self._closing:
+                    self._closing.append(_order)
 
     def get_time_close_orders(self): #TODO not used
         '''Return the secconds missing to close orders time.
@@ -330,6 +701,7 @@ class OrdersManagement(object):
 
         if order.side == LONG:
             _order = self.st.buy( 
+                    data=self.st.getdatabyname(order.symbol),
                     size= order.lot,
                     price=None, 
                     exectype=Order.Market, 
@@ -339,6 +711,7 @@ class OrdersManagement(object):
 
         elif order.side == SHORT:
             _order = self.st.sell(
+                    data=self.st.getdatabyname(order.symbol),
                     size= order.lot,
                     price=None, 
                     exectype=Order.Market, 
@@ -359,9 +732,10 @@ class OrdersManagement(object):
             print(tabulate(df))
 
         df = pd.DataFrame({
-            'Open Orders':len(self.order_list),
-            'Closed Orders':len(self.order_history),
+            'Open Orders':len(self.book.open),
+            'Closed Orders':len(self.book.closed),
             'Daily Orders':len(self.daily_orders),
+            'PnL':self.pnl.pnl(),
             #TODO 'Time to next order'
             }, index=[0])
 
@@ -425,27 +799,59 @@ class OrdersManagement(object):
         '''
         self.timebetweenorders = value
 
+    def set_intrabar(self, value):
+        '''Compare the stops with the high and the low of bars instead of
+        the close. Only in backtesting (without dataclient)
+        '''
+        self.intrabar = value
+
     def show_orders_number(self):
         '''Show the open orders number and the closed orders number.
         '''
-        if self.dataclient != None:
-            #TODO
-            return 0
+        if self.mirror is not None:
+            return self.mirror.open_orders()
         else:
-            return len(self.order_list)
+            return len(self.book)
 
     def show_closed_orders(self):
-        if dataclient != None:
-            con, exe, rep = self.dataclient.getcompletedorders()
-        else:
-            pass
-        #TODO
-
-    def set_executed(self, tradeid, datetime):
-        for i in range(len(self.order_list)-1, -1, -1):
-            if self.order_list[i]._id == tradeid:
-                self.order_list[i]._set_executed(datetime)
-                break
+        '''Return the data frame of closed orders (orders of broker with
+        dataclient)
+        '''
+        if self.mirror is not None:
+            orders = self.mirror.orders_df()
+            if orders.empty:
+                return orders
+            return orders[~orders.status.isin(ACTIVE_STATES)]
+        return pd.concat([order.as_dataframe()
+            for order in self.book.closed.values()]) if self.book.closed \
+                    else pd.DataFrame()
+
+    def set_executed(self, tradeid, datetime, filled_price=None):
+        '''Set the order of trade id as executed
+        '''
+        order = self.book.open.get(tradeid)
+        if order is not None and not order.executed:
+            order._set_executed(datetime, filled_price)
+            deadline = order.deadline()
+            if deadline is not None:
+                heapq.heappush(self._expiries,
+                        (deadline, next(self._expiry_count), order))
+            if self.dataclient == None:
+                self._triggers(order.symbol).add(order)
+
+    def set_stops(self, tradeid, sl, tp):
+        '''Change the stops of the order of trade id. The stops of executed
+        orders must be changed here (not with the order) to update the stop
+        levels.
+        '''
+        order = self.book.open.get(tradeid)
+        if order is None:
+            return
+        order.set_stops(sl, tp)
+        if order.executed and self.dataclient == None:
+            triggers = self._triggers(order.symbol)
+            triggers.remove(order)
+            triggers.add(order)
     
     def set_takeprofit(self, _dict):
         '''Set take profit for data name. This is different from the stops
@@ -470,14 +876,13 @@ class OrdersManagement(object):
         '''
         if self.dataclient != None:
             self.dataclient.close()
-        for order in self.order_list:
+        for order in self.book:
             order.print_order()
 
         open_orders = pd.DataFrame()
-        if len(self.order_list) > 0:
-
-            for order in self.order_list:
-                open_orders = open_orders.append(order.as_dataframe())
+        if len(self.book) > 0:
+            open_orders = pd.concat([order.as_dataframe()
+                for order in self.book])
         output_fn = 'open_orders'+str(dt.datetime.utcnow()).replace('-','')+'.csv'
 
         if open_orders.size > 0:
@@ -485,10 +890,9 @@ class OrdersManagement(object):
                     output_filename=output_fn)
 
         order_his = pd.DataFrame()
-        if len(self.order_history) > 0:
-
-            for order in self.order_history:
-                order_his = order_his.append(order.as_dataframe())
+        if len(self.book.closed) > 0:
+            order_his = pd.concat([order.as_dataframe()
+                for order in self.book.closed.values()])
         output_fn = 'closed_orders_'+str(pd.Timestamp(dt.datetime.now())).replace('-','').replace(' ', '').replace(':','')+'.csv'
         if order_his.size > 0:
             du.save_data(dataframe=order_his, output_filename=output_fn)
@@ -559,15 +963,40 @@ class OrdersManagement(object):
             raise DirectionNotFound()
 
     def update_orders(self):
-        if self.dataclient != None:
-            positions = self.dataclient.getpositions()
-        #TODO
+        '''Update the executed orders with the last fill of broker
+        '''
+        if self.mirror is None:
+            return
+        for order in self.book:
+            if order.executed and order._filled_price is None and \
+                    order.symbol in self._conids:
+                fill = self.mirror.last_fill(self._conids[order.symbol])
+                if fill is not None:
+                    order._filled_price = fill.execution.avgPrice
     
+    def _close(self, order):
+        '''Internal function for moving the order to the closed orders.
+        The row of the order store is freed.
+        '''
+        self.book.close(order)
+        order.detach()
+        triggers = self.triggers.get(order.symbol)
+        if triggers:
+            triggers.remove(order)
+
+    def _triggers(self, symbol):
+        '''Internal function returning the stop levels of the symbol
+        '''
+        if symbol not in self.triggers:
+            self.triggers[symbol] = TriggerIndex()
+        return self.triggers[symbol]
+
     def _add_order(self, order):
         '''Internal function for adding orders to the orders lists
         '''
         if order != None:
-            self.order_list.append(order)
+            order.attach(self.store)
+            self.book.add(order)
             self.daily_orders.append(order)
             if order.side == LONG:
                 self.long_daily_orders += 1
@@ -578,25 +1007,201 @@ class OrdersManagement(object):
         '''Check if time parameters allow open a new order.
         This function is called just before sending a new order.
         '''
+        if self.dataclient == None and self._flags is not None:
+            if not self._flags & su.MAY_OPEN:
+                return False
+
+        else:
+            if self.orderstarttime != None:
+
+                if self.now.time() < self.orderstarttime:
+                    return False
+
+            if self.orderfinaltime != None:
+                if self.now.time() > self.orderfinaltime:
+                    return False
+
+        if not self.check_last_trade_time():
+            return False
+
+        # Time of the order sent
         if self.dataclient == None:
             # If dataclient is deactivated then use backtrader time
             self._lastordertime = self.st.datas[0].datetime.datetime(0)
         else:
-            self._lastordertime = dt.datetime.now()
+            self._lastordertime = self.now
 
-        if self.orderstarttime != None:
+        return True
 
-            if self.now.time() < self.orderstarttime:
-                return False
+class OrderStore(object):
+    '''Values of open orders in NumPy columns (struct of arrays). The
+    orders are OrderHandler objects that read and write a row of the
+    store, then the stops of all orders are checked with one comparison.
+    The rows of closed orders are reused by new orders.
 
-        if self.orderfinaltime != None:
-            if self.now.time() > self.orderfinaltime:
-                return False
+    Parameters:
 
-        if not self.check_last_trade_time():
-            return False
+      - capacity (default: 64)
 
-        return True
+      Initial number of rows, the columns grow when full
+    '''
+
+    # Column names and types, None values are NaN or NaT
+    COLUMNS = (
+            ('side', np.int8),
+            ('lot', np.int64),
+            ('stoploss', np.float64),
+            ('takeprofit', np.float64),
+            ('time_decay', np.float64),
+            ('filled_time', 'datetime64[ns]'),
+            ('filled_price', np.float64),
+            ('symbol', np.int32),
+            ('executed', np.bool_),
+            ('active', np.bool_),
+            )
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.columns = {name: self._empty(dtype, capacity)
+                for name, dtype in self.COLUMNS}
+        # Orders by row (None for free rows) and symbol names by index
+        self.orders = []
+        self.symbols = []
+        self._symbols = dict()
+        # Rows of closed orders
+        self._free = []
+
+    @staticmethod
+    def _empty(dtype, capacity):
+        column = np.zeros(capacity, dtype=dtype)
+        if column.dtype.kind == 'f':
+            column[:] = np.nan
+        elif column.dtype.kind == 'M':
+            column[:] = np.datetime64('NaT')
+        return column
+
+    def __len__(self):
+        return self.size - len(self._free)
+
+    def symbol_index(self, symbol):
+        '''Return the index of the symbol name.
+        '''
+        index = self._symbols.get(symbol)
+        if index is None:
+            index = self._symbols[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return index
+
+    def add(self, order, values):
+        '''Add a row with the values (dictionary of column values) of the
+        order. Return the row.
+        '''
+        if self._free:
+            row = self._free.pop()
+            self.orders[row] = order
+        else:
+            capacity = len(self.columns['side'])
+            if self.size == capacity:
+                for name, dtype in self.COLUMNS:
+                    column = self._empty(dtype, capacity * 2)
+                    column[:capacity] = self.columns[name]
+                    self.columns[name] = column
+            row = self.size
+            self.size += 1
+            self.orders.append(order)
+        for name, value in values.items():
+            self.set(name, row, value)
+        self.columns['active'][row] = True
+        return row
+
+    def remove(self, row):
+        '''Free the row and return the values (dictionary of column
+        values) of the order.
+        '''
+        values = {name: self.get(name, row) for name, _ in self.COLUMNS
+                if name != 'active'}
+        for name, dtype in self.COLUMNS:
+            self.columns[name][row] = self._empty(dtype, 1)[0]
+        self.orders[row] = None
+        self._free.append(row)
+        return values
+
+    def get(self, name, row):
+        '''Return the value of the column in the row.
+        '''
+        value = self.columns[name][row]
+        if name == 'side':
+            return SIDE_NAMES[int(value)]
+        elif name == 'symbol':
+            return self.symbols[value]
+        elif name == 'lot':
+            return int(value)
+        elif name in ('executed', 'active'):
+            return bool(value)
+        elif name == 'filled_time':
+            return None if np.isnat(value) else \
+                    pd.Timestamp(value).to_pydatetime()
+        elif np.isnan(value):
+            return None
+        return float(value)
+
+    def set(self, name, row, value):
+        '''Change the value of the column in the row.
+        '''
+        if name == 'side':
+            value = SIDES[value]
+        elif name == 'symbol':
+            value = self.symbol_index(value)
+        elif value is None:
+            value = np.datetime64('NaT') if name == 'filled_time' else np.nan
+        elif name == 'filled_time':
+            value = pd.Timestamp(value)
+            if value.tzinfo is not None:
+                value = value.tz_localize(None)
+            value = np.datetime64(value, 'ns')
+        self.columns[name][row] = value
+
+    def open_rows(self):
+        '''Return the rows of the executed orders.
+        '''
+        columns = self.columns
+        return np.flatnonzero(columns['active'][:self.size] &
+                columns['executed'][:self.size])
+
+    def check_stops(self, closes, rows=None):
+        '''Return the rows (of rows, executed orders if None) with the
+        stop loss or the take profit reached. The closes are the current
+        prices by symbol index.
+        '''
+        if rows is None:
+            rows = self.open_rows()
+        columns = self.columns
+        prices = np.asarray(closes, dtype=np.float64)[columns['symbol'][rows]]
+        side = columns['side'][rows]
+        stoploss = columns['stoploss'][rows]
+        takeprofit = columns['takeprofit'][rows]
+        # Comparisons with NaN (stops not set) are False
+        with np.errstate(invalid='ignore'):
+            hits = ((side == 1) & ((prices <= stoploss) |
+                (prices >= takeprofit))) | ((side == -1) &
+                    ((prices >= stoploss) | (prices <= takeprofit)))
+        return rows[hits]
+
+def _column(name):
+    '''Property of OrderHandler saved in the column of the order store.
+    '''
+    def getter(self):
+        if self._store is None:
+            return self._values[name]
+        return self._store.get(name, self._row)
+
+    def setter(self, value):
+        if self._store is None:
+            self._values[name] = value
+        else:
+            self._store.set(name, self._row, value)
+
+    return property(getter, setter)
 
 class OrderHandler(object):
     '''Stores order parameters and order state information. Managed with Order Management object.
@@ -617,31 +1222,65 @@ class OrderHandler(object):
 
        -datetime
        Optional argument representing the date and time of creation of the order object. The order can be created but not never sent to the broker
+
+       The values of an open order are saved in a row of the order store (OrderStore) of the Order Management object, before the order is added
+       and after it's closed they are kept in the object
     '''
 
+    __slots__ = ('_id', 'closed', '_created_time', '_store', '_row',
+            '_values')
+
+    symbol = _column('symbol')
+    lot = _column('lot')
+    side = _column('side') # LONG or SHORT
+    executed = _column('executed') # If order was executed
+    # Time parameter
+    time_decay = _column('time_decay')
+    # Internal vars
+    _stoploss = _column('stoploss') # Absolute value of stop loss
+    _takeprofit = _column('takeprofit')
+    _filled_time = _column('filled_time')
+    _filled_price = _column('filled_price')
+
     def __init__(self, id, lots, side, symbol, datetime=None):
 
         self._id = id
-        self.symbol = symbol
-        self.lot = lots
-        self.side = side # LONG or SHORT
-    
-        self.executed = False # If order was executed
         self.closed = False   # If order was closed
-
-        # Time parameter
-        self.time_decay = None
-
-        # Internal vars
-        self._stoploss = None # Absolute value of stop loss
-        self._takeprofit = None
-        self._filled_time = None
-        self._filled_price = None 
+        self._store = None
+        self._row = None
+        self._values = {
+                'symbol':symbol,
+                'lot':lots,
+                'side':side,
+                'executed':False,
+                'time_decay':None,
+                'stoploss':None,
+                'takeprofit':None,
+                'filled_time':None,
+                'filled_price':None,
+                }
         if datetime == None:
             self._created_time = dt.datetime.now()
         else:
             self._created_time = datetime
 
+    def attach(self, store):
+        '''Move the order values to a row of the order store.
+        '''
+        if self._store is None:
+            self._row = store.add(self, self._values)
+            self._store = store
+            self._values = None
+
+    def detach(self):
+        '''Move the order values back to the object and free the row
+        of the order store.
+        '''
+        if self._store is not None:
+            self._values = self._store.remove(self._row)
+            self._store = None
+            self._row = None
+
     def check_stops(self, close):
         '''Check if stops is not none and compare
         with current price. Return True if any of stops
@@ -676,13 +1315,16 @@ class OrderHandler(object):
     def check_timedecay(self, now):
         '''Time decay is the time for closing order after the order is executed. Return True if it's time to close the order
         '''
-        if self._filled_time is not None:
-            if self.time_decay is not None:
+        deadline = self.deadline()
+        return deadline is not None and now >= deadline
 
-                if pd.Timedelta(pd.Timestamp(now) - pd.Timestamp(self._filled_time)).seconds >= self.time_decay:
-                    return True
-
-        return False
+    def deadline(self):
+        '''Return the time to close the order (fill time and time decay) or
+        None if the order is not executed or without time decay.
+        '''
+        if self._filled_time is None or self.time_decay is None:
+            return None
+        return self._filled_time + dt.timedelta(seconds=self.time_decay)
 
     def set_timedecay(self, time=None):
         '''Configure time decay
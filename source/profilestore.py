@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+'''Cache of Market Profiles. The profiles are kept in memory with LRU
+eviction and saved on disk, so optimizations and restarts don't
+generate the same profile again.
+'''
+
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import profileutils as pu
+
+# Same ranges of profileutils.ProfileAccumulator
+OPEN_RANGE_SIZE = np.timedelta64(1, 'D')
+INITIAL_BALANCE_DELTA = np.timedelta64(1, 'h')
+
+def data_fingerprint(dataframe):
+    '''Return a hash of datetime and OHLCV values of the Data Frame.
+    '''
+    return bars_fingerprint(pd.DatetimeIndex(dataframe.index).values,
+            *[dataframe[column] for column in
+                ['Open', 'High', 'Low', 'Close', 'Volume']
+                if column in dataframe.columns])
+
+def bars_fingerprint(times, *columns):
+    '''Return a hash of the time array and the value arrays of bars.
+    Missing columns (None) are skipped.
+    '''
+    sha = hashlib.sha1()
+    sha.update(np.asarray(times, dtype='datetime64[ns]').view(
+        np.int64).tobytes())
+    for column in columns:
+        if column is not None:
+            sha.update(np.asarray(column, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+def session_fingerprints(times, open, high, low, close, volume=None,
+        sessions=None):
+    '''Return the time of first bar and the fingerprint of the bars of
+    every session. The sessions are calendar days, unless 'sessions' array
+    with the session key of each bar is passed. New bars change only the
+    fingerprint of the last session.
+    '''
+    times = np.asarray(times, dtype='datetime64[ns]')
+    columns = [None if column is None else
+            np.asarray(column, dtype=np.float64)
+            for column in (open, high, low, close, volume)]
+    starts, _ = pu.session_numbers(times, sessions)
+    ends = np.append(starts[1:], len(times))
+    return times[starts], [bars_fingerprint(times[start:end],
+        *[None if column is None else column[start:end]
+            for column in columns]) for start, end in zip(starts, ends)]
+
+class ProfileStore(object):
+    '''Store Market Profiles (ProfileSlice objects) by symbol, session,
+    tick size, mode, bins and fingerprint of the session bars. The
+    histogram doesn't depend on the value area, then 'get' returns the
+    profile of any value area parameter.
+
+    Parameters:
+
+      - directory (default: None)
+
+      Directory of the files on disk. If None the profiles are kept
+      in memory only
+
+      - maxsize (default: 1024)
+
+      Maximum number of profiles in memory. The least recently used
+      profile is removed first
+    '''
+
+    def __init__(self, directory=None, maxsize=1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._profiles = OrderedDict()
+
+        if self.directory is not None and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, symbol, session, ticksize, mode, bins, fingerprint):
+        '''Return the key of profile.
+        '''
+        return (str(symbol), str(pd.Timestamp(session)), float(ticksize),
+                str(mode), str(bins), str(fingerprint))
+
+    def get(self, key, valuearea=None):
+        '''Return the profile or None if the profile is not stored.
+        If valuearea is not None and differs from the stored profile, a
+        profile of the same histogram with this value area is returned.
+        '''
+        if key in self._profiles:
+            self._profiles.move_to_end(key)
+            mp_slice = self._profiles[key]
+        else:
+            mp_slice = self._load(key)
+            if mp_slice is None:
+                return None
+            self._remember(key, mp_slice)
+
+        if valuearea is None or np.isclose(mp_slice.valuearea, valuearea):
+            return mp_slice
+        return pu.ProfileSlice(mp_slice.histogram,
+                valuearea=valuearea,
+                mode=mp_slice.mode,
+                open_range=mp_slice.open_range(),
+                initial_balance=mp_slice.initial_balance())
+
+    def put(self, key, mp_slice):
+        '''Store the profile in memory and on disk.
+        '''
+        self._remember(key, mp_slice)
+        self._save(key, mp_slice)
+
+    def session_histograms(self, symbol, times, open, high, low, close,
+            volume=None, ticksize=0.5, mode=pu.TPO, bins=pu.BINS_CLOSE,
+            sessions=None):
+        '''Return the histograms of every session of the bars arrays
+        (same list of profileutils.session_histograms). The histograms of
+        stored sessions are read from the store, the others are generated
+        and stored with the same keys of the bar by bar profiles.
+        '''
+        times = np.asarray(times, dtype='datetime64[ns]')
+        high = np.asarray(high, dtype=np.float64)
+        low = np.asarray(low, dtype=np.float64)
+        close = np.asarray(close, dtype=np.float64)
+        if volume is not None:
+            volume = np.asarray(volume, dtype=np.float64)
+        session_starts, fingerprints = session_fingerprints(times, open,
+                high, low, close, volume, sessions)
+        keys = [self.key(symbol, start, ticksize, mode, bins, fingerprint)
+                for start, fingerprint in zip(session_starts, fingerprints)]
+
+        histograms = [None if mp_slice is None else mp_slice.histogram
+                for mp_slice in [self.get(key) for key in keys]]
+        missing = [i for i, histogram in enumerate(histograms)
+                if histogram is None]
+        if not missing:
+            return histograms
+
+        # Only the bars of sessions not stored are binned
+        starts, session = pu.session_numbers(times, sessions)
+        ends = np.append(starts[1:], len(times))
+        bars = np.isin(session, missing)
+        generated = pu.session_histograms(
+                np.searchsorted(missing, session[bars]),
+                high[bars], low[bars], close[bars],
+                None if volume is None else volume[bars],
+                ticksize=ticksize, bins=bins)
+        for i, histogram in zip(missing, generated):
+            bars = slice(starts[i], ends[i])
+            self.put(keys[i], pu.ProfileSlice(histogram, mode=mode,
+                open_range=pu.period_range(times[bars], high[bars],
+                    low[bars], OPEN_RANGE_SIZE),
+                initial_balance=pu.period_range(times[bars], high[bars],
+                    low[bars], INITIAL_BALANCE_DELTA)))
+            histograms[i] = histogram
+        return histograms
+
+    def clear(self):
+        '''Remove profiles from memory. The files on disk are kept.
+        '''
+        self._profiles.clear()
+
+    def _remember(self, key, mp_slice):
+        self._profiles[key] = mp_slice
+        self._profiles.move_to_end(key)
+        while len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last=False)
+
+    def _filename(self, key):
+        return os.path.join(self.directory,
+                hashlib.sha1(repr(key).encode()).hexdigest() + '.npz')
+
+    def _load(self, key):
+        '''Internal function for reading the profile from disk.
+        '''
+        if self.directory is None:
+            return None
+
+        filename = self._filename(key)
+        if not os.path.isfile(filename):
+            return None
+
+        with np.load(filename) as stored:
+            if str(stored['key']) != repr(key):
+                return None
+            histogram = pu.ProfileHistogram(
+                    float(stored['ticksize']),
+                    int(stored['offset']),
+                    stored['tpo'],
+                    stored['volume'])
+            return pu.ProfileSlice(histogram,
+                    valuearea=float(stored['valuearea']),
+                    mode=str(stored['mode']),
+                    open_range=tuple(stored['open_range']),
+                    initial_balance=tuple(stored['initial_balance']))
+
+    def _save(self, key, mp_slice):
+        '''Internal function for writing the profile on disk. The file is
+        written with a temporary name and renamed, then other processes
+        never read an incomplete file.
+        '''
+        if self.directory is None:
+            return
+
+        histogram = mp_slice.histogram
+        fd, tmpname = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+        with os.fdopen(fd, 'wb') as tmpfile:
+            np.savez_compressed(tmpfile,
+                    key=repr(key),
+                    ticksize=histogram.ticksize,
+                    offset=histogram.offset,
+                    tpo=histogram.tpo,
+                    volume=histogram.volume,
+                    valuearea=mp_slice.valuearea,
+                    mode=mp_slice.mode,
+                    open_range=np.asarray(mp_slice.open_range(),
+                        dtype=np.float64),
+                    initial_balance=np.asarray(mp_slice.initial_balance(),
+                        dtype=np.float64))
+        os.replace(tmpname, self._filename(key))
+
+# Stores shared by the objects of the same process
+_stores = dict()
+
+def getstore(directory=None, maxsize=1024):
+    '''Return the store of the directory. The same store is returned for
+    all calls in the process, then the memory cache is shared between
+    the strategies of an optimization.
+    '''
+    if directory not in _stores:
+        _stores[directory] = ProfileStore(directory, maxsize)
+    return _stores[directory]
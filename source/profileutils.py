@@ -0,0 +1,767 @@
+# -*- coding: utf-8 -*-
+
+'''Native Market Profile engine. The profile is built with NumPy arrays
+on the tick grid and exposes the same interface used from the
+MarketProfile library slices (value_area, open_range(), profile).
+'''
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# Market Profile modes
+TPO = 'tpo'
+VOL = 'vol'
+
+# Price binning of bars
+BINS_CLOSE = 'Close' # Only close price (same as MarketProfile library)
+BINS_RANGE = 'Range' # All rows between low and high of the bar
+
+def price_rows(prices, ticksize):
+    '''Convert prices to rows of the tick grid. The prices are rounded
+    up to the next row, in the same way of MarketProfile library.
+    '''
+    roundoff = 1 / float(ticksize)
+    return np.ceil(np.asarray(prices, dtype=np.float64) * roundoff
+            ).astype(np.int64)
+
+def bar_volume(volume, size):
+    '''Return the volume of bars as float array. Missing volume (None,
+    NaN or negative values, like -1 of IB MIDPOINT data) is zero.
+    '''
+    if volume is None:
+        return np.zeros(size, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    return np.where(volume >= 0, volume, 0.)
+
+def midmax_index(values):
+    '''Return the index of maximum value closest to the middle of array.
+    '''
+    if len(values) == 0:
+        return None
+    maxima = np.flatnonzero(values == np.max(values))
+    return int(maxima[np.argmin(np.abs(maxima - len(values) / 2))])
+
+class ProfileHistogram(object):
+    '''Dense histogram of a Market Profile on the tick grid. The arrays
+    start at the row 'offset' and store the TPO count and the volume
+    of each row.
+
+    Parameters:
+
+      - ticksize
+
+      Size of ticks (rows) in Market Profile
+
+      - offset (default: 0)
+
+      Row of the tick grid of the first element of arrays
+
+      - tpo (default: None)
+
+      Array with TPO count of rows
+
+      - volume (default: None)
+
+      Array with volume of rows
+    '''
+
+    def __init__(self, ticksize, offset=0, tpo=None, volume=None):
+        self.ticksize = float(ticksize)
+        self.roundoff = 1 / self.ticksize
+        self.offset = int(offset)
+
+        if tpo is None:
+            tpo = np.zeros(0, dtype=np.int64)
+        self.tpo = np.asarray(tpo, dtype=np.int64)
+
+        if volume is None:
+            volume = np.zeros(len(self.tpo), dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.float64)
+
+    @classmethod
+    def from_bars(cls, high, low, close, volume=None, ticksize=0.5,
+            bins=BINS_CLOSE):
+        '''Create the histogram from arrays of bars.
+        '''
+        high = np.asarray(high, dtype=np.float64)
+        low = np.asarray(low, dtype=np.float64)
+        close = np.asarray(close, dtype=np.float64)
+        volume = bar_volume(volume, len(close))
+
+        if bins == BINS_CLOSE:
+            valid = np.isfinite(close)
+            rows = price_rows(close[valid], ticksize)
+            if len(rows) == 0:
+                return cls(ticksize)
+            offset = rows.min()
+            size = rows.max() - offset + 1
+            tpo = np.bincount(rows - offset, minlength=size)
+            vol = np.bincount(rows - offset, weights=volume[valid],
+                    minlength=size)
+            return cls(ticksize, offset, tpo, vol)
+
+        elif bins == BINS_RANGE:
+            valid = np.isfinite(high) & np.isfinite(low)
+            top = price_rows(high[valid], ticksize)
+            bottom = price_rows(low[valid], ticksize)
+            if len(top) == 0:
+                return cls(ticksize)
+            offset = bottom.min()
+            size = top.max() - offset + 1
+
+            # Each bar adds one TPO (and the volume split in equal parts)
+            # to every row between low and high
+            nrows = top - bottom + 1
+            starts = bottom - offset
+            ends = top - offset + 1
+            tpo = np.cumsum(
+                    np.bincount(starts, minlength=size+1) -
+                    np.bincount(ends, minlength=size+1))[:size]
+            share = volume[valid] / nrows
+            vol = np.cumsum(
+                    np.bincount(starts, weights=share, minlength=size+1) -
+                    np.bincount(ends, weights=share, minlength=size+1))[:size]
+            return cls(ticksize, offset, tpo, vol)
+
+        else:
+            raise ValueError('Unrecognized bins: %s' % bins)
+
+    def rows(self):
+        '''Return the rows of the tick grid with at least one TPO.
+        '''
+        return np.flatnonzero(self.tpo > 0) + self.offset
+
+    def prices(self, rows):
+        '''Convert rows of the tick grid to prices.
+        '''
+        return rows.astype(np.float64) / self.roundoff
+
+    def weights(self, mode=TPO):
+        '''Return weights of occupied rows for the Market Profile mode.
+        The volume mode uses the TPO count if the bars have no volume.
+        '''
+        occupied = self.tpo > 0
+        if mode == TPO:
+            return self.tpo[occupied]
+        elif mode == VOL:
+            if not self.has_volume():
+                return self.tpo[occupied]
+            return self.volume[occupied]
+        else:
+            raise ValueError('Unrecognized mode: %s' % mode)
+
+    def has_volume(self):
+        '''Return True if the bars of the histogram have volume.
+        '''
+        return self.volume.sum() > 0
+
+    def profile(self, mode=TPO):
+        '''Return the profile as pandas Series indexed by price.
+        '''
+        name = 'Volume' if mode == VOL and self.has_volume() else 'Close'
+        index = pd.Index(self.prices(self.rows()), name='Close')
+        return pd.Series(self.weights(mode), index=index, name=name)
+
+    def levels(self, valuearea=0.7, mode=TPO):
+        '''Return VAL, VAH and POC prices without building the pandas
+        profile. Return None values if histogram is empty.
+        '''
+        poc, value_areas = self.value_areas([valuearea], mode)
+        if poc is None:
+            return None, None, None
+        return value_areas[0] + (poc,)
+
+    def value_areas(self, valueareas, mode=TPO):
+        '''Return the POC price and a list with VAL and VAH of each
+        value area parameter, calculated in a single expansion.
+        '''
+        values = self.weights(mode)
+        poc_idx = midmax_index(values)
+        if poc_idx is None:
+            return None, [(None, None) for _ in valueareas]
+        prices = self.prices(self.rows())
+        min_idx, max_idx = value_area_bounds(values, poc_idx,
+                values.sum() * np.asarray(valueareas, dtype=np.float64))
+        return prices[poc_idx], list(zip(prices[min_idx], prices[max_idx]))
+
+    def add_bar(self, high, low, close, volume=0., bins=BINS_CLOSE):
+        '''Add one bar to the histogram. The cost is proportional to the
+        number of rows of the bar.
+        '''
+        if bins == BINS_CLOSE:
+            if not np.isfinite(close):
+                return
+            bottom = top = int(np.ceil(close * self.roundoff))
+        elif bins == BINS_RANGE:
+            if not (np.isfinite(high) and np.isfinite(low)):
+                return
+            bottom = int(np.ceil(low * self.roundoff))
+            top = int(np.ceil(high * self.roundoff))
+        else:
+            raise ValueError('Unrecognized bins: %s' % bins)
+
+        self._reserve(bottom, top)
+        start = bottom - self.offset
+        end = top - self.offset + 1
+        self.tpo[start:end] += 1
+        if volume > 0:
+            self.volume[start:end] += volume / (end - start)
+
+    def add(self, other):
+        '''Add the rows of other histogram with the same tick size.
+        '''
+        self._combine(other, 1)
+
+    def subtract(self, other):
+        '''Subtract the rows of other histogram with the same tick size.
+        '''
+        self._combine(other, -1)
+
+    def _combine(self, other, sign):
+        '''Internal function for adding or subtracting other histogram.
+        The cost is proportional to the rows of other histogram.
+        '''
+        if other.ticksize != self.ticksize:
+            raise ValueError('Tick size of histograms are different: '
+                    '%s, %s' % (self.ticksize, other.ticksize))
+        if len(other.tpo) == 0:
+            return
+
+        self._reserve(other.offset, other.offset + len(other.tpo) - 1)
+        start = other.offset - self.offset
+        end = start + len(other.tpo)
+        self.tpo[start:end] += sign * other.tpo
+        self.volume[start:end] += sign * other.volume
+
+    def _reserve(self, bottom, top):
+        '''Internal function for growing the arrays until rows bottom
+        and top are inside the histogram. Extra rows are allocated for
+        avoiding a new allocation at every new high or low.
+        '''
+        if len(self.tpo) == 0:
+            self.offset = bottom
+            size = top - bottom + 1
+            self.tpo = np.zeros(size, dtype=np.int64)
+            self.volume = np.zeros(size, dtype=np.float64)
+            return
+
+        last = self.offset + len(self.tpo) - 1
+        if bottom >= self.offset and top <= last:
+            return
+
+        padding = len(self.tpo) // 2 + 1
+        first = bottom - padding if bottom < self.offset else self.offset
+        last = top + padding if top > last else last
+
+        tpo = np.zeros(last - first + 1, dtype=np.int64)
+        volume = np.zeros(last - first + 1, dtype=np.float64)
+        start = self.offset - first
+        tpo[start:start + len(self.tpo)] = self.tpo
+        volume[start:start + len(self.volume)] = self.volume
+        self.offset, self.tpo, self.volume = first, tpo, volume
+
+def value_area_steps(values, poc_idx, limit):
+    '''Expand the value area from the Point of Control until the sum of
+    weights is above limit. The rules are the same of MarketProfile
+    library: the side with greater weight is added first.
+    Return arrays with the sum of weights, first row index and last row
+    index after each step of expansion.
+    '''
+    values = values.tolist()
+    last = len(values) - 1
+    trial = values[poc_idx]
+    min_idx = max_idx = poc_idx
+    trials, mins, maxs = [trial], [min_idx], [max_idx]
+
+    while trial <= limit:
+        low = values[min_idx - 1] if min_idx > 0 else None
+        high = values[max_idx + 1] if max_idx < last else None
+
+        if low is None and high is None:
+            break
+
+        if not high or (low and low > high):
+            if low is None:
+                trial += high
+                max_idx += 1
+            else:
+                trial += low
+                min_idx -= 1
+        else:
+            trial += high
+            max_idx += 1
+
+        trials.append(trial)
+        mins.append(min_idx)
+        maxs.append(max_idx)
+
+    return np.array(trials), np.array(mins), np.array(maxs)
+
+def value_area_bounds(values, poc_idx, targets):
+    '''Return the index of first and last rows of the value area for
+    each target (sum of weights) in a single expansion.
+    '''
+    targets = np.atleast_1d(np.asarray(targets, dtype=np.float64))
+    trials, mins, maxs = value_area_steps(values, poc_idx, targets.max())
+
+    # First step above the target (last step if the profile is complete)
+    above = trials[np.newaxis, :] > targets[:, np.newaxis]
+    steps = np.where(above.any(axis=1), above.argmax(axis=1),
+            len(trials) - 1)
+    return mins[steps], maxs[steps]
+
+class ProfileSlice(object):
+    '''Market Profile levels generated from a histogram. This object
+    has the same interface of MarketProfileSlice (MarketProfile library)
+    used by the strategies.
+
+    Parameters:
+
+      - histogram
+
+      ProfileHistogram object
+
+      - valuearea (default: 0.7)
+
+      Value Area parameter
+
+      - mode (default: 'tpo')
+
+      Market Profile mode ('tpo' or 'vol')
+
+      - open_range (default: (nan, nan))
+
+      Low and high of the open range
+
+      - initial_balance (default: (nan, nan))
+
+      Low and high of the initial balance
+    '''
+
+    def __init__(self, histogram, valuearea=0.7, mode=TPO,
+            open_range=(np.nan, np.nan),
+            initial_balance=(np.nan, np.nan)):
+
+        self.histogram = histogram
+        self.valuearea = float(valuearea)
+        self.mode = mode
+        self._open_range = open_range
+        self._initial_balance = initial_balance
+
+        self.profile = histogram.profile(mode)
+        self._prices = self.profile.index.values
+        self._values = self.profile.values
+
+        self.total_volume = self._values.sum()
+        if len(self._prices) > 0:
+            self.profile_range = self._prices.min(), self._prices.max()
+        else:
+            self.profile_range = np.nan, np.nan
+
+        self.poc_idx = midmax_index(self._values)
+        if self.poc_idx is not None:
+            self.poc_volume = self._values[self.poc_idx]
+            self.poc_price = self._prices[self.poc_idx]
+            self.value_area = self.calculate_value_area(self.valuearea)
+            self.balanced_target = self.calculate_balanced_target()
+        else:
+            self.poc_volume = None
+            self.poc_price = None
+            self.value_area = None
+            self.balanced_target = None
+
+    def open_range(self):
+        return self._open_range
+
+    def initial_balance(self):
+        return self._initial_balance
+
+    def calculate_value_area(self, valuearea):
+        '''Return VAL and VAH for the value area parameter.
+        '''
+        return self.value_areas([valuearea])[0]
+
+    def value_areas(self, valueareas):
+        '''Return a list with VAL and VAH of each value area parameter.
+        All value areas are calculated in a single expansion.
+        '''
+        if self.poc_idx is None:
+            return [None for _ in valueareas]
+        min_idx, max_idx = value_area_bounds(self._values, self.poc_idx,
+                self.total_volume * np.asarray(valueareas, dtype=np.float64))
+        return list(zip(self._prices[min_idx], self._prices[max_idx]))
+
+    def calculate_balanced_target(self):
+        area_above_poc = self._prices.max() - self.poc_price
+        area_below_poc = self.poc_price - self._prices.min()
+
+        if area_above_poc >= area_below_poc:
+            return self.poc_price - area_above_poc
+        return self.poc_price + area_below_poc
+
+    def as_dict(self):
+        ib_low, ib_high = self.initial_balance()
+        or_low, or_high = self.open_range()
+        profile_low, profile_high = self.profile_range
+        val, vah = self.value_area
+
+        return {
+            'or_low': or_low,
+            'or_high': or_high,
+            'ib_low': ib_low,
+            'ib_high': ib_high,
+            'poc': self.poc_price,
+            'low': profile_low,
+            'high': profile_high,
+            'val': val,
+            'vah': vah,
+            'bt': self.balanced_target,
+            }
+
+def period_range(times, high, low, delta):
+    '''Return low and high of bars from first bar until first bar time
+    plus delta (including the last one).
+    '''
+    if len(times) == 0:
+        return np.nan, np.nan
+    end = np.searchsorted(times, times[0] + delta, side='right')
+    return np.nanmin(low[:end]), np.nanmax(high[:end])
+
+def build_profile(dataframe, ticksize=0.5, valuearea=0.7, mode=TPO,
+        bins=BINS_CLOSE, open_range_size=pd.to_timedelta(1, 'D'),
+        initial_balance_delta=pd.to_timedelta(1, 'h')):
+    '''Generate the Market Profile from a pandas Data Frame with
+    'Open', 'High', 'Low', 'Close' and 'Volume' columns and
+    datetime index (same format of datautils.parsedata).
+    '''
+    times = pd.DatetimeIndex(dataframe.index).values
+    high = dataframe['High'].to_numpy(dtype=np.float64)
+    low = dataframe['Low'].to_numpy(dtype=np.float64)
+    close = dataframe['Close'].to_numpy(dtype=np.float64)
+    volume = None
+    if 'Volume' in dataframe.columns:
+        volume = dataframe['Volume'].to_numpy(dtype=np.float64)
+
+    histogram = ProfileHistogram.from_bars(high, low, close, volume,
+            ticksize=ticksize, bins=bins)
+
+    return ProfileSlice(histogram, valuearea=valuearea, mode=mode,
+            open_range=period_range(times, high, low,
+                pd.Timedelta(open_range_size).to_timedelta64()),
+            initial_balance=period_range(times, high, low,
+                pd.Timedelta(initial_balance_delta).to_timedelta64()))
+
+def session_histograms(session, high, low, close, volume=None,
+        ticksize=0.5, bins=BINS_CLOSE):
+    '''Create the histograms of all sessions with a single bincount.
+    The array 'session' has the (sorted) session number of each bar.
+    Return a list with one ProfileHistogram for each session number.
+    '''
+    session = np.asarray(session, dtype=np.int64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    volume = bar_volume(volume, len(close))
+    nsessions = int(session[-1]) + 1 if len(session) > 0 else 0
+
+    if bins == BINS_CLOSE:
+        valid = np.isfinite(close)
+        bottom = top = price_rows(close[valid], ticksize)
+    elif bins == BINS_RANGE:
+        valid = np.isfinite(high) & np.isfinite(low)
+        bottom = price_rows(low[valid], ticksize)
+        top = price_rows(high[valid], ticksize)
+    else:
+        raise ValueError('Unrecognized bins: %s' % bins)
+    session = session[valid]
+
+    # First and last row of each session
+    counts = np.bincount(session, minlength=nsessions)
+    nonempty = counts > 0
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    first = np.zeros(nsessions, dtype=np.int64)
+    last = np.zeros(nsessions, dtype=np.int64)
+    if len(starts) > 0:
+        first[nonempty] = np.minimum.reduceat(bottom, starts)
+        last[nonempty] = np.maximum.reduceat(top, starts)
+
+    # Sessions are placed side by side in one array, with one extra row
+    # per session where the differences of the bars ranges sum to zero
+    widths = np.where(nonempty, last - first + 2, 0)
+    base = np.cumsum(widths) - widths
+    size = int(widths.sum())
+    begin = base[session] + bottom - first[session]
+    end = base[session] + top - first[session] + 1
+
+    share = volume[valid] / (top - bottom + 1)
+    tpo = np.cumsum(np.bincount(begin, minlength=size) -
+            np.bincount(end, minlength=size))
+    vol = np.cumsum(np.bincount(begin, weights=share, minlength=size) -
+            np.bincount(end, weights=share, minlength=size))
+
+    histograms = []
+    for i in range(nsessions):
+        if not nonempty[i]:
+            histograms.append(ProfileHistogram(ticksize))
+            continue
+        rows = slice(base[i], base[i] + widths[i] - 1)
+        histograms.append(ProfileHistogram(ticksize, first[i], tpo[rows],
+            vol[rows]))
+    return histograms
+
+def session_numbers(times, sessions=None):
+    '''Return the index of first bar of each session and the session
+    number of each bar. The sessions are calendar days, unless
+    'sessions' array with the session key of each bar is passed.
+    '''
+    if sessions is None:
+        sessions = np.asarray(times, dtype='datetime64[ns]').astype(
+                'datetime64[D]')
+    sessions = np.asarray(sessions)
+
+    newsession = np.ones(len(sessions), dtype=bool)
+    newsession[1:] = sessions[1:] != sessions[:-1]
+    return np.flatnonzero(newsession), np.cumsum(newsession) - 1
+
+def build_session_profiles(times, open, high, low, close, volume=None,
+        ticksize=0.5, valuearea=0.7, mode=TPO, bins=BINS_CLOSE,
+        open_range_size=pd.to_timedelta(1, 'D'), sessions=None,
+        histograms=None):
+    '''Generate the Market Profile levels of every session of the bars
+    arrays and return them as a Data Frame with columns 'session',
+    'session_start', 'mode', 'bins', 'valuearea', 'open', 'val', 'vah',
+    'poc', 'or_low' and 'or_high'. The column 'session' is the session key and
+    'session_start' is the time of first bar of the session.
+    The parameter valuearea can be a list, then there is one row for
+    each session and value area.
+    The sessions are calendar days, unless 'sessions' array with the
+    session key of each bar is passed.
+    The histograms of the sessions are generated, unless the list
+    'histograms' (as returned by session_histograms) is passed.
+    '''
+    times = np.asarray(times, dtype='datetime64[ns]')
+    open = np.asarray(open, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    valueareas = np.atleast_1d(np.asarray(valuearea, dtype=np.float64))
+
+    if len(times) == 0:
+        return pd.DataFrame(columns=['session', 'session_start', 'mode',
+            'bins', 'valuearea',
+            'open', 'val', 'vah', 'poc', 'or_low', 'or_high'])
+    if sessions is None:
+        sessions = times.astype('datetime64[D]')
+    sessions = np.asarray(sessions)
+    starts, session = session_numbers(times, sessions)
+
+    # Open range
+    limit = times[starts] + pd.Timedelta(open_range_size).to_timedelta64()
+    inrange = times <= limit[session]
+    or_low = np.fmin.reduceat(np.where(inrange, low, np.nan), starts)
+    or_high = np.fmax.reduceat(np.where(inrange, high, np.nan), starts)
+
+    # Value Area and Point of Control
+    nvalueareas = len(valueareas)
+    val = np.full((len(starts), nvalueareas), np.nan)
+    vah = np.full((len(starts), nvalueareas), np.nan)
+    poc = np.full(len(starts), np.nan)
+    if histograms is None:
+        histograms = session_histograms(session, high, low, close, volume,
+                ticksize=ticksize, bins=bins)
+    for i, histogram in enumerate(histograms):
+        _poc, value_areas = histogram.value_areas(valueareas, mode)
+        if _poc is not None:
+            poc[i] = _poc
+            val[i], vah[i] = np.transpose(value_areas)
+
+    return pd.DataFrame({
+        'session': np.repeat(sessions[starts], nvalueareas),
+        'session_start': np.repeat(times[starts], nvalueareas),
+        'mode': mode,
+        'bins': bins,
+        'valuearea': np.tile(valueareas, len(starts)),
+        'open': np.repeat(open[starts], nvalueareas),
+        'val': val.ravel(),
+        'vah': vah.ravel(),
+        'poc': np.repeat(poc, nvalueareas),
+        'or_low': np.repeat(or_low, nvalueareas),
+        'or_high': np.repeat(or_high, nvalueareas),
+        })
+
+class ProfileLevels(object):
+    '''Market Profile levels of one session read from a table of
+    'build_session_profiles'. This object has the interface of
+    ProfileSlice used by the signals (value_area, poc_price and
+    open_range()), without the profile histogram.
+    '''
+
+    def __init__(self, val, vah, poc, or_low, or_high, valuearea=0.7):
+        self.valuearea = float(valuearea)
+        self.value_area = val, vah
+        self.poc_price = poc
+        self.profile = None
+        self._open_range = or_low, or_high
+
+    def open_range(self):
+        return self._open_range
+
+class ProfileAccumulator(object):
+    '''Market Profile of the developing session. The bars are added
+    one by one with 'update' and the developing levels can be read at
+    any moment, so the profile is already finished when the session ends.
+
+    Parameters:
+
+      - ticksize
+
+      Size of ticks (rows) in Market Profile
+
+      - bins (default: 'Close')
+
+      Price binning of bars ('Close' or 'Range')
+
+      - open_range_size (default: 1 day)
+
+      Time from first bar used for the open range
+
+      - initial_balance_delta (default: 1 hour)
+
+      Time from first bar used for the initial balance
+    '''
+
+    def __init__(self, ticksize, bins=BINS_CLOSE,
+            open_range_size=pd.to_timedelta(1, 'D'),
+            initial_balance_delta=pd.to_timedelta(1, 'h')):
+
+        self.ticksize = float(ticksize)
+        self.bins = bins
+        self.open_range_size = pd.Timedelta(open_range_size).to_pytimedelta()
+        self.initial_balance_delta = pd.Timedelta(
+                initial_balance_delta).to_pytimedelta()
+        self.reset()
+
+    def reset(self):
+        '''Start a new empty session.
+        '''
+        self.histogram = ProfileHistogram(self.ticksize)
+        self.start = None
+        self.end = None
+        self.open = None
+        self._open_range = [np.nan, np.nan]
+        self._initial_balance = [np.nan, np.nan]
+
+    def update(self, datetime, open, high, low, close, volume=0.):
+        '''Add a new bar to the developing session.
+        '''
+        self.update_time(datetime, open)
+
+        self.histogram.add_bar(high, low, close, volume, bins=self.bins)
+
+        if datetime <= self.start + self.open_range_size:
+            self._update_range(self._open_range, high, low)
+        if datetime <= self.start + self.initial_balance_delta:
+            self._update_range(self._initial_balance, high, low)
+
+    def update_time(self, datetime, open):
+        '''Update start, end and open of the session without adding the
+        bar to the profile. It's used when the profile of the session is
+        already known.
+        '''
+        if self.start is None:
+            self.start = datetime
+            self.open = open
+        self.end = datetime
+
+    def levels(self, valuearea=0.7, mode=TPO):
+        '''Return the developing VAL, VAH and POC.
+        '''
+        return self.histogram.levels(valuearea, mode)
+
+    def value_area(self, valuearea=0.7, mode=TPO):
+        '''Return the developing VAL and VAH.
+        '''
+        return self.levels(valuearea, mode)[:2]
+
+    def value_areas(self, valueareas, mode=TPO):
+        '''Return the developing VAL and VAH of each value area parameter.
+        '''
+        return self.histogram.value_areas(valueareas, mode)[1]
+
+    def open_range(self):
+        return tuple(self._open_range)
+
+    def initial_balance(self):
+        return tuple(self._initial_balance)
+
+    def profile_slice(self, valuearea=0.7, mode=TPO):
+        '''Return the ProfileSlice of the session.
+        '''
+        return ProfileSlice(self.histogram, valuearea=valuearea, mode=mode,
+                open_range=self.open_range(),
+                initial_balance=self.initial_balance())
+
+    def _update_range(self, _range, high, low):
+        if not low >= _range[0]:
+            _range[0] = low
+        if not high <= _range[1]:
+            _range[1] = high
+
+class CompositeProfile(object):
+    '''Composite Market Profile of the last sessions. The histogram of
+    the newest session is added and the histogram of the oldest session
+    is subtracted, so the update cost doesn't depend on the number of
+    sessions.
+
+    Parameters:
+
+      - ticksize
+
+      Size of ticks (rows) in Market Profile
+
+      - sessions (default: 20)
+
+      Number of sessions of the composite profile
+    '''
+
+    def __init__(self, ticksize, sessions=20):
+        self.ticksize = float(ticksize)
+        self.sessions = int(sessions)
+        self.histogram = ProfileHistogram(self.ticksize)
+        self._window = deque()
+
+    def push(self, session):
+        '''Add a finished session (ProfileAccumulator) to the composite
+        and remove the oldest session if the window is complete.
+        '''
+        self.histogram.add(session.histogram)
+        self._window.append(session)
+        if len(self._window) > self.sessions:
+            self.histogram.subtract(self._window.popleft().histogram)
+
+    def levels(self, valuearea=0.7, mode=TPO):
+        '''Return VAL, VAH and POC of the composite profile.
+        '''
+        return self.histogram.levels(valuearea, mode)
+
+    def open_range(self):
+        '''Return the lowest and highest open range of sessions.
+        '''
+        return self._range([s.open_range() for s in self._window])
+
+    def initial_balance(self):
+        return self._range([s.initial_balance() for s in self._window])
+
+    def profile_slice(self, valuearea=0.7, mode=TPO):
+        '''Return the ProfileSlice of the composite profile.
+        '''
+        return ProfileSlice(self.histogram, valuearea=valuearea, mode=mode,
+                open_range=self.open_range(),
+                initial_balance=self.initial_balance())
+
+    def _range(self, ranges):
+        if len(ranges) == 0:
+            return np.nan, np.nan
+        lows, highs = zip(*ranges)
+        return np.nanmin(lows), np.nanmax(highs)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+'''Rendering of charts in a background process. The strategies send the
+chart requests as plain arrays and continue, the PNG files are created
+by the worker process with matplotlib. If the queue is full the request
+is dropped, the strategy is never blocked by the charts. Render errors
+are printed and don't stop the worker or the strategy. Daemonic processes
+(workers of optimizations) can't start the worker process, then their
+requests are skipped.
+'''
+
+import os
+import atexit
+import queue
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+# Chart types
+PROFILE = 'profile'
+ORDERS = 'orders'
+
+# Default of the production switch of the services. If False the requests
+# are ignored and the worker process is not started
+RENDERING = True
+
+def chart_filename(directory, filename):
+    '''Return the path of the PNG file without spaces, colons and dots.
+    '''
+    filename = filename.replace(' ', '_').replace(':', '').replace('.', '')
+    return os.path.join(directory, filename + '.png')
+
+def render_profile(filename, prices, weights, val, vah, open_price,
+        ticksize):
+    '''Save the Market Profile chart with Value Area lines and open price.
+    '''
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.barh(prices, weights, height=ticksize * 0.9)
+    ax.axhline(y=val, color='yellow', linestyle='-')
+    ax.axhline(y=vah, color='blue', linestyle='-')
+    ax.plot(0, open_price, color='red', marker='o')
+    fig.savefig(filename)
+    plt.close(fig)
+
+def render_orders(filename, title, times, close, order_times, order_prices,
+        order_sides, stoplosses, takeprofits):
+    '''Save the chart of close prices with executed orders and stops.
+    '''
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.plot(times, close, linewidth=1)
+    ax.set_title(title)
+    ax.grid(True)
+    ax.set_ylabel('Close')
+    ax.set_xlabel('Time')
+
+    for i in range(len(order_times)):
+        if order_sides[i] == 'Long':
+            color, marker = 'blue', '^'
+        else:
+            color, marker = 'red', 'v'
+        ax.plot(order_times[i], order_prices[i], marker=marker, color=color)
+        ax.plot(order_times[i], stoplosses[i], '_', color=color)
+        ax.plot(order_times[i], takeprofits[i], '_', color=color)
+
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+
+RENDERERS = {
+        PROFILE: render_profile,
+        ORDERS: render_orders,
+        }
+
+def render(kind, args):
+    '''Render one request. The errors are printed, return False if the
+    chart is not saved.
+    '''
+    try:
+        RENDERERS[kind](**args)
+    except Exception as e:
+        print('[ Render Error ] %s %s: %s' % (kind, args.get('filename'), e))
+        return False
+    return True
+
+def _worker(requests):
+    '''Render the requests until None is received.
+    '''
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        render(*request)
+
+class RenderService(object):
+    '''Queue of chart requests rendered by a worker process.
+
+    Parameters:
+
+      - directory (default: '.')
+
+      Directory of the PNG files
+
+      - maxsize (default: 64)
+
+      Maximum number of requests waiting in the queue. New requests are
+      dropped (and counted in 'dropped') when the queue is full
+
+      - enabled (default: RENDERING)
+
+      Production switch. If False the requests are ignored
+    '''
+
+    def __init__(self, directory='.', maxsize=64, enabled=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.enabled = RENDERING if enabled is None else enabled
+        self.dropped = 0
+        self.skipped = 0
+        self._requests = None
+        self._process = None
+
+    def start(self):
+        '''Start the worker process. Called by the first request.
+        Daemonic processes (workers of optimizations) can't have children
+        and the charts would be rendered in the hot path, then the service
+        is disabled.
+        '''
+        if self._process is not None or not self.enabled:
+            return
+        if mp.current_process().daemon:
+            self.enabled = False
+            print('[ Render Disabled ] charts are not saved by %s' %
+                    mp.current_process().name)
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self._requests = mp.Queue(self.maxsize)
+        self._process = mp.Process(target=_worker,
+                args=(self._requests,), daemon=True)
+        self._process.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=60):
+        '''Render the requests in the queue and stop the worker process.
+        '''
+        if self._process is None:
+            return
+        try:
+            self._requests.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        self._requests = None
+
+    def submit(self, kind, filename, **arrays):
+        '''Send a chart request. Return False if the request is dropped
+        or skipped (service disabled).
+        '''
+        self.start()
+        if not self.enabled:
+            self.skipped += 1
+            return False
+
+        arrays['filename'] = chart_filename(self.directory, filename)
+        try:
+            self._requests.put_nowait((kind, arrays))
+        except queue.Full:
+            self.dropped += 1
+            print('[ Render Dropped ] %s %s (%d dropped)' % (kind,
+                arrays['filename'], self.dropped))
+            return False
+        return True
+
+    def profile(self, profile, value_area, open_price, ticksize, filename):
+        '''Send the Market Profile chart request. The profile is a pandas
+        Series of TPO count or volume by price.
+        '''
+        if profile is None or value_area is None:
+            return False
+        val, vah = value_area
+        return self.submit(PROFILE, filename,
+                prices=profile.index.to_numpy(dtype=np.float64),
+                weights=profile.to_numpy(dtype=np.float64),
+                val=float(val),
+                vah=float(vah),
+                open_price=float(open_price),
+                ticksize=float(ticksize))
+
+    def orders(self, data, orders, dataname, filename=None):
+        '''Send the chart request of close prices (Data Frame from
+        datautils.parsedata) and executed orders (OrderHandler objects).
+        '''
+        executed = [order for order in orders
+                if order._filled_price is not None]
+        times = pd.DatetimeIndex(data.index).values
+        if filename is None:
+            filename = 'orders_' + str(dataname)
+            if len(times) > 0:
+                filename += '_' + str(pd.Timestamp(times[0]))
+
+        return self.submit(ORDERS, filename,
+                title=str(dataname),
+                times=times,
+                close=data['Close'].to_numpy(dtype=np.float64),
+                order_times=np.array([order._filled_time
+                    for order in executed], dtype='datetime64[ns]'),
+                order_prices=np.array([order._filled_price
+                    for order in executed], dtype=np.float64),
+                order_sides=[order.side for order in executed],
+                stoplosses=np.array([order._stoploss
+                    for order in executed], dtype=np.float64),
+                takeprofits=np.array([order._takeprofit
+                    for order in executed], dtype=np.float64))
+
+# Services shared by the objects of the same process
+_services = dict()
+
+def getservice(directory='.', maxsize=64):
+    '''Return the rendering service of the directory. The worker process
+    is shared by all strategies of the process.
+    '''
+    if directory not in _services:
+        _services[directory] = RenderService(directory, maxsize)
+    return _services[directory]
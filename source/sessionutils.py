@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+'''Session calendar. The sessions and trading windows of a dataset are
+computed once with arrays, then the strategies and the order management
+read the flags of each bar by index instead of comparing dates and times
+at every bar.
+'''
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# Flags of bars
+NEW_SESSION = 1
+MAY_OPEN = 2
+MUST_FLATTEN = 4
+
+DAY_NS = 24 * 60 * 60 * 10**9
+EPOCH = dt.datetime(1970, 1, 1)
+
+# Session rollover and timezone of markets
+SESSION_CALENDARS = {
+        # Calendar days of the bars time
+        'day': {'rollover':dt.time(0, 0), 'timezone':None},
+        # FX rollover at 17:00 New York
+        'fx': {'rollover':dt.time(17, 0), 'timezone':'America/New_York'},
+        # CME Globex futures
+        'cme': {'rollover':dt.time(17, 0), 'timezone':'America/Chicago'},
+        # US stocks
+        'us_stocks': {'rollover':dt.time(0, 0), 'timezone':'America/New_York'},
+        }
+
+def time_ns(value):
+    '''Convert a time of day (datetime.time) to nanoseconds.
+    '''
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 10**9 \
+            + value.microsecond * 1000
+
+class SessionIndex(object):
+    '''Sessions and flags of each bar of a dataset, created with
+    SessionCalendar.index. All lookups by bar index are O(1).
+
+    Attributes:
+
+      - times: datetime64[ns] of bars
+
+      - keys: datetime64[D] key of the session of each bar (day of rollover)
+
+      - session: session number of each bar
+
+      - starts, ends: index of first bar and index after last bar of
+        each session
+
+      - flags: NEW_SESSION, MAY_OPEN and MUST_FLATTEN bits of each bar
+    '''
+
+    def __init__(self, times, keys, flags):
+        self.times = times
+        self.keys = keys
+        self.flags = flags
+        self.session = np.cumsum(flags & NEW_SESSION) - 1
+        self.starts = np.flatnonzero(flags & NEW_SESSION)
+        self.ends = np.append(self.starts[1:], len(times))
+
+    def __len__(self):
+        return len(self.times)
+
+    def bounds(self, i):
+        '''Return the index of first bar and the index after the last bar
+        of the session of bar i.
+        '''
+        session = self.session[i]
+        return self.starts[session], self.ends[session]
+
+    def session_start(self, i):
+        '''Return the time of first bar of the session of bar i.
+        '''
+        return self.times[self.starts[self.session[i]]]
+
+    def new_session(self, i):
+        return bool(self.flags[i] & NEW_SESSION)
+
+    def may_open(self, i):
+        return bool(self.flags[i] & MAY_OPEN)
+
+    def must_flatten(self, i):
+        return bool(self.flags[i] & MUST_FLATTEN)
+
+class SessionCalendar(object):
+    '''Session boundaries and trading windows of a market.
+    The trading window times are in the session timezone and are
+    counted from the rollover, then windows after midnight are allowed.
+
+    Parameters:
+
+      - rollover (default: dt.time(0, 0))
+
+      Time of day when a new session starts
+
+      - timezone (default: None)
+
+      Timezone of rollover and trading windows. If None the times of
+      bars are used without conversion
+
+      - datatimezone (default: 'UTC')
+
+      Timezone of the (naive) times of bars. Used only with timezone
+
+      - starttime (default: None)
+
+      Time of day when orders are allowed
+
+      - finaltime (default: None)
+
+      Time of day when orders are not allowed
+
+      - closetime (default: None)
+
+      Time of day to close the orders
+    '''
+
+    def __init__(self, rollover=dt.time(0, 0), timezone=None,
+            datatimezone='UTC', starttime=None, finaltime=None,
+            closetime=None):
+        self.rollover = rollover
+        self.timezone = timezone
+        self.datatimezone = datatimezone
+        self.starttime = starttime
+        self.finaltime = finaltime
+        self.closetime = closetime
+
+    @classmethod
+    def from_name(cls, name, **kwargs):
+        '''Create the calendar of a market in SESSION_CALENDARS.
+        '''
+        if name not in SESSION_CALENDARS:
+            raise ValueError('Unrecognized session calendar: %s' % name)
+        params = dict(SESSION_CALENDARS[name])
+        params.update(kwargs)
+        return cls(**params)
+
+    def index(self, times):
+        '''Return the SessionIndex of the (sorted) times of bars.
+        '''
+        times = np.asarray(times, dtype='datetime64[ns]')
+        keys, elapsed = self._locate(times)
+
+        flags = np.zeros(len(times), dtype=np.uint8)
+        if len(times) > 0:
+            newsession = np.ones(len(times), dtype=bool)
+            newsession[1:] = keys[1:] != keys[:-1]
+            flags[newsession] |= NEW_SESSION
+
+        start = self._offset(self.starttime, 0)
+        final = self._offset(self.finaltime, DAY_NS)
+        flags[(elapsed >= start) & (elapsed < final)] |= MAY_OPEN
+        if self.closetime is not None:
+            flags[elapsed >= self._offset(self.closetime, 0)] |= MUST_FLATTEN
+
+        return SessionIndex(times, keys, flags)
+
+    def flags(self, datetime, previous=None):
+        '''Return the flags of one bar. The previous bar time is used for
+        the NEW_SESSION flag. Used when the bars are not known in advance
+        (live data or data not preloaded).
+        '''
+        key, elapsed = self._locate_one(datetime)
+        return self._flags(elapsed, previous is None or
+                self._locate_one(previous)[0] != key)
+
+    def clock(self):
+        '''Return a SessionClock of the calendar, the flags of bars
+        received one by one without timezone conversion at every bar.
+        '''
+        return SessionClock(self)
+
+    def key(self, datetime):
+        '''Return the session key (datetime64[D], day of rollover) of one
+        time. The keys are the same of SessionIndex.keys.
+        '''
+        return np.datetime64(int(self._locate_one(datetime)[0]), 'D')
+
+    def _locate(self, times):
+        '''Internal function returning the session key of each time and
+        the time elapsed from the rollover.
+        '''
+        ns = times.astype(np.int64)
+        if self.timezone is not None:
+            ns = pd.DatetimeIndex(times).tz_localize(self.datatimezone
+                    ).tz_convert(self.timezone).tz_localize(None).asi8
+
+        shifted = ns - time_ns(self.rollover)
+        days = shifted // DAY_NS
+        return days.astype('datetime64[D]'), shifted - days * DAY_NS
+
+    def _locate_one(self, datetime):
+        '''Internal function returning the session key (days since
+        1970-01-01) and the time elapsed from the rollover of one time.
+        '''
+        if self.timezone is not None:
+            datetime = pd.Timestamp(datetime).tz_localize(self.datatimezone
+                    ).tz_convert(self.timezone).tz_localize(None)
+
+        delta = datetime - EPOCH
+        shifted = (delta.days * 86400 + delta.seconds) * 10**9 + \
+                delta.microseconds * 1000 - time_ns(self.rollover)
+        return divmod(shifted, DAY_NS)
+
+    def _flags(self, elapsed, newsession):
+        '''Internal function returning the flags of the time elapsed from
+        the rollover.
+        '''
+        flags = NEW_SESSION if newsession else 0
+        if self._offset(self.starttime, 0) <= elapsed < \
+                self._offset(self.finaltime, DAY_NS):
+            flags |= MAY_OPEN
+        if self.closetime is not None and \
+                elapsed >= self._offset(self.closetime, 0):
+            flags |= MUST_FLATTEN
+        return flags
+
+    def _utcoffset(self, ns):
+        '''Internal function returning the nanoseconds from the time of
+        bars (nanoseconds since 1970-01-01) to the time of the calendar
+        timezone.
+        '''
+        if self.timezone is None:
+            return 0
+        return pd.Timestamp(ns).tz_localize(self.datatimezone).tz_convert(
+                self.timezone).tz_localize(None).value - ns
+
+    def _offset(self, value, default):
+        '''Internal function converting a time of day to the time elapsed
+        from the rollover.
+        '''
+        if value is None:
+            return default
+        return (time_ns(value) - time_ns(self.rollover)) % DAY_NS
+
+class SessionClock(object):
+    '''Flags of bars received one by one (live data or data not
+    preloaded), same values of SessionCalendar.flags with the previous bar.
+    The offset of the calendar timezone is computed once a day and reused
+    while it doesn't change, then the flags of the other bars are integer
+    operations. The days with a change of offset (daylight saving time)
+    are converted bar by bar.
+
+    Parameters:
+
+      - calendar
+
+      SessionCalendar of the bars
+    '''
+
+    def __init__(self, calendar):
+        self.calendar = calendar
+        # Offset of the timezone valid for the times of [begin, end)
+        self._begin = None
+        self._end = None
+        self._utcoffset = None
+        # Last bar (time, session key and flags)
+        self._last = None
+        self._key = None
+        self._last_flags = None
+
+    @property
+    def started(self):
+        '''True after the flags of the first bar.
+        '''
+        return self._last is not None
+
+    def flags(self, datetime, previous=None):
+        '''Return the flags of the bar. A new session starts when the
+        session key differs from the key of previous bar, the time of
+        previous bar is used only before the first bar of the clock. The
+        flags of the same bar are returned again if it's passed twice.
+        '''
+        if self._last is None and previous is not None:
+            self._key = self.calendar._locate_one(previous)[0]
+
+        delta = datetime - EPOCH
+        ns = (delta.days * 86400 + delta.seconds) * 10**9 + \
+                delta.microseconds * 1000
+        if ns == self._last:
+            return self._last_flags
+
+        if self._begin is None or not self._begin <= ns < self._end:
+            self._begin, self._end = ns, ns + DAY_NS
+            self._utcoffset = self.calendar._utcoffset(ns)
+            if self._utcoffset != self.calendar._utcoffset(self._end):
+                self._utcoffset = None
+
+        if self._utcoffset is None:
+            key, elapsed = self.calendar._locate_one(datetime)
+        else:
+            key, elapsed = divmod(ns + self._utcoffset -
+                    time_ns(self.calendar.rollover), DAY_NS)
+
+        flags = self.calendar._flags(elapsed, key != self._key)
+        self._last, self._key, self._last_flags = ns, key, flags
+        return flags
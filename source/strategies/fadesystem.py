@@ -9,10 +9,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 from tabulate import tabulate
-from market_profile import MarketProfile
 
 from orderutils import *
 from datautils import *
+import sessionutils as su
+import renderservice as rs
+import profilestore as ps
 from strategies.fadesystemsignals import *
 
 from strategies.exceptions import DirectionNotFound, TradeModeNotFound, OrderNotExecuted
@@ -42,6 +44,40 @@ class FadeSystemIB(bt.Strategy):
         - mp_ticksize (default: 0.0002)
         The size of ticks in Market Profile
 
+        - mp_developing (default: False)
+        Use the Value Area of the developing session for signals
+
+        - mp_mode (default: 'tpo')
+        Market Profile mode ('tpo' or 'vol')
+
+        - mp_bins (default: 'Close')
+        Price binning of bars in Market Profile ('Close' for close
+        price or 'Range' for all ticks between low and high)
+
+        - mp_sessions (default: 1)
+        Number of previous sessions in the Market Profile. With more
+        than one session the composite profile of the sessions is used
+
+        - mp_store (default: None)
+        Directory of the Market Profile store (profilestore). The
+        profiles of sessions are saved and read by other runs with the
+        same session bars, like optimizations and restarts. If None the
+        profiles are not stored
+
+        - session_calendar (default: 'day')
+        Session calendar in sessionutils.SESSION_CALENDARS ('day' for
+        calendar days, 'fx' for 17:00 New York rollover). The time
+        parameters are in the calendar timezone
+
+        - savefigures (default: SAVEFIGURES)
+        Save the charts of the session profiles and orders at every
+        session with the rendering service. The charts are not saved by
+        the workers of optimizations
+
+        - intrabar (default: False)
+        Compare the stops of orders with the high and the low of bars
+        instead of the close in backtesting
+
         - stoploss
         Stop Loss value in percentage of price
 
@@ -82,12 +118,20 @@ class FadeSystemIB(bt.Strategy):
             # Market Profile Parameters
             'mp_valuearea':0.7, # Market Profile Value Area
             'mp_ticksize':0.0002, # Market Profile Tick Size
+            'mp_developing':False, # Trade against developing Value Area
+            'mp_mode':'tpo', # Market Profile mode ('tpo' or 'vol')
+            'mp_bins':'Close', # Price binning ('Close' or 'Range')
+            'mp_sessions':1, # Number of sessions of composite profile
+            'mp_store':None, # Directory of Market Profile store
             # Time Parameters
             'starttime':dt.time(0,0,0),
             'orderfinaltime':dt.time(15,0,0),
             'timetocloseorders':dt.time(16,0,0),
             'timebetweenorders':60 * 5,
             'positiontimedecay':60 * 60 * 2, # Time in seconds to force a stop
+            'session_calendar':'day', # Sessions rollover and timezone
+            'savefigures':SAVEFIGURES, # Save the charts of profiles and orders
+            'intrabar':False, # Stops reached by high and low of bars
 
             }
 
@@ -105,6 +149,24 @@ class FadeSystemIB(bt.Strategy):
         self.order_management.set_orders_final_time(self.params.orderfinaltime)
         self.order_management.set_orders_close_time(self.params.timetocloseorders)
         self.order_management.set_time_between_orders(self.params.timebetweenorders) 
+        self.order_management.set_intrabar(self.params.intrabar)
+
+        # Charts are saved by a background process
+        self.renderer = rs.getservice()
+
+        # Market Profiles shared by runs with the same data
+        self.profile_store = None
+        if self.params.mp_store is not None:
+            self.profile_store = ps.getstore(self.params.mp_store)
+
+        # Sessions and trading windows
+        self.calendar = su.SessionCalendar.from_name(
+                self.params.session_calendar,
+                starttime=self.params.starttime,
+                finaltime=self.params.orderfinaltime,
+                closetime=self.params.timetocloseorders)
+        self._sessions = None
+        self._clock = self.calendar.clock()
 
         # Trade Signals
         self.signals_handler = TradeSignalsHandler(
@@ -112,7 +174,15 @@ class FadeSystemIB(bt.Strategy):
                 valuearea = self.params.mp_valuearea,
                 ticksize= self.params.mp_ticksize,
                 std_threshold=self.params.std_threshold,
-                min_pricechange=self.params.minimumchangeprice)
+                min_pricechange=self.params.minimumchangeprice,
+                mp_mode=self.params.mp_mode,
+                bins=self.params.mp_bins,
+                developing_va=self.params.mp_developing,
+                composite_sessions=self.params.mp_sessions,
+                renderer=self.renderer,
+                profile_store=self.profile_store,
+                profile_table=PROFILE_TABLES.get(self.datas[0]._name),
+                calendar=self.calendar)
 
         self.lot_config = LOTS_CONFIGURATION[self.params.lotconfig]
 
@@ -124,8 +194,22 @@ class FadeSystemIB(bt.Strategy):
         # Date/Time vars
         self._lastday = None
         self._newday = False
+        self._session_begin = None
 
     def start(self):
+        # Broker state of live trading (nothing in backtesting)
+        self.order_management.start()
+
+        # Sessions of preloaded data are computed once
+        if len(self.datas[0].datetime.array) > 0:
+            self._sessions = self.calendar.index(
+                    num2datetime64(self.datas[0].datetime.array))
+
+        # Profiles are stored by the fingerprint of the session bars
+        if self.profile_store is not None:
+            self.signals_handler.session_fingerprints = \
+                    self.session_fingerprints(self.datas[0])
+
         df = pd.DataFrame({
             'Initial Cash':self.broker.getcash(),
             'MA Period':self.params.ma_period,
@@ -143,56 +227,75 @@ class FadeSystemIB(bt.Strategy):
         print('[ Strategy Started ] \n'+
                 tabulate(df, headers='keys', tablefmt='psql', showindex=False))
 
+    def session_fingerprints(self, data):
+        '''Return the fingerprints of the sessions of the data by time of
+        first bar, or None if the bars are not known in advance (live data).
+        The bars of array feeds are known without preload.
+        '''
+        if len(data.datetime.array) > 0:
+            times = num2datetime64(data.datetime.array)
+            values = [data.open.array, data.high.array, data.low.array,
+                    data.close.array, data.volume.array]
+        elif getattr(data, 'bars', None) is not None:
+            times = data.bars.time
+            values = [data.bars.open, data.bars.high, data.bars.low,
+                    data.bars.close, data.bars.volume]
+        else:
+            return None
+        starts, fingerprints = ps.session_fingerprints(times, *values,
+                sessions=self.calendar.index(times).keys)
+        return dict(zip(pd.DatetimeIndex(starts), fingerprints))
+
     def next(self):
+        flags = self.session_flags()
         if self._lastday == None:
             self._lastday = self.datas[0].datetime.date(0)
             self._last_cron_time = self.datas[0].datetime.time(0)
+        elif flags & su.NEW_SESSION:
+            # Every session those vars must be changed
+            self._newday = True
 
         now = self.datas[0].datetime.time(0)
         today = self.datas[0].datetime.date(0)
         _datetime = self.datas[0].datetime.datetime(0)
 
         self.cron_report(now)
-        self.order_management.next(_datetime)
+        self.order_management.next(_datetime, flags)
         _std = self.stddev[0]
         _open = self.datas[0].open[0]
         _high = self.datas[0].high[0]
         _low = self.datas[0].low[0]
         _close = self.datas[0].close[0]
+        _volume = self.datas[0].volume[0]
 
 
         self.signals_handler.next(_datetime, _std, _open, _high,
-                _low, _close)
+                _low, _close, _volume, new_session=self._newday)
 
-        if today > self._lastday:
-            # Every day those vars must be changed
-            self._newday = True
+        if self._newday:
+            self._newday = False
 
             self.order_management.reset()
             self.signals_handler.reset()
 
-        if self._newday:
-            self._newday = False
+            if self.params.savefigures:
+                # Get session before data
+                data = parsedata(
+                            data=self.datas[0],
+                            from_date=self._session_begin, 
+                            to_date=_datetime)
+
+                # Plot data and orders
+                self.renderer.orders(data, self.order_management.daily_orders,
+                        dataname=self.datas[0]._name)
 
-            # Get Timestamp 
-            lastday_begin = dt.datetime.timestamp(
-                    pd.Timestamp(self._lastday))
-            lastday_end = dt.datetime.timestamp(
-                    pd.Timestamp(self._lastday)+dt.timedelta(days=1))
-
-            # Get day before data
-            data = parsedata(
-                        data=self.datas[0],
-                        from_date=lastday_begin, 
-                        to_date=lastday_end)
-
-            # Plot data and orders
-            plot_orders(data, self.order_management.daily_orders, dataname=data)
-            self.signals_handler.generate_mp(data)
+            # Market Profile of day before is accumulated bar by bar
+            self.signals_handler.finish_mp(save_fig=self.params.savefigures)
             self.signals_handler.set_signal_mode()
             self.signals_handler.print_status()
 
             self._lastday = today
+            self._session_begin = _datetime
 
         if self.order_management.check_time_close_orders():
             self.order_management.close_all_positions()
@@ -221,6 +324,22 @@ class FadeSystemIB(bt.Strategy):
             # Open Order
             self.open_order(self.datas[0]._name, signal, lots)
 
+    def session_flags(self):
+        '''Return the session calendar flags of current bar. The flags of
+        preloaded data are read from the session index, otherwise (live
+        data) they are computed bar by bar with the session clock.
+        '''
+        i = len(self.datas[0]) - 1
+        if self._sessions is not None and i < len(self._sessions):
+            return self._sessions.flags[i]
+
+        # Previous bar of preloaded data before the live bars
+        previous = None
+        if not self._clock.started and len(self.datas[0]) > 1:
+            previous = self.datas[0].datetime.datetime(-1)
+        return self._clock.flags(self.datas[0].datetime.datetime(0),
+                previous)
+
     def open_order(self, dataname, signal, lots):
         '''Open order based on signal parameter and lots
         '''
@@ -270,7 +389,8 @@ class FadeSystemIB(bt.Strategy):
         if order.status == order.Completed:
             self.log('Order [%d] Completed' % order.tradeid)
 
-            self.order_management.set_executed(order.tradeid, self.datas[0].close[0], self.datas[0].datetime.datetime(0))
+            self.order_management.set_executed(order.tradeid, self.datas[0].datetime.datetime(0), order.executed.price)
+            self.order_management.notify_fill(order)
             self.order_management.update_orders()
 
             df = pd.DataFrame({
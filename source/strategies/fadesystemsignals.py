@@ -2,6 +2,9 @@
 
 from orderutils import *
 import datautils as du
+import profileutils as pu
+import profilestore as ps
+import numpy as np
 from strategies.optparams import *
 import datetime as dt
 
@@ -36,9 +39,41 @@ class TradeSignalsHandler(object):
 
        Minimum time in seconds for sending another signal
 
+       - mp_mode (default: 'tpo')
+
+       Market Profile mode ('tpo' or 'vol'). The volume mode uses TPO count for bars without volume
+
+       - bins (default: 'Close')
+
+       Price binning of bars in Market Profile ('Close' or 'Range')
+
+       - developing_va (default: False)
+
+       Use the Value Area of the developing session (current day) for signals instead of the Value Area of previous session
+
+       - profile_store (default: None)
+
+       ProfileStore object of session profiles. The profile of a stored session is read from the store and the bars are not accumulated. The store is used only for the sessions in 'session_fingerprints', the fingerprints of the session bars by time of first bar (profilestore.session_fingerprints). Sessions found in the profile table are not stored
+
+       - profile_table (default: None)
+
+       Table of session Market Profiles (datautils.generatesessionprofiles). If the table has the value area parameter, 'finish_mp' reads the levels from the table and the bars are not accumulated. The sessions are found by the session key of the calendar, then the table must be generated with the same calendar. Sessions missing in the table are accumulated bar by bar
+
+       - calendar (default: None)
+
+       SessionCalendar of the sessions. If None the sessions are calendar days
+
+       - composite_sessions (default: 1)
+
+       Number of previous sessions of the Market Profile. With more than one session 'finish_mp' uses the composite profile of the last sessions and the profile table is not used
+
+       - renderer (default: None)
+
+       RenderService for saving Market Profile charts in background. If None the charts are saved synchronously
+
     '''
 
-    def __init__(self, dataname, std_threshold, min_pricechange, ticksize, valuearea=0.7, signals_interval = 60*5):
+    def __init__(self, dataname, std_threshold, min_pricechange, ticksize, valuearea=0.7, signals_interval = 60*5, mp_mode=pu.TPO, bins=pu.BINS_CLOSE, developing_va=False, profile_store=None, profile_table=None, composite_sessions=1, renderer=None, calendar=None):
         
         self.dataname = str(dataname)
 
@@ -52,10 +87,46 @@ class TradeSignalsHandler(object):
     
         self.signals_time_interval = signals_interval
 
+        self.mp_mode = mp_mode
+
+        self.bins = bins
+
+        self.developing_va = developing_va
+
+        self.profile_store = profile_store
+        self.session_fingerprints = None
+
+        self.renderer = renderer
+
+        self.calendar = calendar
+
+        # Composite profile of the last sessions
+        self.composite_profile = None
+        if composite_sessions > 1:
+            self.composite_profile = pu.CompositeProfile(self.ticksize,
+                    composite_sessions)
+            profile_table = None
+
+        # Levels of precomputed session profiles by session key
+        self._profile_levels = self._read_profile_table(profile_table)
+        self._session_levels = None
+        self._finished_levels = None
+
         # Market Profile
         self.market_profile = None
         self.profile_slice = None
 
+        # Market Profile of current and previous sessions updated by 'next'
+        self.developing_profile = pu.ProfileAccumulator(self.ticksize,
+                self.bins)
+        self._finished_profile = None
+        self._finished_date = None
+        self._session_date = None
+
+        # Stored profiles of current and previous sessions
+        self._stored_slice = None
+        self._finished_slice = None
+
         # Trade mode
         self._mode_for_long = NONE
         self._mode_for_short = NONE
@@ -73,8 +144,11 @@ class TradeSignalsHandler(object):
     
         self._last_signal_time = None
 
-    def next(self, datetime, std_value, open, high, low, close):
-        '''This function should be called every time new data
+    def next(self, datetime, std_value, open, high, low, close, volume=0.,
+            new_session=None):
+        '''This function should be called every time new data.
+        The new_session flag comes from the session calendar, if None a
+        new session starts when the day changes.
         '''
         self.now = datetime
         self.std = std_value
@@ -83,6 +157,37 @@ class TradeSignalsHandler(object):
         self.low = low
         self.close = close
 
+        self.update_profile(datetime, open, high, low, close, volume,
+                new_session)
+
+    def update_profile(self, datetime, open, high, low, close, volume=0.,
+            new_session=None):
+        '''Add the bar to the developing Market Profile. When a new session
+        starts, the developing profile is finished and kept for 'finish_mp'.
+        '''
+        if new_session is None:
+            new_session = datetime.date() != self._session_date
+        if new_session or self._session_date is None:
+            if self._session_date is not None:
+                self._finish_session()
+                self.developing_profile = pu.ProfileAccumulator(
+                        self.ticksize, self.bins)
+            # Sessions are named by the date of first bar
+            self._session_date = datetime.date()
+            self._session_levels = self._get_levels(datetime)
+            self._stored_slice = None
+            if self._session_levels is None:
+                self._stored_slice = self._get_stored(datetime)
+
+        # Levels of precomputed or stored profiles don't need the bars
+        if not self.developing_va and (self._session_levels is not None or
+                self._stored_slice is not None):
+            self.developing_profile.update_time(datetime, open)
+            return
+
+        self.developing_profile.update(datetime, open, high, low, close,
+                volume)
+
     def check_last_mp_time(self):
         '''Check if Market Profile was generated in the last day
         '''
@@ -150,17 +255,159 @@ class TradeSignalsHandler(object):
             return False
         return True
 
-    def generate_mp(self, data):
+    def generate_mp(self, data, save_fig=True):
         '''Generate Market Profile. The signal handler need this function 
         to be called every beginning of cycle. This function is not 
         called internally.
         '''
-        self._mp_gen_time = data['datetime'][0]
+        self._mp_gen_time = data['datetime'].iloc[0]
+
+        if self.profile_store is not None:
+            key = self.profile_store.key(self.dataname, self._mp_gen_time,
+                    self.ticksize, self.mp_mode, self.bins,
+                    ps.data_fingerprint(data))
+            profile_slice = self.profile_store.get(key, self.valuearea)
+            if profile_slice is not None:
+                self.profile_slice = profile_slice
+                self.market_profile = profile_slice.profile
+                return
+
         self.market_profile, self.profile_slice = du.generateprofiles(
                 data, 
                 ticksize=self.ticksize,
                 valuearea=self.valuearea,
-                save_fig=True)
+                mp_mode=self.mp_mode,
+                bins=self.bins,
+                save_fig=save_fig,
+                renderer=self.renderer)
+
+        if self.profile_store is not None:
+            self.profile_store.put(key, self.profile_slice)
+
+    def finish_mp(self, save_fig=False):
+        '''Use the profile of previous session, accumulated bar by bar,
+        as Market Profile. This function replaces 'generate_mp' without
+        parsing the data again and is not called internally.
+        If a profile table is used, the levels are read from the table
+        (sessions missing in the table use the accumulated profile).
+        If composite sessions are used, the composite profile of the last
+        sessions is used.
+        '''
+        if self._finished_levels is not None:
+            self._mp_gen_time, self.profile_slice = self._finished_levels
+            self.market_profile = None
+            return
+
+        if self._finished_profile is None:
+            return
+
+        session = self._finished_profile
+        self._mp_gen_time = session.start
+        if self.composite_profile is not None:
+            self.profile_slice = self.composite_profile.profile_slice(
+                    self.valuearea, self.mp_mode)
+        elif self._finished_slice is not None:
+            self.profile_slice = self._finished_slice
+        else:
+            self.profile_slice = session.profile_slice(self.valuearea,
+                    self.mp_mode)
+        self.market_profile = self.profile_slice.profile
+
+        if save_fig:
+            filename = self.dataname+'_'+self.mp_mode+'_'+str(session.end)+'_'+\
+                    str(session.start)
+            if self.renderer is not None:
+                self.renderer.profile(self.market_profile,
+                        self.profile_slice.value_area, session.open,
+                        self.ticksize, filename)
+            else:
+                du.plot_profile(self.market_profile,
+                        self.profile_slice.value_area, session.open,
+                        filename)
+
+    def _finish_session(self):
+        '''Internal function for keeping the developing session as the
+        finished session. The profile of the session is stored if it
+        isn't in the store yet.
+        '''
+        self._finished_profile = self.developing_profile
+        self._finished_date = self._session_date
+        self._finished_levels = self._session_levels
+        self._finished_slice = self._stored_slice
+
+        key = self._store_key(self._finished_profile.start)
+        if self._finished_slice is None and self._finished_levels is None \
+                and key is not None:
+            self._finished_slice = self._finished_profile.profile_slice(
+                    self.valuearea, self.mp_mode)
+            self.profile_store.put(key, self._finished_slice)
+
+        if self.composite_profile is not None:
+            # Stored profiles have the histogram and ranges of the session
+            self.composite_profile.push(self._finished_slice
+                    if self._finished_slice is not None
+                    else self._finished_profile)
+
+    def _store_key(self, session_start):
+        '''Internal function returning the store key of the session or
+        None if the store is not used or the session bars are not known.
+        '''
+        if self.profile_store is None or self.session_fingerprints is None:
+            return None
+        fingerprint = self.session_fingerprints.get(
+                pd.Timestamp(session_start))
+        if fingerprint is None:
+            return None
+        return self.profile_store.key(self.dataname, session_start,
+                self.ticksize, self.mp_mode, self.bins, fingerprint)
+
+    def _get_stored(self, session_start):
+        '''Internal function returning the stored profile of the session
+        starting at session_start or None.
+        '''
+        key = self._store_key(session_start)
+        if key is None:
+            return None
+        return self.profile_store.get(key, self.valuearea)
+
+    def session_key(self, datetime):
+        '''Return the session key of the bar time, the key of the
+        calendar or the day if there is no calendar.
+        '''
+        if self.calendar is not None:
+            return pd.Timestamp(self.calendar.key(datetime))
+        return pd.Timestamp(datetime.date())
+
+    def _get_levels(self, session_start):
+        '''Internal function returning the levels of the profile table
+        of the session starting at session_start or None.
+        '''
+        if self._profile_levels is None:
+            return None
+        return self._profile_levels.get(self.session_key(session_start))
+
+    def _read_profile_table(self, table):
+        '''Internal function for reading the levels of the value area
+        parameter from a table of session profiles by session key.
+        Return None if table is None or don't have the value area, mode
+        and bins of the handler.
+        '''
+        if table is None:
+            return None
+
+        table = table[np.isclose(table['valuearea'], self.valuearea) &
+                (table['mode'] == self.mp_mode) &
+                (table['bins'] == self.bins)]
+        if len(table.index) == 0:
+            return None
+
+        levels = dict()
+        for row in table.itertuples():
+            levels[pd.Timestamp(row.session)] = (
+                    row.session_start,
+                    pu.ProfileLevels(row.val, row.vah, row.poc,
+                        row.or_low, row.or_high, row.valuearea))
+        return levels
 
     def set_signal_mode(self):
         '''
@@ -168,6 +415,8 @@ class TradeSignalsHandler(object):
         This function is called after Market Profile is
         generated. 
         '''
+        if self.profile_slice is None:
+            return
         val, vah = self.profile_slice.value_area
 
         if self.open >= vah:
@@ -229,6 +478,9 @@ class TradeSignalsHandler(object):
 
         # Market Profile Value Area
         val, vah = self.profile_slice.value_area
+        if self.developing_va:
+            val, vah = self.developing_profile.value_area(self.valuearea,
+                    self.mp_mode)
 
         # Long signal
         if self._mode_for_long == BELOW_VAL:
@@ -256,6 +508,8 @@ class TradeSignalsHandler(object):
     def print_status(self):
         '''Print status of this signal handler.
         '''
+        if self.profile_slice is None:
+            return
         val, vah = self.profile_slice.value_area
         min_range, max_range = self.profile_slice.open_range()
         
@@ -9,10 +9,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 from tabulate import tabulate
-from market_profile import MarketProfile
 
 from datautils import *
 from orderutils import *
+import sessionutils as su
+import renderservice as rs
+import profilestore as ps
 from strategies.fadesystemsignals import *
 from strategies.optparams import *
 
@@ -45,11 +47,47 @@ class FadeSystemIB(bt.Strategy):
         - mp_ticksize (default: 0.0002)
         The size of ticks in Market Profile
 
+        - mp_developing (default: False)
+        Use the Value Area of the developing session for signals
+
+        - mp_mode (default: 'tpo')
+        Market Profile mode ('tpo' or 'vol')
+
+        - mp_bins (default: 'Close')
+        Price binning of bars in Market Profile ('Close' for close
+        price or 'Range' for all ticks between low and high)
+
+        - mp_sessions (default: 1)
+        Number of previous sessions in the Market Profile. With more
+        than one session the composite profile of the sessions is used
+
+        - mp_store (default: None)
+        Directory of the Market Profile store (profilestore). The
+        profiles of sessions are saved and read by other runs with the
+        same session bars, like optimizations and restarts. If None the
+        profiles are not stored
+
+        - session_calendar (default: 'day')
+        Session calendar in sessionutils.SESSION_CALENDARS ('day' for
+        calendar days, 'fx' for 17:00 New York rollover). The time
+        parameters are in the calendar timezone
+
+        - savefigures (default: SAVEFIGURES)
+        Save the charts of the session profiles and orders at every
+        session with the rendering service. The charts are not saved by
+        the workers of optimizations
+
+        - intrabar (default: False)
+        Compare the stops of orders with the high and the low of bars
+        instead of the close in backtesting
+
         - stoploss
-        Stop Loss value in percentage of price
+        Index of STOP_LOSS_CONFIGURATION, the loss of the position of
+        each data name to close it
 
         - takeprofit
-        Take Profit value in percentage of executed price
+        Index of TAKE_PROFIT_CONFIGURATION, the profit of the position of
+        each data name to close it
 
         - starttime (default: dt.time(0, 0, 0)
         The time of day the strategy can start trade
@@ -84,12 +122,20 @@ class FadeSystemIB(bt.Strategy):
             'atr_period':14,
             # Market Profile Parameter
             'mp_valuearea':0.7,
+            'mp_developing':False,
+            'mp_mode':'tpo',
+            'mp_bins':'Close',
+            'mp_sessions':1,
+            'mp_store':None,
             # Time Parameters
             'starttime':dt.time(0,0,0),
             'orderfinaltime':dt.time(15,0,0),
             'timetocloseorders':dt.time(16,0,0),
             'timebetweenorders':60 * 5,
             'positiontimedecay':60*60*2, # Time in seconds to force a stop
+            'session_calendar':'day',
+            'savefigures':SAVEFIGURES,
+            'intrabar':False,
             }
 
     def __init__(self, **kwargs):
@@ -107,6 +153,28 @@ class FadeSystemIB(bt.Strategy):
         self.order_management.set_orders_final_time(self.params.orderfinaltime)
         self.order_management.set_orders_close_time(self.params.timetocloseorders)
         self.order_management.set_time_between_orders(self.params.timebetweenorders)
+        self.order_management.set_intrabar(self.params.intrabar)
+        self.order_management.set_takeprofit(
+                TAKE_PROFIT_CONFIGURATION[self.params.takeprofit])
+        self.order_management.set_stoploss(
+                STOP_LOSS_CONFIGURATION[self.params.stoploss])
+
+        # Charts are saved by a background process
+        self.renderer = rs.getservice()
+
+        # Market Profiles shared by runs with the same data
+        self.profile_store = None
+        if self.params.mp_store is not None:
+            self.profile_store = ps.getstore(self.params.mp_store)
+
+        # Sessions and trading windows
+        self.calendar = su.SessionCalendar.from_name(
+                self.params.session_calendar,
+                starttime=self.params.starttime,
+                finaltime=self.params.orderfinaltime,
+                closetime=self.params.timetocloseorders)
+        self._sessions = None
+        self._clock = self.calendar.clock()
 
         for _data in self.getdatanames():
 
@@ -121,7 +189,15 @@ class FadeSystemIB(bt.Strategy):
                     valuearea=self.params.mp_valuearea, 
                     ticksize=TICKSIZE_CONFIGURATION[_data], 
                     std_threshold=STD_THRESHOLD_CONFIGURATION[self.params.std_threshold][_data],
-                    min_pricechange=MINIMUM_PRICE_CONFIGURATION[self.params.minimumchangeprice][_data])
+                    min_pricechange=MINIMUM_PRICE_CONFIGURATION[self.params.minimumchangeprice][_data],
+                    mp_mode=self.params.mp_mode,
+                    bins=self.params.mp_bins,
+                    developing_va=self.params.mp_developing,
+                    composite_sessions=self.params.mp_sessions,
+                    renderer=self.renderer,
+                    profile_store=self.profile_store,
+                    profile_table=PROFILE_TABLES.get(_data),
+                    calendar=self.calendar)
 
         # Lot configuration is handled by the strategy
         self.lot_config = LOTS_CONFIGURATION[self.params.lotconfig]
@@ -133,8 +209,23 @@ class FadeSystemIB(bt.Strategy):
         # Date/Time vars
         self._lastday = None
         self._newday = False
+        self._session_begin = None
 
     def start(self):
+        # Broker state of live trading (nothing in backtesting)
+        self.order_management.start()
+
+        # Sessions of preloaded data are computed once
+        if len(self.datas[0].datetime.array) > 0:
+            self._sessions = self.calendar.index(
+                    num2datetime64(self.datas[0].datetime.array))
+
+        # Profiles are stored by the fingerprint of the session bars
+        if self.profile_store is not None:
+            for _data in self.getdatanames():
+                self.signals[_data].session_fingerprints = \
+                        self.session_fingerprints(self.getdatabyname(_data))
+
         if LOG:
 
             df = pd.DataFrame({
@@ -154,10 +245,33 @@ class FadeSystemIB(bt.Strategy):
             print('[ Strategy Started ] \n'+
                     tabulate(df, headers='keys', tablefmt='psql', showindex=False))
 
+    def session_fingerprints(self, data):
+        '''Return the fingerprints of the sessions of the data by time of
+        first bar, or None if the bars are not known in advance (live data).
+        The bars of array feeds are known without preload.
+        '''
+        if len(data.datetime.array) > 0:
+            times = num2datetime64(data.datetime.array)
+            values = [data.open.array, data.high.array, data.low.array,
+                    data.close.array, data.volume.array]
+        elif getattr(data, 'bars', None) is not None:
+            times = data.bars.time
+            values = [data.bars.open, data.bars.high, data.bars.low,
+                    data.bars.close, data.bars.volume]
+        else:
+            return None
+        starts, fingerprints = ps.session_fingerprints(times, *values,
+                sessions=self.calendar.index(times).keys)
+        return dict(zip(pd.DatetimeIndex(starts), fingerprints))
+
     def next(self):
+        flags = self.session_flags()
         if self._lastday == None:
             self._lastday = self.datas[0].datetime.date(0)
             self._last_cron_time = self.datas[0].datetime.time(0)
+        elif flags & su.NEW_SESSION:
+            # Every session those vars must be changed
+            self._newday = True
 
         # The first data added will define the datetime
         now = self.datas[0].datetime.time(0)
@@ -165,7 +279,7 @@ class FadeSystemIB(bt.Strategy):
         _datetime = self.datas[0].datetime.datetime(0)
 
         self.cron_report(now)
-        self.order_management.next(_datetime)
+        self.order_management.next(_datetime, flags)
         for key, value in self.signals.items():
             self.signals[key].next(
                     datetime=_datetime,
@@ -173,43 +287,40 @@ class FadeSystemIB(bt.Strategy):
                     open=self.getdatabyname(key).open[0],
                     high=self.getdatabyname(key).high[0],
                     low=self.getdatabyname(key).low[0],
-                    close=self.getdatabyname(key).close[0]
+                    close=self.getdatabyname(key).close[0],
+                    volume=self.getdatabyname(key).volume[0],
+                    new_session=self._newday
                     )
 
-        if today > self._lastday:
-            # Every day those vars must be changed
-            self._newday = True
+        if self._newday:
+            self._newday = False
 
             for dataname in self.getdatanames():
                 # Reset trade signals handler variables
                 self.signals[dataname].reset()
             self.order_management.reset()
 
-        if self._newday:
-            self._newday = False
-
-            # Get timestamp of previous day
-            lastday_begin = dt.datetime.timestamp(
-                    pd.Timestamp(self._lastday))
-            lastday_end = dt.datetime.timestamp(
-                    pd.Timestamp(self._lastday)+dt.timedelta(days=1))
-
             for _data in self.getdatanames():
 
-                # Get data from day before
-                data = parsedata(self.getdatabyname(_data),
-                            from_date=lastday_begin, 
-                            to_date=lastday_end)
+                if self.params.savefigures:
+                    # Get data from day before
+                    data = parsedata(self.getdatabyname(_data),
+                                from_date=self._session_begin, 
+                                to_date=_datetime)
+
+                    # Plot data and orders
+                    self.renderer.orders(data, [order for order in
+                        self.order_management.daily_orders
+                        if order.symbol == _data], dataname=_data)
 
-                # Plot data and orders
-                plot_orders(data, self.order_management.daily_orders, dataname=_data)
-                # Generate Market Profile
-                self.signals[_data].generate_mp(data)
+                # Market Profile of day before is accumulated bar by bar
+                self.signals[_data].finish_mp(save_fig=self.params.savefigures)
 
                 self.signals[_data].set_signal_mode()
                 self.signals[_data].print_status()
 
             self._lastday = today
+            self._session_begin = _datetime
 
         if self.order_management.check_time_close_orders():
             self.order_management.close_all_positions()
@@ -245,6 +356,23 @@ class FadeSystemIB(bt.Strategy):
                 self.open_order(_data, signal, lots)
                 #self._last_order_time = st.datas[0].datetime.datetime(0)
     
+    def session_flags(self):
+        '''Return the session calendar flags of current bar. The flags of
+        preloaded data are read from the session index, otherwise (live
+        data) they are computed bar by bar with the session clock.
+        The first data added defines the sessions.
+        '''
+        i = len(self.datas[0]) - 1
+        if self._sessions is not None and i < len(self._sessions):
+            return self._sessions.flags[i]
+
+        # Previous bar of preloaded data before the live bars
+        previous = None
+        if not self._clock.started and len(self.datas[0]) > 1:
+            previous = self.datas[0].datetime.datetime(-1)
+        return self._clock.flags(self.datas[0].datetime.datetime(0),
+                previous)
+
     def open_order(self, dataname, signal, lots):
         '''Open order based on signal parameter and lots
         '''
@@ -298,7 +426,8 @@ class FadeSystemIB(bt.Strategy):
             self.log('Order [%d] Completed' % order.tradeid)
 
             self.order_management.set_executed(order.tradeid, 
-                    self.datas[0].datetime.datetime(0))
+                    self.datas[0].datetime.datetime(0), order.executed.price)
+            self.order_management.notify_fill(order)
             self.order_management.update_orders()
 
             df = pd.DataFrame({
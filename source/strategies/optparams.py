@@ -10,6 +10,10 @@ LOTS_CONFIGURATION = [
 # Change this with dataclient
 TICKSIZE_CONFIGURATION = {}
 
+# Session Market Profiles by data name
+# Change this with datautils.generatesessionprofiles
+PROFILE_TABLES = {}
+
 STD_THRESHOLD_CONFIGURATION = [
 
         {'EURUSD':0.001368,
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import datetime as dt
+
+from ib_insync import (IB, Forex, Order, OrderStatus, Trade, Fill, Execution,
+        CommissionReport, Position, AccountValue)
+
+import accountmirror as am
+
+ACCOUNT = 'DU123'
+
+def test_events():
+    ib = IB()
+    mirror = am.AccountMirror(ib, ACCOUNT)
+    eurusd = Forex('EURUSD', conId=12087792)
+
+    trade = Trade(eurusd, Order(orderId=7, account=ACCOUNT, action='BUY',
+        totalQuantity=20000), OrderStatus(orderId=7, status='Submitted'))
+    ib.orderStatusEvent.emit(trade)
+    assert mirror.open_orders() == 1
+
+    for i, shares in enumerate((5000., 15000.)):
+        fill = Fill(eurusd, Execution(execId='e%d' % i, orderId=7,
+            acctNumber=ACCOUNT, side='BOT', shares=shares, price=1.1,
+            avgPrice=1.1), CommissionReport(), dt.datetime(2020, 1, 2, 10, i))
+        ib.execDetailsEvent.emit(trade, fill)
+    ib.positionEvent.emit(Position(ACCOUNT, eurusd, 20000., 1.1))
+    ib.positionEvent.emit(Position('OTHER', eurusd, -5000., 1.2))
+    ib.accountValueEvent.emit(AccountValue(ACCOUNT, 'NetLiquidation',
+        '1000000', 'USD', ''))
+
+    assert mirror.filled(7) == 20000.
+    assert mirror.last_fill(eurusd.conId).execution.execId == 'e1'
+    assert mirror.position(eurusd.conId) == 20000.
+    assert mirror.value('NetLiquidation', 'USD') == '1000000'
+
+    fills = mirror.fills_df()
+    assert list(fills.execId) == ['e0', 'e1']
+    assert fills.symbol[0] == 'EURUSD'
+    # Snapshots are rebuilt only after changes
+    assert mirror.fills_df() is fills
+    ib.positionEvent.emit(Position(ACCOUNT, eurusd, 0., 0.))
+    assert mirror.fills_df() is fills
+    assert mirror.position(eurusd.conId) == 0.
+    assert mirror.account_df().loc['NetLiquidation', 'Value'] == '1000000'
+
+    mirror.close()
+    ib.positionEvent.emit(Position(ACCOUNT, eurusd, 1000., 1.1))
+    assert mirror.position(eurusd.conId) == 0.
+
+def test_sync():
+    ib = IB()
+    eurusd = Forex('EURUSD', conId=12087792)
+    # Fills and orders of other clients are only known by requests
+    fill = Fill(eurusd, Execution(execId='e0', orderId=3, clientId=99,
+        acctNumber=ACCOUNT, side='SLD', shares=1000., price=1.1,
+        avgPrice=1.1), CommissionReport(), dt.datetime(2020, 1, 2, 10))
+    trade = Trade(eurusd, Order(orderId=4, clientId=99, account=ACCOUNT,
+        action='BUY', totalQuantity=1000), OrderStatus(orderId=4,
+            status='Submitted'))
+    requests = []
+
+    async def reqExecutionsAsync(execFilter):
+        requests.append(execFilter.acctCode)
+        return [fill]
+
+    async def reqAllOpenOrdersAsync():
+        return [trade]
+
+    ib.reqExecutionsAsync = reqExecutionsAsync
+    ib.reqAllOpenOrdersAsync = reqAllOpenOrdersAsync
+
+    mirror = am.AccountMirror(ib, ACCOUNT, sync_interval=0.)
+    # Nothing is requested before the start
+    mirror.poll()
+    assert requests == [] and mirror.last_fill(eurusd.conId) is None
+
+    mirror.start()
+    assert requests == [ACCOUNT]
+    assert mirror.last_fill(eurusd.conId) is fill
+    assert mirror.open_orders() == 1
+    fills = mirror.fills_df()
+
+    # The polls request them again, the same fills don't change the table
+    mirror.poll()
+    mirror.poll()
+    assert len(requests) > 1
+    assert mirror.fills_df() is fills
+    mirror.close()
+
+if __name__ == '__main__':
+    test_events()
+    test_sync()
+    print('Account mirror: OK')
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import backtrader as bt
+import backtrader.feeds as btfeeds
+
+import barframe as bf
+import barfeed
+
+DATAFILE = 'eurusd.csv'
+
+def load(data):
+    cerebro = bt.Cerebro()
+    cerebro.adddata(data)
+    data._env = cerebro
+    data._start()
+    data.preload()
+    return data
+
+def test_preload():
+    expected = load(btfeeds.GenericCSVData(dataname=DATAFILE, nullvalue=0.,
+        dtformat='%Y-%m-%d %H:%M:%S', date=0, open=1, high=2, low=3,
+        close=4, volume=5, openinterest=-1,
+        timeframe=bt.TimeFrame.Minutes))
+    data = load(barfeed.ArrayData(dataname=bf.BarFrame.from_csv(DATAFILE),
+        timeframe=bt.TimeFrame.Minutes))
+
+    assert data.buflen() == expected.buflen()
+    for name in data.lines.getlinealiases():
+        assert getattr(data.lines, name).array == \
+                getattr(expected.lines, name).array
+
+def test_barsize_timeframe():
+    assert barfeed.barsize_timeframe('1 min') == (bt.TimeFrame.Minutes, 1)
+    assert barfeed.barsize_timeframe('5 mins') == (bt.TimeFrame.Minutes, 5)
+    assert barfeed.barsize_timeframe('1 hour') == (bt.TimeFrame.Minutes, 60)
+    assert barfeed.barsize_timeframe('30 secs') == (bt.TimeFrame.Seconds, 30)
+
+if __name__ == '__main__':
+    test_preload()
+    test_barsize_timeframe()
+    print('Bar feed: OK')
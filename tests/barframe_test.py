@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import pandas as pd
+import numpy as np
+
+import barframe as bf
+import datautils as du
+
+DATAFILE = 'eurusd.csv'
+
+def test_from_csv():
+    dataframe = pd.read_csv(DATAFILE)
+    bars = bf.BarFrame.from_csv(DATAFILE)
+
+    assert len(bars) == len(dataframe.index)
+    assert bars.time.dtype == np.int64
+    assert (bars.times() == pd.DatetimeIndex(dataframe['date']).values).all()
+    assert (bars.close == dataframe['close'].to_numpy()).all()
+
+    # Sessions are views of the same arrays
+    sessions = bars.sessions()
+    assert len(sessions) == len(pd.DatetimeIndex(dataframe['date']
+        ).normalize().unique())
+    assert sum(len(session) for session in sessions) == len(bars)
+    assert np.shares_memory(sessions[1].close, bars.close)
+
+    day = bars.between('2019-09-03', '2019-09-04')
+    assert day.times()[0] == np.datetime64('2019-09-03T00:00')
+    assert day.times()[-1] == np.datetime64('2019-09-04T00:00')
+
+def test_parsedataframe():
+    dataframe = pd.read_csv(DATAFILE).rename(columns={'date':'datetime'})
+    original = dataframe.copy()
+
+    result = du.parsedataframe(dataframe, from_date='2019-09-03',
+            size_limit=100)
+
+    # Input is not changed and size limit counts bars
+    assert dataframe.equals(original)
+    assert len(result.index) == 100
+    assert (result['Close'].to_numpy() ==
+            dataframe['close'].to_numpy()[-100:]).all()
+
+if __name__ == '__main__':
+    test_from_csv()
+    test_parsedataframe()
+    print('Bar frame: OK')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import tempfile
+
+import numpy as np
+
+import barframe as bf
+import barstore as bs
+
+DATAFILE = 'eurusd.csv'
+
+def test_convert_and_merge():
+    store = bs.BarStore(tempfile.mkdtemp())
+    expected = bf.BarFrame.from_csv(DATAFILE)
+    bs.convert_csv(DATAFILE, store, 'EURUSD', ticksize=0.00005)
+
+    bars = store.read('EURUSD')
+    assert isinstance(bars.close.base, np.memmap)
+    assert (bars.time == expected.time).all()
+    assert (bars.close == expected.close).all()
+    assert store.metadata('EURUSD')['ticksize'] == 0.00005
+
+    # Overlapping bars replace the saved bars
+    part = expected[100:200]
+    store.merge('EURUSD', bf.BarFrame(part.time, part.open, part.high,
+        part.low, part.close + 1., part.volume))
+    bars = store.read('EURUSD')
+    assert len(bars) == len(expected)
+    assert (bars.close[100:200] == expected.close[100:200] + 1.).all()
+    assert (bars.close[200:] == expected.close[200:]).all()
+    assert store.metadata('EURUSD')['rows'] == len(expected)
+
+def test_append():
+    store = bs.BarStore(tempfile.mkdtemp())
+    expected = bf.BarFrame.from_csv(DATAFILE)
+    store.write('EURUSD', expected[:1000], ticksize=0.00005)
+    path = store.path('EURUSD')
+
+    # Newer bars extend the columns in place
+    metadata = store.append('EURUSD', expected[1000:3000], source='test')
+    assert store.path('EURUSD') == path
+    bars = store.read('EURUSD')
+    assert isinstance(bars.close.base, np.memmap)
+    assert (bars.time == expected.time[:3000]).all()
+    assert (bars.close == expected.close[:3000]).all()
+    assert metadata['rows'] == 3000
+    assert metadata['ticksize'] == 0.00005
+    assert store.metadata('EURUSD')['source'] == 'test'
+    assert store.metadata('EURUSD')['last'] == str(expected.times()[2999])
+
+    # Overlapping bars are merged
+    store.append('EURUSD', expected[2000:4000])
+    bars = store.read('EURUSD')
+    assert (bars.time == expected.time[:4000]).all()
+    assert store.metadata('EURUSD')['rows'] == 4000
+
+    # Empty dataset
+    store.write('EMPTY', expected[:0])
+    store.append('EMPTY', expected[:10])
+    assert (store.read('EMPTY').close == expected.close[:10]).all()
+
+if __name__ == '__main__':
+    test_convert_and_merge()
+    test_append()
+    print('Bar store: OK')
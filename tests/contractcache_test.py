@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import os
+import tempfile
+
+from ib_insync import Contract, ContractDetails, Forex, PriceIncrement
+
+import contractcache as cc
+
+DETAILS = ContractDetails(
+        contract=Contract(secType='CASH', conId=12087792, symbol='EUR',
+            exchange='IDEALPRO', currency='USD', localSymbol='EUR.USD'),
+        minTick=0.00005,
+        marketRuleIds='239,239',
+        validExchanges='IDEALPRO,SMART',
+        timeZoneId='US/Eastern')
+RULES = {239: [PriceIncrement(0, 0.00005), PriceIncrement(10, 0.001)]}
+
+def test_contract_cache():
+    filename = os.path.join(tempfile.mkdtemp(), 'contracts.json')
+    cache = cc.ContractCache(filename)
+    contract = Forex('EURUSD')
+    cache.put(contract, cc.ContractInfo.from_details(DETAILS, RULES))
+    cache.save()
+
+    # Saved details are found by the requested contract and by conId
+    saved = cc.ContractCache(filename)
+    info = saved.get(contract)
+    assert info.minTick == 0.00005
+    assert info.ticksize(1.1) == 0.00005
+    assert info.ticksize(20.) == 0.001
+    assert saved.get(Contract(conId=12087792)).localSymbol == 'EUR.USD'
+    assert saved.missing([contract, Forex('GBPUSD')]) == [Forex('GBPUSD')]
+
+    # Expired details are requested again
+    assert cc.ContractCache(filename, ttl=0).get(contract) is None
+
+if __name__ == '__main__':
+    test_contract_cache()
+    print('Contract cache: OK')
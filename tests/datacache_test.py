@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import asyncio
+import tempfile
+
+import pandas as pd
+from ib_insync import Forex
+
+import barframe as bf
+import barstore as bs
+import datacache as dc
+
+DATAFILE = 'eurusd.csv'
+
+class CsvClient(object):
+    '''Data client returning the bars of the csv file.
+    '''
+
+    def __init__(self):
+        self.dataframe = pd.read_csv(DATAFILE, parse_dates=['date'])
+        self.requests = []
+
+    async def getearliestbar_async(self, contract, whatToShow, useRTH):
+        return self.dataframe['date'].iloc[0].to_pydatetime()
+
+    async def getticksize_async(self, contract):
+        return 0.00005
+
+    async def getbars_range_async(self, contract, timeframe, fromdate,
+            todate, whatToShow, useRTH):
+        self.requests.append((fromdate, todate))
+        dates = self.dataframe['date']
+        return bf.BarFrame.from_dataframe(
+                self.dataframe[(dates >= fromdate) & (dates < todate)])
+
+    def run_until_complete(self, awaitable, name=''):
+        return asyncio.run(awaitable)
+
+def test_ranges():
+    ranges = dc.add_range([(0, 10), (20, 30)], 10, 15)
+    assert ranges == [(0, 15), (20, 30)]
+    assert dc.missing_ranges(ranges, 5, 40) == [(15, 20), (30, 40)]
+    assert dc.missing_ranges(ranges, 0, 15) == []
+    assert dc.seconds_duration(3600) == '3600 S'
+    assert dc.seconds_duration(86401) == '2 D'
+
+    # Days are trading days, the weekend is skipped
+    assert dc.duration_start('1 D', '2019-09-09 10:00') == \
+            pd.Timestamp('2019-09-06 10:00')
+    assert dc.duration_start('3600 S', '2019-09-09 10:00') == \
+            pd.Timestamp('2019-09-09 09:00')
+
+def test_update():
+    client = CsvClient()
+    store = bs.BarStore(tempfile.mkdtemp())
+    cache = dc.HistoricalCache(client, store)
+    contract = Forex('EURUSD', 'IDEALPRO', 'EUR')
+
+    bars = cache.update(contract, 'EURUSD', '1 min', '1 D',
+            end='2019-09-04 12:00')
+    assert len(client.requests) == 1
+    assert bars.times()[-1] == pd.Timestamp('2019-09-04 11:59')
+
+    # Only the new range is downloaded
+    bars = cache.update(contract, 'EURUSD', '1 min', '2 D',
+            end='2019-09-05 12:00')
+    assert client.requests[-1] == (pd.Timestamp('2019-09-04 12:00'),
+            pd.Timestamp('2019-09-05 12:00'))
+    assert cache.gaps('EURUSD', '1 min', '2019-09-03 12:00',
+            '2019-09-05 12:00') == []
+
+    dates = client.dataframe['date']
+    expected = client.dataframe[(dates >= '2019-09-03 12:00') &
+            (dates < '2019-09-05 12:00')]
+    assert len(bars) == len(expected.index)
+    assert (bars.close == expected['close'].to_numpy()).all()
+
+    # History before the earliest bar is not requested
+    requests = len(client.requests)
+    cache.update(contract, 'EURUSD', '1 min', '1 Y', end='2019-09-04')
+    assert len(client.requests) == requests + 1
+    assert client.requests[-1][0] == dates.iloc[0]
+
+def test_update_writes():
+    client = CsvClient()
+    store = bs.BarStore(tempfile.mkdtemp())
+    cache = dc.HistoricalCache(client, store)
+    contract = Forex('EURUSD', 'IDEALPRO', 'EUR')
+    writes = []
+    write = store.write
+
+    def counted_write(*args, **kwargs):
+        writes.append(args[0])
+        return write(*args, **kwargs)
+
+    store.write = counted_write
+    cache.update(contract, 'EURUSD', '1 min', '1 D', end='2019-09-04 12:00')
+    assert len(writes) == 1
+
+    # New bars after the saved bars extend the columns in place
+    cache.update(contract, 'EURUSD', '1 min', '2 D', end='2019-09-05 12:00')
+    assert len(writes) == 1
+
+    # Gaps before and after the saved bars are merged in one rewrite
+    bars = cache.update(contract, 'EURUSD', '1 min', '4 D',
+            end='2019-09-06 12:00')
+    assert len(client.requests) == 4
+    assert len(writes) == 2
+    dates = client.dataframe['date']
+    expected = client.dataframe[(dates >= '2019-09-02 12:00') &
+            (dates < '2019-09-06 12:00')]
+    assert (bars.close == expected['close'].to_numpy()).all()
+    assert store.metadata('EURUSD')['ranges'] == [['2019-09-02 12:00:00',
+        '2019-09-06 12:00:00']]
+
+if __name__ == '__main__':
+    test_ranges()
+    test_update()
+    test_update_writes()
+    print('Data cache: OK')
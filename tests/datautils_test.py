@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+import backtrader.feeds as btfeeds
+
+import datautils as du
+
+DATAFILE = 'eurusd.csv'
+SIZE_LIMIT = 60 * 24
+
+def reference_parsedata(data, from_date=None, to_date=None,
+        size_limit=SIZE_LIMIT):
+    '''Data Frame of the last bars read bar by bar from the lines (the
+    parsedata of the first versions). The dates are POSIX timestamps.
+    '''
+    size = min(size_limit, len(data))
+    datetime = [data.datetime.datetime(i) for i in range(-size + 1, 1)]
+    dataframe = pd.DataFrame({
+        'timestamp':[dt.datetime.timestamp(value) for value in datetime],
+        'datetime':pd.DatetimeIndex(datetime),
+        'Close':data.close.get(ago=0, size=size),
+        'High':data.high.get(ago=0, size=size),
+        'Low':data.low.get(ago=0, size=size),
+        'Open':data.open.get(ago=0, size=size),
+        'Volume':data.volume.get(ago=0, size=size),
+        }, index=pd.DatetimeIndex(datetime, name='datetime'))
+
+    if from_date is not None:
+        dataframe = dataframe[dataframe['timestamp'] >= from_date]
+    if to_date is not None:
+        dataframe = dataframe[dataframe['timestamp'] <= to_date]
+    return dataframe
+
+class ParseStrategy(bt.Strategy):
+    '''Compare parsedata with the reference at some bars.
+    '''
+
+    def __init__(self):
+        self.checked = 0
+
+    def next(self):
+        if len(self.data) % 997:
+            return
+        now = self.data.datetime.datetime(0)
+        begin = now - dt.timedelta(hours=6)
+        end = now - dt.timedelta(hours=1)
+        for from_date, to_date in [(None, None), (begin, None),
+                (None, end), (begin, end)]:
+            # Same ranges as datetime and as POSIX timestamp
+            timestamps = [None if value is None else value.timestamp()
+                    for value in (from_date, to_date)]
+            expected = reference_parsedata(self.data, *timestamps)
+            for args in [(from_date, to_date), timestamps]:
+                result = du.parsedata(self.data, *args,
+                        size_limit=SIZE_LIMIT)
+                assert result.index.equals(expected.index)
+                assert pd.DatetimeIndex(result['datetime']).equals(
+                        pd.DatetimeIndex(expected['datetime']))
+                for column in ['timestamp', 'Close', 'High', 'Low', 'Open',
+                        'Volume']:
+                    assert np.allclose(result[column].to_numpy(np.float64),
+                            expected[column].to_numpy(np.float64))
+        self.checked += 1
+
+def run(preload):
+    cerebro = bt.Cerebro(preload=preload, runonce=False, stdstats=False)
+    cerebro.adddata(btfeeds.GenericCSVData(dataname=DATAFILE, nullvalue=0.,
+        dtformat='%Y-%m-%d %H:%M:%S', date=0, open=1, high=2, low=3,
+        close=4, volume=5, openinterest=-1,
+        timeframe=bt.TimeFrame.Minutes))
+    cerebro.addstrategy(ParseStrategy)
+    return cerebro.run()[0]
+
+def test_parsedata_preload():
+    assert run(preload=True).checked > 0
+
+def test_parsedata_live():
+    assert run(preload=False).checked > 0
+
+def test_plot_profile():
+    import os
+    import tempfile
+
+    profile = pd.Series([3., 5., 2.], index=[1.1, 1.1002, 1.1004])
+    directory = tempfile.mkdtemp()
+    du.plot_profile(profile, (1.1, 1.1004), 1.1002,
+            os.path.join(directory, 'EURUSD_tpo_2019-09-02 10:00:00'))
+    assert os.listdir(directory) == ['EURUSD_tpo_2019-09-02_100000.png']
+
+if __name__ == '__main__':
+    test_parsedata_preload()
+    test_parsedata_live()
+    test_plot_profile()
+    print('Parse data: OK')
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import asyncio
+import tempfile
+
+import numpy as np
+import pandas as pd
+from ib_insync import BarData, Forex
+
+import barframe as bf
+import barstore as bs
+import downloader as dl
+
+DATAFILE = 'eurusd.csv'
+
+def test_chunk_ranges():
+    ranges = dl.chunk_ranges('2019-01-01', '2019-01-10 12:00', '1 min')
+    assert len(ranges) == 10
+    assert ranges[0] == (pd.Timestamp('2019-01-09 12:00'),
+            pd.Timestamp('2019-01-10 12:00'))
+    assert ranges[-1][0] == pd.Timestamp('2019-01-01')
+    assert dl.max_chunk_seconds('5 secs') == 3600
+    assert dl.max_chunk_seconds('1 day') == dl.MAX_DURATION
+
+def test_token_bucket():
+    bucket = dl.TokenBucket(100., 2)
+
+    async def acquire():
+        return await asyncio.gather(*[bucket.acquire() for i in range(4)])
+
+    waits = asyncio.run(acquire())
+    assert waits[:2] == [0., 0.]
+    assert all(wait > 0 for wait in waits[2:])
+
+def test_parts():
+    bars = bf.BarFrame.from_csv(DATAFILE)
+    directory = tempfile.mkdtemp()
+    filenames = [dl.save_part(directory, bars[begin:begin + 1000])
+            for begin in reversed(range(0, len(bars), 1000))]
+    parts = dl.read_parts(filenames)
+    assert (parts.time == bars.time).all()
+    assert (parts.close == bars.close).all()
+
+class FakeIB(object):
+    '''Historical data of the bars without connection.
+    '''
+
+    def __init__(self, bars):
+        self.bars = bars
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime,
+            durationStr, barSizeSetting, whatToShow, useRTH):
+        size, unit = durationStr.split()
+        end = pd.Timestamp(endDateTime)
+        begin = end - pd.Timedelta(int(size), unit.lower())
+        bars = self.bars.between(begin, end)
+        return [BarData(date=time.to_pydatetime(), open=bars.open[i],
+            high=bars.high[i], low=bars.low[i], close=bars.close[i],
+            volume=-1, average=bars.close[i], barCount=-1)
+            for i, time in enumerate(pd.DatetimeIndex(bars.times()))]
+
+def test_frame_parts():
+    bars = bf.BarFrame.from_csv(DATAFILE)
+    frame = bars[:2000].to_dataframe().reset_index(drop=True).rename(
+            columns=str.lower).rename(columns={'datetime':'date'})
+    directory = tempfile.mkdtemp()
+    filenames = [dl.save_part(directory, frame[begin:begin + 500])
+            for begin in reversed(range(0, len(frame), 500))]
+    parts = dl.read_frame_parts(filenames)
+    assert list(parts.columns) == list(frame.columns)
+    assert (parts['date'].values == bars[:2000].times()).all()
+    assert (parts['close'].values == bars.close[:2000]).all()
+    assert [len(part) for part in dl.iter_parts([])] == []
+
+def test_download():
+    bars = bf.BarFrame.from_csv(DATAFILE)
+    times = bars.times()
+    start = pd.Timestamp(times[0]).ceil('D')
+    end = start + pd.Timedelta(3, 'D')
+    expected = bars.between(start, end - pd.Timedelta(1, 'ns'))
+    downloader = dl.ChunkedDownloader(FakeIB(bars), verbose=False)
+    contract = Forex('EURUSD')
+
+    frame = asyncio.run(downloader.download_frame_async(contract, '1 min',
+        start, end))
+    assert list(frame.columns) == dl.FRAME_COLUMNS
+    assert (frame['close'].values == expected.close).all()
+
+    store = bs.BarStore(tempfile.mkdtemp())
+    metadata = asyncio.run(downloader.download_tostore_async(contract,
+        '1 min', start, end, store, ticksize=0.00005))
+    saved = store.read('EURUSD')
+    assert metadata['rows'] == len(expected)
+    assert metadata['whatToShow'] == 'MIDPOINT'
+    assert (saved.time == expected.time).all()
+    assert (saved.close == expected.close).all()
+    assert downloader.stats.completed == 6
+
+if __name__ == '__main__':
+    test_chunk_ranges()
+    test_token_bucket()
+    test_parts()
+    test_frame_parts()
+    test_download()
+    print('Downloader: OK')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import asyncio
+import datetime as dt
+
+from ib_insync import Forex, MarketOrder, util
+
+import barframe as bf
+import contractcache
+import localgateway as lg
+from dataclient import IBDataClient
+
+DATAFILE = 'eurusd.csv'
+
+def test_gateway():
+    gateway = lg.LocalGateway(port=0, latency=0.01)
+    gateway.add_symbol('EURUSD', DATAFILE, 'CASH')
+    gateway.start()
+    # The loop of ib_insync (closed by asyncio.run of other tests)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    client = IBDataClient(lg.HOST, gateway.port, 1)
+    client.contracts = contractcache.ContractCache(None)
+    try:
+        contract = Forex('EURUSD')
+        assert client.getticksize(contract) == 0.00005
+
+        # Historical bars are read from the file
+        expected = bf.BarFrame.from_csv(DATAFILE).between(
+                dt.datetime(2019, 9, 2), dt.datetime(2019, 9, 4, 23, 59))
+        bars = client.getbars_range(contract, '1 min',
+                dt.datetime(2019, 9, 2), dt.datetime(2019, 9, 5))
+        assert (bars.time == expected.time).all()
+        assert (bars.close == expected.close).all()
+
+        # Chunked downloads have the columns of a single request
+        frame = client.getdownloader().download_frame(contract, '1 min',
+                dt.datetime(2019, 9, 2), dt.datetime(2019, 9, 5))
+        single = util.df(client.client.reqHistoricalData(contract,
+            dt.datetime(2019, 9, 3), '1 D', '1 min', 'MIDPOINT', True))
+        assert list(frame.columns) == list(single.columns)
+        assert (frame['close'].to_numpy() == expected.close).all()
+        assert len(single.index) == len(expected.between(None,
+            dt.datetime(2019, 9, 2, 23, 59)))
+
+        # Orders are filled with the last price
+        mirror = client.getmirror()
+        mirror.start()
+        trade = client.client.placeOrder(client.qualify([contract])['EURUSD'],
+                MarketOrder('BUY', 20000))
+        client.client.sleep(0.2)
+        assert trade.orderStatus.status == 'Filled'
+        assert mirror.position(trade.contract.conId) == 20000.
+        assert mirror.fills_df().price[0] == gateway.symbols['EURUSD'].price
+    finally:
+        client.close()
+        gateway.stop()
+
+def test_legacy_client():
+    gateway = lg.LocalGateway(port=0)
+    gateway.start()
+
+    # Handshake of IbPy: client version and server version
+    async def connect():
+        reader, writer = await asyncio.open_connection(lg.HOST, gateway.port)
+        writer.write(b'63\0')
+        answer = await reader.read()
+        writer.close()
+        return answer
+
+    try:
+        assert asyncio.run(connect()) == b'%d\0' % lg.LEGACY_SERVER_VERSION
+    finally:
+        gateway.stop()
+
+if __name__ == '__main__':
+    test_gateway()
+    test_legacy_client()
+    print('Local gateway: OK')
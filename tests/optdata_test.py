@@ -11,83 +11,26 @@ HOST = '127.0.0.1'
 PORT = 7497
 CLIENT_ID = 1234
 
-args = {
-        'host':HOST,
-        'port':PORT,
-        'clientid':CLIENT_ID,
-        'symbol':'EURUSD',
-        'symboltype':'Forex',
-        'exchange':'IDEALPRO',
-        'currency':'USD',
-        'timeframe':'1 min',
-        'duration':'2 Y',
-        'whatToShow':'MIDPOINT',
-        'outputfile':'EUR.USD-CASH-IDEALPRO',
-        }
-
-dataclient.run(**args)
-
-args = {
-        'host':HOST,
-        'port':PORT,
-        'clientid':CLIENT_ID,
-        'symbol':'AUDUSD',
-        'symboltype':'Forex',
-        'exchange':'IDEALPRO',
-        'currency':'USD',
-        'timeframe':'1 min',
-        'duration':'2 Y',
-        'whatToShow':'MIDPOINT',
-        'outputfile':'AUD.USD-CASH-IDEALPRO',
-        }
-
-dataclient.run(**args)
-
-args = {
-        'host':HOST,
-        'port':PORT,
-        'clientid':CLIENT_ID,
-        'symbol':'USDJPY',
-        'symboltype':'Forex',
-        'exchange':'IDEALPRO',
-        'currency':'JPY',
-        'timeframe':'1 min',
-        'duration':'2 Y',
-        'whatToShow':'MIDPOINT',
-        'outputfile':'USD.JPY-CASH-IDEALPRO',
-        }
-
-dataclient.run(**args)
-
-args = {
-        'host':HOST,
-        'port':PORT,
-        'clientid':CLIENT_ID,
-        'symbol':'GBPUSD',
-        'symboltype':'Forex',
-        'exchange':'IDEALPRO',
-        'currency':'USD',
-        'timeframe':'1 min',
-        'duration':'2 Y',
-        'whatToShow':'MIDPOINT',
-        'outputfile':'GBP.USD-CASH-IDEALPRO',
-        }
+# Bar store of downloaded data
+DIRECTORY = 'data'
 
-dataclient.run(**args)
+# Symbols downloaded at the same time
+CONCURRENCY = 5
 
-args = {
-        'host':HOST,
-        'port':PORT,
-        'clientid':CLIENT_ID,
-        'symbol':'CADUSD',
+JOB = {
         'symboltype':'Forex',
         'exchange':'IDEALPRO',
-        'currency':'USD',
         'timeframe':'1 min',
         'duration':'2 Y',
         'whatToShow':'MIDPOINT',
-        'outputfile':'CAD.USD-CASH-IDEALPRO',
         }
 
-dataclient.run(**args)
+jobs = [
+        dict(JOB, symbol='EURUSD', currency='USD', name='EUR.USD-CASH-IDEALPRO'),
+        dict(JOB, symbol='AUDUSD', currency='USD', name='AUD.USD-CASH-IDEALPRO'),
+        dict(JOB, symbol='USDJPY', currency='JPY', name='USD.JPY-CASH-IDEALPRO'),
+        dict(JOB, symbol='GBPUSD', currency='USD', name='GBP.USD-CASH-IDEALPRO'),
+        dict(JOB, symbol='CADUSD', currency='USD', name='CAD.USD-CASH-IDEALPRO'),
+        ]
 
+dataclient.run_batch(jobs, HOST, PORT, CLIENT_ID, DIRECTORY, CONCURRENCY)
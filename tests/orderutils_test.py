@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import asyncio
+import datetime as dt
+from types import SimpleNamespace
+
+import numpy as np
+
+import orderutils as ou
+
+def test_order_book():
+    book = ou.OrderBook()
+    orders = [ou.OrderHandler(i, 1, ou.LONG if i % 2 else ou.SHORT,
+        'EURUSD' if i < 4 else 'AMD') for i in range(1, 7)]
+    for order in orders:
+        book.add(order)
+
+    assert len(book) == 6
+    assert orders[4].lot == 1 and type(orders[4].lot) is int
+    assert book.symbols() == ['EURUSD', 'AMD']
+    assert [order._id for order in book.symbol_orders('EURUSD')] == [1, 2, 3]
+
+    book.close(orders[1])
+    assert orders[1].closed
+    assert book.get(2) is orders[1]
+    assert 2 not in book.open and 2 in book.closed
+    assert [order._id for order in book.symbol_orders('EURUSD')] == [1, 3]
+
+    for order in book.symbol_orders('AMD'):
+        book.close(order)
+    assert book.symbols() == ['EURUSD']
+    assert [order._id for order in book] == [1, 3]
+    assert len(book.closed) == 4
+
+def test_order_store():
+    store = ou.OrderStore(capacity=2)
+    random = np.random.RandomState(0)
+    symbols = ['EURUSD', 'AMD', 'ES']
+    orders = []
+    for i in range(50):
+        order = ou.OrderHandler(i, 1 + i % 6, ou.LONG if i % 2 else ou.SHORT,
+                symbols[i % 3])
+        if i % 7:
+            price = random.uniform(0.9, 1.1)
+            order.set_stops(*ou.calc_stops(price, order.side, 0.01, 0.01,
+                mode=ou.PERCENT))
+        order.attach(store)
+        order.executed = i % 11 != 0
+        orders.append(order)
+
+    assert len(store) == 50
+    assert orders[4].lot == 5 and type(orders[4].lot) is int
+    assert orders[4].symbol == 'AMD'
+    assert orders[0]._stoploss is None
+
+    # The rows of closed orders are reused, the values are kept
+    capacity = len(store.columns['side'])
+    for order in orders[3:9]:
+        order.closed = True
+        order.detach()
+    assert len(store) == 44 and orders[4].lot == 5
+    for i in range(50, 56):
+        order = ou.OrderHandler(i, 2, ou.LONG, 'ES')
+        order.attach(store)
+        order.executed = True
+        orders.append(order)
+    assert store.size == 50 and len(store.columns['side']) == capacity
+    assert orders[-1].symbol == 'ES' and orders[-1]._stoploss is None
+
+    for step in range(20):
+        closes = random.uniform(0.9, 1.1, len(store.symbols))
+        expected = [order for order in orders if not order.closed and
+                order.executed and
+                order.check_stops(closes[store.symbol_index(order.symbol)])]
+        result = [store.orders[row] for row in store.check_stops(closes)]
+        assert sorted(result, key=lambda order: order._id) == expected
+
+def test_triggers():
+    triggers = ou.TriggerIndex()
+    random = np.random.RandomState(1)
+    orders = []
+    for i in range(30):
+        order = ou.OrderHandler(i, 1, ou.LONG if i % 2 else ou.SHORT, 'EURUSD')
+        sl, tp = ou.calc_stops(random.uniform(0.95, 1.05), order.side, 0.02,
+                0.03, mode=ou.PERCENT)
+        order.set_stops(sl, None if i % 5 == 0 else tp)
+        triggers.add(order)
+        orders.append(order)
+
+    # Each order is returned once, at the first price reaching a stop
+    pending = list(orders)
+    for step in range(40):
+        close = random.uniform(0.9, 1.1)
+        expected = [order for order in pending if order.check_stops(close)]
+        pending = [order for order in pending if order not in expected]
+        assert triggers.trigger(close) == expected
+    assert len(triggers) == sum(2 - (order._id % 5 == 0)
+            for order in pending)
+    assert set(triggers._levels) == {order._id for order in pending}
+
+    # The high and the low of the bar reach the levels above and below
+    order = ou.OrderHandler(100, 1, ou.LONG, 'EURUSD')
+    order.set_stops(0.99, 1.01)
+    triggers.add(order)
+    assert order not in triggers.trigger(1.0, 1.0)
+    assert triggers.trigger(0.995, 1.012)[-1] is order
+    triggers.add(order)
+    triggers.remove(order)
+    assert all(level[2] is not order
+            for level in triggers.below + triggers.above)
+    assert triggers.below == sorted(triggers.below)
+    assert triggers.above == sorted(triggers.above)
+
+def test_expiries():
+    class Strategy(object):
+        def getdatanames(self):
+            return ['EURUSD']
+    om = ou.OrdersManagement(Strategy(), None)
+    start = dt.datetime(2020, 1, 2, 10)
+    for i, decay in enumerate((600, 60, None, 3600 * 25), 1):
+        order = ou.OrderHandler(i, 1, ou.LONG, 'EURUSD')
+        order.set_timedecay(decay)
+        om._add_order(order)
+        om.set_executed(i, start)
+    # Executed once, orders without time decay are not kept
+    om.set_executed(1, start)
+    assert [order._id for _, _, order in sorted(om._expiries)] == [2, 1, 4]
+
+    order = om.book.get(4)
+    assert not order.check_timedecay(start + dt.timedelta(hours=24))
+    assert order.check_timedecay(start + dt.timedelta(hours=25))
+
+def test_pnl():
+    pnl = ou.PnLTracker({'ES':50.})
+    pnl.fill('EURUSD', 2, 1.0)
+    pnl.fill('EURUSD', 2, 1.2)
+    assert np.isclose(pnl.avgprices['EURUSD'], 1.1)
+    pnl.update('EURUSD', 1.3)
+    assert np.isclose(pnl.unrealized['EURUSD'], 0.8)
+
+    # Sells close the position, the rest is a short position
+    pnl.fill('EURUSD', -3, 1.2, commission=0.01)
+    assert np.isclose(pnl.realized['EURUSD'], 0.29)
+    assert np.isclose(pnl.unrealized['EURUSD'], 0.1)
+    pnl.fill('EURUSD', -3, 1.0)
+    assert np.isclose(pnl.realized['EURUSD'], 0.19)
+    assert pnl.positions['EURUSD'] == -2 and pnl.avgprices['EURUSD'] == 1.0
+
+    pnl.fill('ES', -1, 3000.)
+    pnl.update('ES', 2990.)
+    assert np.isclose(pnl.pnl('ES'), 500.)
+    assert pnl.open_symbols() == ['EURUSD', 'ES']
+    assert np.isclose(pnl.pnl(), 500.19)
+    pnl.update('EURUSD', 1.1)
+    assert np.isclose(pnl.pnl(), 499.99)
+    assert np.isclose(pnl.as_dataframe().unrealized.sum(),
+            pnl.total_unrealized)
+
+class Clock(object):
+    def datetime(self, ago):
+        return dt.datetime(2020, 1, 2, 10)
+
+class Data(object):
+    def __init__(self, name, close):
+        self._name = name
+        self.close = [close]
+        self.high = [close]
+        self.low = [close]
+        self.datetime = Clock()
+
+class Strategy(object):
+    def __init__(self, *datas):
+        self.datas = list(datas)
+        self.closed = []
+
+    def getdatanames(self):
+        return [data._name for data in self.datas]
+
+    def getdatabyname(self, name):
+        return [data for data in self.datas if data._name == name][0]
+
+    def close(self, data, price, exectype):
+        self.closed.append(data._name)
+
+def test_live_stops():
+    class Mirror(object):
+        def __init__(self):
+            self.positions = dict()
+
+        def poll(self):
+            pass
+
+        async def start_async(self):
+            self.started = True
+
+        def position(self, conid):
+            return self.positions.get(conid, 0)
+
+    class DataClient(object):
+        def __init__(self):
+            self.mirror = Mirror()
+
+        def getmirror(self, account):
+            return self.mirror
+
+        async def qualify_async(self, names):
+            return {name: SimpleNamespace(conId=i)
+                    for i, name in enumerate(names)}
+
+    eurusd, amd = Data('EURUSD', 1.1), Data('AMD', 30.)
+    st = Strategy(eurusd, amd)
+    dataclient = DataClient()
+    om = ou.OrdersManagement(st, dataclient)
+    # The loop of ib_insync (closed by asyncio.run of other tests)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    # The contracts are qualified by the start, not by the constructor
+    assert om.broker_position('EURUSD') is None
+    om.start()
+    assert dataclient.mirror.started
+    assert om.broker_position('EURUSD') == 0
+    for i, data, side in [(1, eurusd, ou.LONG), (2, amd, ou.SHORT),
+            (3, amd, ou.SHORT)]:
+        order = ou.OrderHandler(i, 1, side, data._name)
+        order.set_stops(*ou.calc_stops(data.close[0], side, 0.01, 0.01,
+            mode=ou.PERCENT))
+        om._add_order(order)
+        if i < 3:
+            om.set_executed(i, data.datetime.datetime(0), data.close[0])
+    dataclient.mirror.positions = {0:1, 1:-1}
+    assert not om.triggers
+
+    # Stops of the executed orders are compared with the closes at once
+    eurusd.close[0] = 1.08
+    amd.close[0] = 30.1
+    om.check_close_conditions()
+    assert st.closed == ['EURUSD']
+    assert om._closing == [om.book.get(1)]
+
+    # The order is closed and its row freed when the broker confirms
+    dataclient.mirror.positions[0] = 0
+    om.check_close_conditions()
+    assert om.book.get(1).closed and om.book.get(1).lot == 1
+    assert len(om.store) == 2 and st.closed == ['EURUSD']
+
+def test_intrabar_stops():
+    eurusd = Data('EURUSD', 1.1)
+    st = Strategy(eurusd)
+    om = ou.OrdersManagement(st, None)
+    order = ou.OrderHandler(1, 1, ou.LONG, 'EURUSD')
+    order.set_stops(*ou.calc_stops(1.1, ou.LONG, 0.01, 0.01,
+        mode=ou.PERCENT))
+    om._add_order(order)
+    om.set_executed(1, eurusd.datetime.datetime(0), 1.1)
+
+    # The low of the bar reaches the stop loss, the close doesn't
+    eurusd.low[0] = 1.08
+    om.check_close_conditions()
+    assert st.closed == [] and not order.closed
+
+    om.set_intrabar(True)
+    om.check_close_conditions()
+    assert st.closed == ['EURUSD'] and order.closed
+
+def test_strategy_intrabar():
+    import os
+    import tempfile
+    import backtrader as bt
+    import barfeed
+    import barframe as bf
+    from strategies.fadesystem import FadeSystemIB
+
+    cerebro = bt.Cerebro(stdstats=False)
+    data = barfeed.ArrayData(dataname=bf.BarFrame.from_csv('eurusd.csv'),
+            name='EURUSD', timeframe=bt.TimeFrame.Minutes)
+    cerebro.adddata(data)
+    cerebro.resampledata(data, timeframe=bt.TimeFrame.Minutes,
+            compression=5)
+    cerebro.addstrategy(FadeSystemIB, mp_ticksize=0.0002, intrabar=True)
+    # The orders are saved in the working directory when the strategy stops
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        om = cerebro.run()[0].order_management
+    finally:
+        os.chdir(cwd)
+
+    # The stops of executed orders are checked with the high and the low
+    assert om.intrabar
+    assert len(om.book.closed) > 0
+
+def test_pnl_stops():
+    def fill(data, size):
+        return SimpleNamespace(data=data, executed=SimpleNamespace(
+            size=size, price=data.close[0], comm=0.))
+
+    eurusd, amd = Data('EURUSD', 1.1), Data('AMD', 30.)
+    st = Strategy(eurusd, amd)
+    om = ou.OrdersManagement(st, None)
+    om.set_stoploss({'EURUSD':50., 'AMD':50.})
+    om.set_takeprofit({'EURUSD':100., 'AMD':100.})
+
+    # Realized profit of a previous position is not in the stops
+    om.notify_fill(fill(eurusd, 1000))
+    eurusd.close[0] = 1.4
+    om.notify_fill(fill(eurusd, -1000))
+    assert np.isclose(om.get_pnl('EURUSD'), 300.)
+
+    for i, data, size in [(1, eurusd, 1000), (2, amd, 10)]:
+        order = ou.OrderHandler(i, size, ou.LONG, data._name)
+        om._add_order(order)
+        om.set_executed(i, data.datetime.datetime(0), data.close[0])
+        om.notify_fill(fill(data, size))
+
+    eurusd.close[0] = 1.3
+    amd.close[0] = 35.
+    om.check_close_conditions()
+    assert st.closed == ['EURUSD']
+    assert om.book.get(1).closed and not om.book.get(2).closed
+    assert np.isclose(om.get_unrealized('AMD'), 50.)
+    assert np.isclose(om.get_pnl('EURUSD'), 300. - 100.)
+    om.notify_fill(fill(eurusd, -1000))
+
+    amd.close[0] = 40.
+    om.check_close_conditions()
+    assert st.closed == ['EURUSD', 'AMD']
+    assert len(om.book) == 0
+    assert np.isclose(om.get_pnl(), om.get_pnl('EURUSD') +
+            om.get_pnl('AMD'))
+
+if __name__ == '__main__':
+    test_order_book()
+    test_order_store()
+    test_triggers()
+    test_expiries()
+    test_pnl()
+    test_pnl_stops()
+    test_live_stops()
+    test_intrabar_stops()
+    test_strategy_intrabar()
+    print('Order utils: OK')
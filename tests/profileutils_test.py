@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import pandas as pd
+import numpy as np
+from market_profile import MarketProfile
+
+import os
+import tempfile
+
+import datautils as du
+import profileutils as pu
+import profilestore as ps
+import sessionutils as su
+
+DATAFILE = 'eurusd.csv'
+TICKSIZES = [0.00005, 0.0001, 0.0002]
+VALUEAREAS = [0.25, 0.5, 0.7, 0.75]
+
+def load_sessions(filename=DATAFILE):
+    '''Split the data file in daily Data Frames with the same format
+    of datautils.parsedata
+    '''
+    dataframe = pd.read_csv(filename, parse_dates=['date'])
+    dataframe = dataframe.rename(columns={
+        'date':'datetime',
+        'open':'Open',
+        'high':'High',
+        'low':'Low',
+        'close':'Close',
+        'volume':'Volume',
+        })
+    dataframe = dataframe.set_index('datetime', drop=False)
+    return [day for _, day in dataframe.groupby(dataframe.index.date)]
+
+def library_profile(dataframe, ticksize, valuearea, mode='tpo'):
+    mp = MarketProfile(
+            dataframe,
+            value_area_pct=valuearea,
+            tick_size=ticksize,
+            open_range_size=pd.to_timedelta(1, 'D'),
+            initial_balance_delta=pd.to_timedelta(1, 'h'),
+            mode=mode)
+    return mp[0:len(dataframe.index)]
+
+def test_parity_with_library():
+    for session in load_sessions():
+        for ticksize in TICKSIZES:
+            for valuearea in VALUEAREAS:
+                expected = library_profile(session, ticksize, valuearea)
+                result = pu.build_profile(session, ticksize, valuearea)
+
+                assert result.value_area == expected.value_area
+                assert result.open_range() == expected.open_range()
+                assert result.initial_balance() == expected.initial_balance()
+                assert result.poc_price == expected.poc_price
+                assert result.profile.equals(expected.profile)
+
+def test_value_areas():
+    for session in load_sessions():
+        for ticksize in TICKSIZES:
+            result = pu.build_profile(session, ticksize).value_areas(
+                    VALUEAREAS)
+            expected = [library_profile(session, ticksize, valuearea
+                ).value_area for valuearea in VALUEAREAS]
+            assert result == expected
+
+def test_session_profiles():
+    dataframe = pd.read_csv(DATAFILE)
+    sessions = load_sessions()
+    for bins in [pu.BINS_CLOSE, pu.BINS_RANGE]:
+        table = du.generatesessionprofiles(dataframe, 0.0001, VALUEAREAS,
+                bins=bins)
+        assert len(table.index) == len(sessions) * len(VALUEAREAS)
+
+        for row in table.itertuples():
+            session = sessions[row.Index // len(VALUEAREAS)]
+            expected = pu.build_profile(session, 0.0001, row.valuearea,
+                    bins=bins)
+
+            assert row.session_start == session.index[0]
+            assert row.open == session['Open'].iloc[0]
+            assert (row.val, row.vah) == expected.value_area
+            assert row.poc == expected.poc_price
+            assert (row.or_low, row.or_high) == expected.open_range()
+
+def test_range_bins():
+    high = np.array([1.0004, 1.0002])
+    low = np.array([1.0, 1.0001])
+    close = np.array([1.0002, 1.0002])
+    histogram = pu.ProfileHistogram.from_bars(high, low, close,
+            ticksize=0.0001, bins=pu.BINS_RANGE)
+
+    assert histogram.tpo.tolist() == [1, 2, 2, 1, 1]
+    assert histogram.rows().tolist() == list(range(10000, 10005))
+
+def test_accumulator():
+    for session in load_sessions():
+        for bins in [pu.BINS_CLOSE, pu.BINS_RANGE]:
+            expected = pu.build_profile(session, 0.0001, 0.7, bins=bins)
+
+            accumulator = pu.ProfileAccumulator(0.0001, bins=bins)
+            for row in session.itertuples():
+                accumulator.update(row.Index, row.Open, row.High, row.Low,
+                        row.Close, row.Volume)
+            result = accumulator.profile_slice(0.7)
+
+            assert result.value_area == expected.value_area
+            assert result.poc_price == expected.poc_price
+            assert result.open_range() == expected.open_range()
+            assert accumulator.levels(0.7) == \
+                    expected.value_area + (expected.poc_price,)
+
+def test_profile_store():
+    session = load_sessions()[1]
+    expected = pu.build_profile(session, 0.0002, 0.7)
+    directory = tempfile.mkdtemp()
+
+    store = ps.ProfileStore(directory, maxsize=1)
+    key = store.key('EURUSD', session.index[0], 0.0002, pu.TPO,
+            pu.BINS_CLOSE, ps.data_fingerprint(session))
+    assert store.get(key) is None
+    store.put(key, expected)
+    assert store.get(key) is expected
+
+    # Profiles of other bins have other keys
+    assert store.key('EURUSD', session.index[0], 0.0002, pu.TPO,
+            pu.BINS_RANGE, ps.data_fingerprint(session)) != key
+
+    # New store reads the profile from disk
+    result = ps.ProfileStore(directory).get(key)
+    assert result.value_area == expected.value_area
+    assert result.open_range() == expected.open_range()
+    assert result.profile.equals(expected.profile)
+
+    # The same histogram is used for other value areas
+    result = store.get(key, 0.5)
+    assert result.value_area == pu.build_profile(session, 0.0002,
+            0.5).value_area
+
+def test_session_profiles_store():
+    dataframe = pd.read_csv(DATAFILE)
+    directory = tempfile.mkdtemp()
+    expected = du.generatesessionprofiles(dataframe, 0.0001, VALUEAREAS)
+
+    store = ps.ProfileStore(directory)
+    result = du.generatesessionprofiles(dataframe, 0.0001, VALUEAREAS,
+            store=store, name='EURUSD')
+    assert result.equals(expected)
+    assert len(store._profiles) == len(load_sessions())
+
+    # Profiles of the sessions are read from disk
+    result = du.generatesessionprofiles(dataframe, 0.0001, VALUEAREAS,
+            store=ps.ProfileStore(directory), name='EURUSD')
+    assert result.equals(expected)
+
+def test_session_fingerprints():
+    dataframe = pd.read_csv(DATAFILE, parse_dates=['date'])
+    columns = [dataframe[column].values for column in
+            ['date', 'open', 'high', 'low', 'close', 'volume']]
+    starts, expected = ps.session_fingerprints(*columns)
+    assert len(set(expected)) == len(load_sessions())
+
+    # A new bar changes only the fingerprint of the last session
+    starts, result = ps.session_fingerprints(*[column[:-1]
+        for column in columns])
+    assert result[:-1] == expected[:-1] and result[-1] != expected[-1]
+
+    # Only the histograms of the last session are generated again
+    store = ps.ProfileStore()
+    histograms = store.session_histograms('EURUSD', *[column[:-1]
+        for column in columns], ticksize=0.0001)
+    result = store.session_histograms('EURUSD', *columns, ticksize=0.0001)
+    assert all(result[i] is histograms[i] for i in range(len(result) - 1))
+    assert result[-1] is not histograms[-1]
+    assert len(store._profiles) == len(result) + 1
+
+def test_signals_profile_store():
+    from strategies.fadesystemsignals import TradeSignalsHandler
+
+    sessions = load_sessions()
+    bars = pd.concat(sessions)
+    store = ps.ProfileStore(tempfile.mkdtemp())
+
+    def run():
+        handler = TradeSignalsHandler('EURUSD', 0., 0., 0.0001,
+                profile_store=store)
+        starts, fingerprints = ps.session_fingerprints(bars.index.values,
+                bars['Open'], bars['High'], bars['Low'], bars['Close'],
+                bars['Volume'])
+        handler.session_fingerprints = dict(zip(pd.DatetimeIndex(starts),
+            fingerprints))
+        levels = []
+        for row in bars.itertuples():
+            handler.next(row.Index.to_pydatetime(), 0., row.Open, row.High,
+                    row.Low, row.Close, row.Volume)
+            if handler._finished_profile is not None and (len(levels) == 0
+                    or levels[-1][0] != handler._finished_date):
+                handler.finish_mp()
+                levels.append((handler._finished_date,
+                    handler.profile_slice.value_area))
+        return handler, levels
+
+    handler, expected = run()
+    assert [value_area for _, value_area in expected] == [
+            pu.build_profile(session, 0.0001, 0.7).value_area
+            for session in sessions[:-1]]
+
+    # Stored sessions are not accumulated again
+    handler, result = run()
+    assert result == expected
+    assert len(handler._finished_profile.histogram.tpo) == 0
+
+def test_volume_profile():
+    high = np.array([1.0004, 1.0002, 1.0003])
+    low = np.array([1.0, 1.0001, 1.0003])
+    close = np.array([1.0002, 1.0002, 1.0003])
+    volume = np.array([50., 10., 100.])
+
+    histogram = pu.ProfileHistogram.from_bars(high, low, close, volume,
+            ticksize=0.0001, bins=pu.BINS_RANGE)
+    assert np.allclose(histogram.weights(pu.VOL), [10, 15, 15, 110, 10])
+
+    # Same volume added bar by bar
+    accumulator = pu.ProfileAccumulator(0.0001, bins=pu.BINS_RANGE)
+    for i in range(len(close)):
+        accumulator.update(pd.Timestamp(2019, 9, 2, 0, i), close[i],
+                high[i], low[i], close[i], volume[i])
+    assert np.allclose(accumulator.histogram.weights(pu.VOL),
+            histogram.weights(pu.VOL))
+    assert accumulator.levels(0.5, pu.VOL)[2] == histogram.prices(
+            np.array([10003]))[0]
+
+    # Missing volume (IB MIDPOINT data) uses TPO count
+    histogram = pu.ProfileHistogram.from_bars(high, low, close, -volume,
+            ticksize=0.0001, bins=pu.BINS_RANGE)
+    assert histogram.weights(pu.VOL).tolist() == \
+            histogram.weights(pu.TPO).tolist()
+
+def test_volume_parity_with_library():
+    for session in load_sessions()[:3]:
+        session = session.assign(Volume=np.arange(len(session.index)) % 7)
+        expected = library_profile(session, 0.0001, 0.7, mode='vol')
+        result = pu.build_profile(session, 0.0001, 0.7, mode=pu.VOL)
+        assert result.value_area == expected.value_area
+        assert result.poc_price == expected.poc_price
+
+def test_composite_profile():
+    sessions = load_sessions()
+    composite = pu.CompositeProfile(0.0001, sessions=3)
+    for i, session in enumerate(sessions):
+        accumulator = pu.ProfileAccumulator(0.0001)
+        for row in session.itertuples():
+            accumulator.update(row.Index, row.Open, row.High, row.Low,
+                    row.Close, row.Volume)
+        composite.push(accumulator)
+
+        window = pd.concat(sessions[max(0, i - 2):i + 1])
+        expected = pu.build_profile(window, 0.0001, 0.7)
+        result = composite.profile_slice(0.7)
+        assert result.value_area == expected.value_area
+        assert result.poc_price == expected.poc_price
+        assert result.profile.equals(expected.profile)
+
+def test_signals_profile_table():
+    from strategies.fadesystemsignals import TradeSignalsHandler
+
+    dataframe = pd.read_csv(DATAFILE, parse_dates=['date'])
+    times = dataframe['date'].values
+    calendar = su.SessionCalendar.from_name('fx')
+    index = calendar.index(times)
+    table = du.generatesessionprofiles(dataframe, 0.0001, 0.7,
+            calendar=calendar)
+
+    # Sessions of the fx calendar start on the previous evening
+    handler = TradeSignalsHandler('EURUSD', 0., 0., 0.0001,
+            profile_table=table, calendar=calendar)
+    levels = []
+    for i, row in enumerate(dataframe.itertuples()):
+        new_session = bool(index.flags[i] & su.NEW_SESSION)
+        handler.next(row.date.to_pydatetime(), 0., row.open, row.high,
+                row.low, row.close, row.volume, new_session=new_session)
+        if new_session and i > 0:
+            handler.finish_mp()
+            levels.append(handler.profile_slice.value_area)
+
+    expected = list(zip(table['val'], table['vah']))[:-1]
+    assert len(expected) > 0 and levels == expected
+
+    # Tables of other bins are not used
+    assert (table['bins'] == pu.BINS_CLOSE).all()
+    handler = TradeSignalsHandler('EURUSD', 0., 0., 0.0001,
+            bins=pu.BINS_RANGE, profile_table=table, calendar=calendar)
+    assert handler._read_profile_table(table) is None
+    assert handler._read_profile_table(du.generatesessionprofiles(
+        dataframe, 0.0001, 0.7, bins=pu.BINS_RANGE,
+        calendar=calendar)) is not None
+
+def run_strategy(bars, table=None, **params):
+    '''Run FadeSystemIB on the bars resampled to 5 minutes, like the
+    backtest scripts, and keep the levels used for signals at every
+    session in the attribute 'levels' of the strategy.
+    '''
+    import backtrader as bt
+    import barfeed
+    from strategies.optparams import PROFILE_TABLES
+    from strategies.fadesystem import FadeSystemIB
+
+    class LevelsStrategy(FadeSystemIB):
+        def start(self):
+            super().start()
+            self.levels = []
+
+        def next(self):
+            super().next()
+            profile_slice = self.signals_handler.profile_slice
+            if profile_slice is not None and (len(self.levels) == 0 or
+                    self.levels[-1] is not profile_slice):
+                self.levels.append(profile_slice)
+
+    cerebro = bt.Cerebro(stdstats=False)
+    data = barfeed.ArrayData(dataname=bars, name='EURUSD',
+            timeframe=bt.TimeFrame.Minutes)
+    cerebro.adddata(data)
+    cerebro.resampledata(data, timeframe=bt.TimeFrame.Minutes,
+            compression=5)
+    cerebro.addstrategy(LevelsStrategy, **params)
+    if table is not None:
+        PROFILE_TABLES['EURUSD'] = table
+    # The orders are saved in the working directory when the strategy stops
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        return cerebro.run()[0]
+    finally:
+        os.chdir(cwd)
+        PROFILE_TABLES.pop('EURUSD', None)
+
+def test_strategy_profile_table():
+    import barframe as bf
+
+    bars = bf.BarFrame.from_csv(DATAFILE)
+    table = du.generatesessionprofiles(bars.to_dataframe(), 0.0002, 0.7,
+            calendar=su.SessionCalendar.from_name('fx'))
+
+    # The first session of the strategy starts after the indicators
+    # warmup, the table has the first bar of the data
+    strategy = run_strategy(bars, table, mp_ticksize=0.0002,
+            session_calendar='fx')
+
+    expected = list(zip(table['val'], table['vah']))[:-1]
+    assert len(expected) > 0
+    assert [level.value_area for level in strategy.levels] == expected
+
+def test_strategy_profile_store():
+    import barframe as bf
+
+    bars = bf.BarFrame.from_csv(DATAFILE)
+    directory = tempfile.mkdtemp()
+
+    # Resampled data is not preloaded, the sessions of the array feed
+    # are stored
+    expected = run_strategy(bars, mp_ticksize=0.0002, mp_store=directory)
+    assert len(os.listdir(directory)) == len(expected.levels) - 1
+
+    ps.getstore(directory).clear()
+    result = run_strategy(bars, mp_ticksize=0.0002, mp_store=directory)
+    assert [level.value_area for level in result.levels] == \
+            [level.value_area for level in expected.levels]
+    handler = result.signals_handler
+    assert handler._finished_slice is not None
+    assert len(handler._finished_profile.histogram.tpo) == 0
+
+if __name__ == '__main__':
+    test_parity_with_library()
+    test_value_areas()
+    test_session_profiles()
+    test_range_bins()
+    test_accumulator()
+    test_profile_store()
+    test_session_profiles_store()
+    test_session_fingerprints()
+    test_signals_profile_store()
+    test_signals_profile_table()
+    test_strategy_profile_table()
+    test_strategy_profile_store()
+    test_volume_profile()
+    test_volume_parity_with_library()
+    test_composite_profile()
+    print('Market Profile parity: OK')
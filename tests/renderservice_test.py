@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import os
+import queue
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+import renderservice as rs
+
+def daemon_submit(directory, results):
+    service = rs.RenderService(directory)
+    profile = pd.Series([1., 3., 2.], index=[1.0999, 1.1, 1.1001])
+    results.put((service.profile(profile, (1.0999, 1.1001), 1.1, 0.0001,
+        'EURUSD_tpo'), service.enabled, service.skipped))
+
+def test_daemon():
+    # Workers of optimizations don't render in the hot path
+    directory = tempfile.mkdtemp()
+    results = mp.Queue()
+    process = mp.Process(target=daemon_submit, args=(directory, results),
+            daemon=True)
+    process.start()
+    assert results.get(timeout=60) == (False, False, 1)
+    process.join()
+    assert os.listdir(directory) == []
+
+def test_render():
+    directory = tempfile.mkdtemp()
+    filename = rs.chart_filename(directory, 'EURUSD_tpo')
+    assert rs.render(rs.PROFILE, {'filename':filename,
+        'prices':np.array([1.0999, 1.1, 1.1001]),
+        'weights':np.array([1., 3., 2.]),
+        'val':1.0999, 'vah':1.1001, 'open_price':1.1, 'ticksize':0.0001})
+    assert os.path.isfile(filename)
+
+    # Render errors don't stop the worker
+    assert not rs.render(rs.ORDERS, {'filename':filename, 'title':'EURUSD'})
+
+def test_disabled():
+    service = rs.RenderService(tempfile.mkdtemp(), enabled=False)
+    profile = pd.Series([1., 3., 2.], index=[1.0999, 1.1, 1.1001])
+    assert not service.profile(profile, (1.0999, 1.1001), 1.1, 0.0001,
+            'EURUSD_tpo')
+    assert service._process is None and service.skipped == 1
+
+    # Empty sessions are not sent
+    assert not service.profile(pd.Series([], dtype=np.float64), None, 1.1,
+            0.0001, 'empty')
+
+def test_full_queue():
+    class Process(object):
+        pass
+
+    service = rs.RenderService(tempfile.mkdtemp(), maxsize=1)
+    # Worker process not started, the queue is never consumed
+    service._process = Process()
+    service._requests = queue.Queue(service.maxsize)
+
+    profile = pd.Series([1., 3., 2.], index=[1.0999, 1.1, 1.1001])
+    assert service.profile(profile, (1.0999, 1.1001), 1.1, 0.0001, 'first')
+    assert not service.profile(profile, (1.0999, 1.1001), 1.1, 0.0001,
+            'second')
+    assert service.dropped == 1
+    assert service._requests.get_nowait()[1]['filename'].endswith('first.png')
+
+if __name__ == '__main__':
+    test_daemon()
+    test_render()
+    test_disabled()
+    test_full_queue()
+    print('Render service: OK')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+sys.path.append('../source/')
+
+import datetime as dt
+
+import pandas as pd
+import numpy as np
+
+import sessionutils as su
+
+DATAFILE = 'eurusd.csv'
+
+def load_times(filename=DATAFILE):
+    return pd.DatetimeIndex(pd.read_csv(filename)['date']).values
+
+def test_day_calendar():
+    times = load_times()
+    calendar = su.SessionCalendar(starttime=dt.time(1, 0),
+            finaltime=dt.time(15, 0), closetime=dt.time(16, 0))
+    index = calendar.index(times)
+
+    days = times.astype('datetime64[D]')
+    assert (index.keys == days).all()
+    assert len(index.starts) == len(np.unique(days))
+
+    hours = pd.DatetimeIndex(times).hour
+    assert ((index.flags & su.MAY_OPEN > 0) ==
+            ((hours >= 1) & (hours < 15))).all()
+    assert ((index.flags & su.MUST_FLATTEN > 0) == (hours >= 16)).all()
+
+    # Same flags bar by bar
+    for i in range(1, len(times), 97):
+        previous = pd.Timestamp(times[i - 1]).to_pydatetime()
+        now = pd.Timestamp(times[i]).to_pydatetime()
+        assert calendar.flags(now, previous) == index.flags[i]
+
+    start, end = index.bounds(len(times) - 1)
+    assert end == len(times)
+    assert (days[start:end] == days[-1]).all()
+
+def test_fx_calendar():
+    # 17:00 New York is 21:00 UTC in daylight saving time
+    times = pd.date_range('2019-09-02 20:58', periods=4, freq='min').values
+    calendar = su.SessionCalendar.from_name('fx',
+            finaltime=dt.time(15, 0), closetime=dt.time(16, 0))
+    index = calendar.index(times)
+
+    # First bar always starts a session
+    assert index.flags.tolist() == [su.NEW_SESSION | su.MUST_FLATTEN,
+            su.MUST_FLATTEN,
+            su.NEW_SESSION | su.MAY_OPEN, su.MAY_OPEN]
+    assert index.session_start(3) == times[2]
+
+def test_session_clock():
+    # Bars around the change of daylight saving time of New York
+    times = pd.date_range('2019-10-31', '2019-11-06', freq='7min').values
+    for name in ('day', 'fx', 'us_stocks'):
+        calendar = su.SessionCalendar.from_name(name,
+                starttime=dt.time(1, 0), finaltime=dt.time(15, 0),
+                closetime=dt.time(16, 0))
+        index = calendar.index(times)
+        clock = calendar.clock()
+        flags = [clock.flags(pd.Timestamp(time).to_pydatetime())
+                for time in times]
+        assert flags == index.flags.tolist()
+        # Same bar again
+        assert clock.flags(pd.Timestamp(times[-1]).to_pydatetime()) == \
+                index.flags[-1]
+
+    # The previous bar is used by the first bar of the clock
+    clock = calendar.clock()
+    assert clock.flags(pd.Timestamp(times[1]).to_pydatetime(),
+            pd.Timestamp(times[0]).to_pydatetime()) == index.flags[1]
+
+if __name__ == '__main__':
+    test_day_calendar()
+    test_fx_calendar()
+    test_session_clock()
+    print('Session calendar: OK')